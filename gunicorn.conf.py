@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, read with `gunicorn -c gunicorn.conf.py` (see Procfile).
+
+With ASYNC_VIEWS off the site runs as WSGI on threaded sync workers. With it
+on, it runs as ASGI on uvicorn workers: each worker is one event loop that
+keeps accepting requests while others wait on the database or the cache, so
+fewer workers are needed. Any of these can be overridden with the usual
+GUNICORN_CMD_ARGS or the environment variables below.
+"""
+import multiprocessing
+import os
+
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False').lower() in ('1', 'true', 'yes', 'on')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+if ASYNC_VIEWS:
+    wsgi_app = 'myproject_ecom.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'myproject_ecom.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Recycle workers now and then so slow leaks can't build up
+max_requests = 1000
+max_requests_jitter = 100
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
@@ -0,0 +1,24 @@
+"""
+Settings profile for benchmark runs:
+
+    python manage.py benchmark_views --settings=myproject_ecom.settings_bench
+
+Same stack as production (DEBUG off, persistent connections, DATABASE_URL if
+set) but without the development-only overhead that would skew the numbers.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+# Budgets are reported by the benchmark itself; never turn a slow view into a 500
+QUERY_BUDGET_RAISE = False
+LOGGING['loggers']['store.perf']['level'] = 'ERROR'  # noqa: F405
+
+# Logging in the benchmark shopper shouldn't cost a full PBKDF2 round
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Keep benchmark data away from the development database and the test suite's
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'bench.sqlite3'}  # noqa: F405
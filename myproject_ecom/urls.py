@@ -16,9 +16,10 @@ Including another URLconf
 """
 # myproject/urls.py
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.static import serve
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -29,4 +30,11 @@ urlpatterns = [
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+# Under ASYNC_VIEWS there is no WhiteNoise middleware: serve the collected static files
+# here (better still, from a CDN or the front proxy)
+if settings.ASYNC_VIEWS:
+    urlpatterns += [
+        re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
+    ]
+
     
\ No newline at end of file
@@ -1,8 +1,80 @@
 # store/admin.py
+import datetime
+
 from django.contrib import admin
-from .models import Product, Order, OrderItem, Category # Import Category
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.urls import path
+from django.utils import timezone
+
+from . import exports
+from .models import Product, Order, OrderItem, Category, PaymentEvent, ShippingAddress # Import Category
 
 admin.site.register(Category) 
 admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+admin.site.register(ShippingAddress)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'customer', 'date_ordered', 'complete', 'status', 'payment_method', 'item_count', 'subtotal')
+    list_filter = ('complete', 'status', 'payment_method')
+    list_select_related = ('customer__user',)
+    date_hierarchy = 'date_ordered'
+    search_fields = ('id', 'transaction_id', 'razorpay_order_id')
+    def get_urls(self):
+        urls = [
+            path('export/', self.admin_site.admin_view(self.export_view), name='store_order_export'),
+        ]
+        return urls + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        # For the export form in templates/admin/store/order/change_list.html
+        extra_context = {**(extra_context or {}), 'export_formats': exports.FORMATS, 'statuses': Order.STATUSES}
+        return super().changelist_view(request, extra_context)
+
+    def export_view(self, request):
+        """
+        Streams completed orders as CSV or JSON Lines, one row per order line:
+        ?format=csv|jsonl&date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&status=Paid
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        format = request.GET.get('format') or 'csv'
+        status = request.GET.get('status') or None
+        try:
+            date_from, date_to = (
+                datetime.date.fromisoformat(value) if value else None
+                for value in (request.GET.get('date_from'), request.GET.get('date_to'))
+            )
+        except ValueError:
+            return HttpResponseBadRequest('Dates must be given as YYYY-MM-DD.')
+        if format not in exports.FORMATS:
+            return HttpResponseBadRequest(f'Unknown export format {format!r}.')
+        if status and status not in dict(Order.STATUSES):
+            return HttpResponseBadRequest(f'Unknown order status {status!r}.')
+
+        rows = exports.order_rows(exports.export_queryset(date_from, date_to, status))
+        content_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(exports.export_lines(rows, format), content_type=f'{content_type}; charset=utf-8')
+        filename = f'orders-{timezone.now():%Y%m%d-%H%M%S}.{format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    """Webhook events are append-only: browsable, never edited here."""
+    list_display = ('event', 'event_id', 'received_at', 'processed_at', 'result')
+    list_filter = ('event', 'result')
+    search_fields = ('event_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,200 @@
+# store/async_views.py
+"""
+Async versions of the catalogue, cart and payment gateway views, served when
+settings.ASYNC_VIEWS is on and the site runs under ASGI (see gunicorn.conf.py).
+
+They render the same templates and JSON as their counterparts in views.py and
+share their helpers. Lookups that don't depend on each other, such as the
+product page, the category list, the facet cube and the cart on the home page,
+are awaited together with asyncio.gather(), so their cache round trips
+overlap. Django's async ORM still hands each query to a thread, one at a time
+per request, so a single request gets little faster; the gain is that a worker
+keeps serving other requests while one waits on the database or the cache.
+Templates and cart writes (which need transactions) run through sync_to_async().
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+from django.views.decorators.http import require_POST
+
+from . import cart, facets, guest_cart, payments, suggestions
+from .catalogue_cache import acached_catalogue
+from .models import Category, OrderItem, Product
+from .pagination import akeyset_page
+from .utils import acart_data
+from .views import (
+    CART_ACTIONS, amount_in_paise, cart_json, catalogue_request, get_current_order, guest_cart_response,
+    guest_quantity, home_context, money, parse_quantity, payment_gateway_context, payment_setup_failed,
+)
+
+arender = sync_to_async(render)
+
+
+async def catalogue_page(request, category_slug=None):
+    """views.catalogue_page() for async views."""
+    queryset, sort, after, filters, parts = catalogue_request(request, category_slug)
+    products, next_cursor = await acached_catalogue(parts, lambda: akeyset_page(queryset, sort, after))
+    return products, next_cursor, sort, filters
+
+
+async def all_categories():
+    return [category async for category in Category.objects.all()]
+
+
+async def all_products(queryset):
+    return [product async for product in queryset]
+
+
+async def home(request, category_slug=None):
+    # Load the user once here, so the cart and the templates don't each fetch it
+    request.user = await request.auser()
+
+    page, categories, cube, suggested_products, data = await asyncio.gather(
+        catalogue_page(request, category_slug),
+        acached_catalogue(('categories',), all_categories),
+        facets.afacet_cube(),
+        # Products for Suggested/Featured Section (e.g., last 4 products)
+        all_products(Product.objects.order_by('-id')[:4]),
+        acart_data(request),
+    )
+
+    context = home_context(request, category_slug, page, categories, cube, suggested_products, data)
+    return await arender(request, 'store/index.html', context)
+
+
+async def product_detail(request, product_id):
+    # Same cache entry as views.product_detail
+    async def build_detail():
+        product = await Product.objects.select_related('category').filter(pk=product_id).afirst()
+        if product is None:
+            return None
+        return {
+            'product': product,
+            'suggested_products': await sync_to_async(suggestions.suggested_products)(product),
+        }
+
+    request.user = await request.auser()
+    context, data = await asyncio.gather(
+        acached_catalogue(('product', product_id), build_detail),
+        acart_data(request),
+    )
+    if context is None:
+        raise Http404('No Product matches the given query.')
+    return await arender(request, 'store/product_detail.html', context)
+
+
+async def cart_view(request):
+    request.user = await request.auser()
+    data = await acart_data(request)
+    context = {
+        'items': data['items'],
+        'order': data['order'],
+    }
+    return await arender(request, 'store/cart.html', context)
+
+
+# --- CART JSON API ---
+# Cart writes lock the order row and run in a transaction (see cart.py), which
+# Django only supports from sync code, so they go through sync_to_async.
+
+@sync_to_async
+def apply_cart_action(order, product, action, quantity):
+    if action == 'add':
+        cart.add_item(order, product, quantity)
+    elif action == 'set':
+        cart.set_quantity(order, product, quantity)
+    else:
+        cart.remove_item(order, product)
+    return cart_json(order, product)
+
+
+@require_POST
+async def updateCartAjax(request):
+    """views.updateCartAjax() for async views."""
+    request.user = await request.auser()
+
+    try:
+        payload = json.loads(request.body)
+        action = payload['action']
+        product_id = int(payload['productId'])
+        quantity = parse_quantity(payload.get('quantity'), 1)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid cart update.'}, status=400)
+    if action not in CART_ACTIONS:
+        return JsonResponse({'error': f'Unknown action {action!r}.'}, status=400)
+
+    product, data = await asyncio.gather(
+        Product.objects.filter(pk=product_id).afirst(),
+        acart_data(request),
+    )
+    if product is None:
+        return JsonResponse({'error': 'Product not found.'}, status=404)
+
+    if not request.user.is_authenticated:
+        quantities = dict(guest_cart.read_cart(request))
+        quantities[product.id] = guest_quantity(quantities.get(product.id, 0), action, quantity)
+        return await sync_to_async(guest_cart_response)(request, quantities, product)
+
+    return JsonResponse(await apply_cart_action(data['order'], product, action, quantity))
+
+
+@require_POST
+async def updateCartBulkAjax(request):
+    """views.updateCartBulkAjax() for async views."""
+    request.user = await request.auser()
+
+    try:
+        rows = json.loads(request.body)['items']
+        requested = {int(row['productId']): int(row['quantity']) for row in rows}
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid cart update.'}, status=400)
+
+    products, data = await asyncio.gather(
+        Product.objects.ain_bulk(list(requested)),
+        acart_data(request),
+    )
+    missing = sorted(set(requested) - set(products))
+    if missing:
+        return JsonResponse({'error': 'Product not found.', 'product_ids': missing}, status=404)
+
+    if not request.user.is_authenticated:
+        quantities = {**guest_cart.read_cart(request), **requested}
+        return await sync_to_async(guest_cart_response)(request, quantities, lines=True)
+
+    order = data['order']
+    await sync_to_async(cart.bulk_update)(order, {products[pk]: quantity for pk, quantity in requested.items()})
+
+    response = cart_json(order)
+    response['lines'] = [
+        {'product_id': item.product_id, 'quantity': item.quantity, 'line_total': money(item.get_total)}
+        async for item in OrderItem.objects.for_order(order)
+    ]
+    return JsonResponse(response)
+
+
+# --- PAYMENT ---
+
+async def process_razorpay_payment(request):
+    """
+    views.process_razorpay_payment() for async views: while the gateway
+    creates the order, the worker goes on serving other requests.
+    """
+    request.user = await request.auser()
+    order, shipping_address = await sync_to_async(get_current_order)(request)
+
+    if not order or not shipping_address:
+        messages.error(request, "Order not found.")
+        return redirect('store:checkout')
+
+    amount = amount_in_paise(order)
+    try:
+        razorpay_order_id = await payments.get_gateway().acreate_order(order, amount)
+    except payments.PaymentGatewayError as exc:
+        return payment_setup_failed(request, exc)
+
+    context = payment_gateway_context(order, shipping_address, razorpay_order_id, amount)
+    return await arender(request, 'store/payment_gateway.html', context)
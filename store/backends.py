@@ -0,0 +1,48 @@
+# store/backends.py
+"""
+Authentication backend that makes loading the logged-in user cheap.
+
+AuthenticationMiddleware loads request.user on every request; the default
+backend does that with one query, and the shopper's Customer profile costs a
+second one as soon as a view touches user.customer. CachedUserBackend loads
+both together (select_related) and keeps the result in the cache for
+settings.AUTH_USER_CACHE_TIMEOUT seconds, so most logged-in requests load
+the user with no query at all.
+
+The entry is keyed by user id and dropped whenever the User or its Customer
+is saved or deleted (see signals.py). Password changes, deactivation and
+last_login updates therefore take effect at once. Bulk queryset updates
+bypass the signals, so they only show up once the timeout expires.
+
+Invalidation only reaches other workers through a shared cache, so settings
+enables this backend only when REDIS_URL is set.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    """Drops a user from the cache; the next request loads it from the database again."""
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedUserBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key, _MISSING)
+        if user is _MISSING:
+            UserModel = get_user_model()
+            try:
+                user = UserModel._default_manager.select_related('customer').get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+        return user if self.user_can_authenticate(user) else None
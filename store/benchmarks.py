@@ -0,0 +1,319 @@
+# store/benchmarks.py
+"""
+Request-level benchmarks for the storefront views.
+
+Drives the views through the Django test client against a seeded database and
+reports latency percentiles, query counts and rows fetched per scenario.
+Results can be saved as JSON and compared against a stored baseline; see the
+benchmark_views management command.
+
+The throughput benchmark compares one worker of each kind: the sync views
+served one request at a time (a sync WSGI worker) against the async views
+(settings.ASYNC_VIEWS) serving `concurrency` requests at once on one event
+loop (a uvicorn worker).
+"""
+import asyncio
+import importlib
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import clear_url_caches, reverse
+
+from .models import Category, Customer, Order, OrderItem, Product, ShippingAddress
+
+BENCH_USERNAME = 'bench_shopper'
+CART_LINES = 10
+# The scenarios with an async implementation (see store/async_views.py)
+THROUGHPUT_SCENARIOS = ('home', 'category_filter', 'product_detail', 'cart_view')
+
+
+@dataclass
+class Scenario:
+    name: str
+    url: str
+    method: str = 'get'
+    data: dict = field(default_factory=dict)
+    authenticated: bool = False
+
+    @property
+    def key(self):
+        return f"{self.name}[{'auth' if self.authenticated else 'anon'}]"
+
+
+@dataclass
+class Result:
+    status: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    queries: int
+    rows: int
+    error: str = ''
+
+
+@dataclass
+class Throughput:
+    requests: int
+    concurrency: int
+    seconds: float
+    requests_per_second: float
+    p50_ms: float
+    p95_ms: float
+    errors: int
+
+
+def seed_fixtures():
+    """
+    Creates the shopper the authenticated scenarios run as: an open cart with
+    CART_LINES lines, a shipping address and a completed order. Call it after
+    the catalogue has been generated.
+    """
+    user = User.objects.create_user(BENCH_USERNAME, 'bench@example.com', 'bench-password')
+    customer = Customer.objects.create(user=user, name='Bench Shopper', email='bench@example.com')
+    products = list(Product.objects.order_by('id')[:CART_LINES])
+
+    completed = Order.objects.create(customer=customer, complete=True, status='Paid', payment_method='COD',
+                                     transaction_id='BENCH-1')
+    OrderItem.objects.bulk_create(OrderItem(order=completed, product=p, quantity=1) for p in products)
+    completed.update_totals()
+
+    cart = Order.objects.create(customer=customer)
+    OrderItem.objects.bulk_create(OrderItem(order=cart, product=p, quantity=2) for p in products)
+    cart.update_totals()
+
+    ShippingAddress.objects.create(
+        customer=customer, order=cart, name='Bench Shopper', email='bench@example.com',
+        address='1 Benchmark Way', city='Perf City', state='Load', zipcode='00000',
+    )
+    return user
+
+
+def default_scenarios():
+    product = Product.objects.order_by('id').first()
+    category = Category.objects.order_by('id').first()
+    scenarios = []
+    for authenticated in (False, True):
+        scenarios += [
+            Scenario('home', reverse('store:home'), authenticated=authenticated),
+            Scenario('category_filter', reverse('store:category_filter', args=[category.slug]), authenticated=authenticated),
+            Scenario('product_detail', reverse('store:product_detail', args=[product.id]), authenticated=authenticated),
+            Scenario('search', reverse('store:search'), data={'q': product.name.split()[0]}, authenticated=authenticated),
+            Scenario('cart_view', reverse('store:cart'), authenticated=authenticated),
+            Scenario('checkout_view', reverse('store:checkout'), authenticated=authenticated),
+            # Re-posts the current quantity, so every iteration does the same work
+            Scenario('updateCartPage', reverse('store:update_cart', args=[product.id]), method='post',
+                     data={'quantity': 2}, authenticated=authenticated),
+        ]
+    # The payment steps only exist for a signed-in customer
+    scenarios += [
+        Scenario('initiate_payment', reverse('store:initiate_payment'), authenticated=True),
+        Scenario('order_complete', reverse('store:order_complete'), authenticated=True),
+        Scenario('view_orders', reverse('store:view_orders'), authenticated=True),
+    ]
+    return scenarios
+
+
+def make_client(authenticated):
+    client = Client(raise_request_exception=False)
+    if authenticated:
+        client.force_login(User.objects.get(username=BENCH_USERNAME))
+        session = client.session
+        session['payment_method'] = 'cod'
+        session.save()
+    return client
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def count_rows(captured):
+    """Re-runs each captured SELECT as a COUNT(*) to learn how many rows it returned."""
+    rows = 0
+    with connection.cursor() as cursor:
+        for sql, params in captured:
+            if sql.lstrip().upper().startswith('SELECT'):
+                cursor.execute(f'SELECT COUNT(*) FROM ({sql}) benchmark_rows', params)
+                rows += cursor.fetchone()[0]
+    return rows
+
+
+def profile(client, scenario):
+    """One instrumented request: (status, query count, rows fetched)."""
+    captured = []
+
+    def record(execute, sql, params, many, context):
+        captured.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with CaptureQueriesContext(connection) as queries, connection.execute_wrapper(record):
+        response = getattr(client, scenario.method)(scenario.url, scenario.data)
+    return response.status_code, len(queries), count_rows(captured)
+
+
+def run_scenario(scenario, iterations, warmup, cold_cache=False):
+    client = make_client(scenario.authenticated)
+    request = getattr(client, scenario.method)
+
+    for _ in range(warmup):
+        request(scenario.url, scenario.data)
+
+    timings = []
+    status = 0
+    for _ in range(iterations):
+        if cold_cache:
+            cache.clear()
+        start = time.perf_counter()
+        response = request(scenario.url, scenario.data)
+        timings.append((time.perf_counter() - start) * 1000)
+        status = response.status_code
+
+    if cold_cache:
+        cache.clear()
+    status, queries, rows = profile(client, scenario)
+    timings.sort()
+    return Result(
+        status=status,
+        p50_ms=round(percentile(timings, 50), 3),
+        p95_ms=round(percentile(timings, 95), 3),
+        p99_ms=round(percentile(timings, 99), 3),
+        mean_ms=round(statistics.fmean(timings), 3),
+        queries=queries,
+        rows=rows,
+        error='' if status < 400 else f'HTTP {status}',
+    )
+
+
+def run_benchmarks(scenarios, iterations, warmup, cold_cache=False):
+    return {
+        scenario.key: asdict(run_scenario(scenario, iterations, warmup, cold_cache))
+        for scenario in scenarios
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Returns a list of regressions against the baseline results: a scenario
+    that now errors, runs more queries, or whose p95 grew by more than
+    `tolerance` (a fraction) and by at least `min_delta_ms`.
+    """
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if result['error'] and not before['error']:
+            regressions.append(f"{key}: now fails with {result['error']}")
+            continue
+        if result['queries'] > before['queries']:
+            regressions.append(f"{key}: queries {before['queries']} -> {result['queries']}")
+        limit = before['p95_ms'] * (1 + tolerance)
+        if result['p95_ms'] > limit and result['p95_ms'] - before['p95_ms'] >= min_delta_ms:
+            regressions.append(f"{key}: p95 {before['p95_ms']:.2f}ms -> {result['p95_ms']:.2f}ms")
+    return regressions
+
+
+def reload_urls():
+    importlib.reload(importlib.import_module('store.urls'))
+    # The project URLconf holds a resolver for store.urls that caches its patterns
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@contextmanager
+def views_mode(async_views):
+    """Serves the store URLs from the sync or the async views for the duration of the block."""
+    try:
+        with override_settings(ASYNC_VIEWS=async_views):
+            reload_urls()
+            yield
+    finally:
+        # Back to the views the settings ask for
+        reload_urls()
+
+
+def make_async_client(authenticated):
+    client = AsyncClient(raise_request_exception=False)
+    # Log in through a sync client and share its session cookie
+    client.cookies = make_client(authenticated).cookies
+    return client
+
+
+def summarize_throughput(timings, errors, concurrency, seconds):
+    timings.sort()
+    return Throughput(
+        requests=len(timings),
+        concurrency=concurrency,
+        seconds=round(seconds, 3),
+        requests_per_second=round(len(timings) / seconds, 1),
+        p50_ms=round(percentile(timings, 50), 3),
+        p95_ms=round(percentile(timings, 95), 3),
+        errors=errors,
+    )
+
+
+def sync_throughput(scenarios, requests):
+    """The sync views, one request at a time."""
+    clients = {authenticated: make_client(authenticated) for authenticated in (False, True)}
+    timings, errors = [], 0
+    start = time.perf_counter()
+    for i in range(requests):
+        scenario = scenarios[i % len(scenarios)]
+        client = clients[scenario.authenticated]
+        sent = time.perf_counter()
+        response = getattr(client, scenario.method)(scenario.url, scenario.data)
+        timings.append((time.perf_counter() - sent) * 1000)
+        errors += response.status_code >= 400
+    return summarize_throughput(timings, errors, 1, time.perf_counter() - start)
+
+
+async def _async_throughput(scenarios, requests, concurrency, clients):
+    timings, errors = [], 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        # Workers share one iterator, so `requests` are sent in total
+        for i in pending:
+            scenario = scenarios[i % len(scenarios)]
+            client = clients[scenario.authenticated]
+            sent = time.perf_counter()
+            response = await getattr(client, scenario.method)(scenario.url, scenario.data)
+            timings.append((time.perf_counter() - sent) * 1000)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize_throughput(timings, errors, concurrency, time.perf_counter() - start)
+
+
+def async_throughput(scenarios, requests, concurrency):
+    """The async views, `concurrency` requests in flight on one event loop."""
+    clients = {authenticated: make_async_client(authenticated) for authenticated in (False, True)}
+    return asyncio.run(_async_throughput(scenarios, requests, concurrency, clients))
+
+
+def run_throughput(scenarios, requests, concurrency, warmup):
+    """
+    Returns {'sync': Throughput, 'async': Throughput} as dicts for the same mix
+    of scenarios, each run after `warmup` untimed passes to fill the caches.
+    """
+    results = {}
+    with views_mode(False):
+        sync_throughput(scenarios, warmup * len(scenarios))
+        results['sync'] = asdict(sync_throughput(scenarios, requests))
+    with views_mode(True):
+        async_throughput(scenarios, warmup * len(scenarios), concurrency)
+        results['async'] = asdict(async_throughput(scenarios, requests, concurrency))
+    return results
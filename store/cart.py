@@ -0,0 +1,117 @@
+# store/cart.py
+"""
+Race-free mutations of a customer's open cart.
+
+Every change runs in one transaction that first locks the Order row
+(SELECT ... FOR UPDATE where the database supports it), changes the line with
+an F() expression or a single UPDATE/DELETE, and refreshes the stored order
+totals. Two tabs or a double-click can therefore never lose an increment.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Order, OrderItem, Product
+
+# The order whose totals the running cart change refreshes itself (see refreshes_totals)
+_refreshing = ContextVar('store_cart_refreshing', default=None)
+
+
+@contextmanager
+def _refreshing_totals(order):
+    token = _refreshing.set(order.pk)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+
+def refreshes_totals(order_id):
+    """Whether a cart change in progress refreshes this order's totals once it is done."""
+    return order_id is not None and _refreshing.get() == order_id
+
+
+def _lock(order):
+    # Serialises concurrent changes to the same cart; a no-op on SQLite, which locks the whole database
+    Order.objects.select_for_update().filter(pk=order.pk).exists()
+
+
+def _apply(order, product, quantity=None, increment=None):
+    """
+    Sets or increments one line; a resulting quantity <= 0 removes it.
+
+    Runs under _lock(), so plain UPDATE/INSERT statements are race-free. They
+    deliberately skip the OrderItem signals: callers refresh the order totals
+    once at the end instead of once per line. Removed lines go through
+    QuerySet.delete(), so post_delete receivers still run, except the totals
+    one (see refreshes_totals).
+    """
+    lines = OrderItem.objects.filter(order=order, product=product)
+    if increment is not None:
+        updated = lines.update(quantity=F('quantity') + increment)
+        if not updated and increment > 0:
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=increment)])
+        if increment < 0:
+            lines.filter(quantity__lte=0).delete()
+    elif quantity > 0:
+        if not lines.update(quantity=quantity):
+            OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity)])
+    else:
+        lines.delete()
+
+
+def add_item(order, product, quantity=1):
+    """Adds `quantity` (may be negative) of a product to the cart."""
+    with transaction.atomic(), _refreshing_totals(order):
+        _lock(order)
+        _apply(order, product, increment=quantity)
+        order.update_totals()
+
+
+def set_quantity(order, product, quantity):
+    """Sets the quantity of a product in the cart; 0 or less removes the line."""
+    with transaction.atomic(), _refreshing_totals(order):
+        _lock(order)
+        _apply(order, product, quantity=quantity)
+        order.update_totals()
+
+
+def remove_item(order, product):
+    set_quantity(order, product, 0)
+
+
+def bulk_update(order, quantities):
+    """Applies {product: quantity} in a single transaction with one totals refresh."""
+    with transaction.atomic(), _refreshing_totals(order):
+        _lock(order)
+        for product, quantity in quantities.items():
+            _apply(order, product, quantity=quantity)
+        order.update_totals()
+
+
+def merge(order, quantities):
+    """
+    Adds a guest cart, {product_id: quantity}, to the customer's cart in a
+    single transaction: one bulk UPDATE for products already in the cart, one
+    bulk INSERT for the rest and one totals refresh. Products that no longer
+    exist are skipped.
+    """
+    with transaction.atomic():
+        _lock(order)
+        product_ids = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        existing = list(OrderItem.objects.filter(order=order, product_id__in=product_ids))
+        for line in existing:
+            line.quantity += quantities[line.product_id]
+        OrderItem.objects.bulk_update(existing, ['quantity'])
+        new_ids = product_ids - {line.product_id for line in existing}
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product_id=product_id, quantity=quantities[product_id]) for product_id in new_ids
+        )
+        order.update_totals()
+
+
+def get_line(order, product):
+    """The cart line for a product, with its DB-computed total, or None."""
+    return OrderItem.objects.for_order(order).filter(product=product).first()
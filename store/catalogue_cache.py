@@ -0,0 +1,96 @@
+# store/catalogue_cache.py
+"""
+Caching for the catalogue-only parts of the storefront (product grid, category
+nav, product pages, suggestions).
+
+Every key includes a catalogue version number. Saving or deleting a Product or
+Category bumps the version (see signals.py), which retires all catalogue
+entries at once without having to know their keys. Per-user data such as the
+cart badge is never stored here.
+
+The version lives in the default cache, so an invalidation only reaches the
+workers that share it. With the per-process LocMemCache (no REDIS_URL) each
+gunicorn worker has its own version and entries, and the others serve stale
+pages until CATALOGUE_CACHE_TIMEOUT, which settings keep short in that case.
+
+Entries are built from the primary database (see routers.primary_reads): a
+replica read right after a bump could still return the old rows, which would
+then be cached under the new version for the whole timeout.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import primary_reads
+
+VERSION_KEY = 'store:catalogue-version'
+# Distinguishes a cached None (e.g. a missing product) from a cache miss
+_MISSING = object()
+
+
+def catalogue_timeout():
+    return getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 60 * 15)
+
+
+def catalogue_version():
+    """Returns the current catalogue version, starting a new one if the cache lost it."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted counter can't resurrect old entries
+        cache.add(VERSION_KEY, int(time.time()), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_catalogue():
+    """Retires every cached catalogue entry."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time()), None)
+
+
+def _key(version, parts):
+    key = ':'.join(str(part) for part in parts)
+    # Search terms and name cursors are free text: hash anything memcached would reject
+    if len(key) > 150 or not key.isascii() or any(char.isspace() or not char.isprintable() for char in key):
+        key = hashlib.md5(key.encode()).hexdigest()
+    return 'store:catalogue:{}:{}'.format(version, key)
+
+
+def catalogue_key(*parts):
+    return _key(catalogue_version(), parts)
+
+
+def cached_catalogue(parts, builder):
+    """
+    Returns builder() from the cache, keyed by `parts` and the catalogue version.
+    Everything builder() returns must be picklable.
+    """
+    def build():
+        with primary_reads():
+            return builder()
+    return cache.get_or_set(catalogue_key(*parts), build, catalogue_timeout())
+
+
+# Async versions for store/async_views.py, using the cache's async API
+
+async def acatalogue_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time()), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+async def acached_catalogue(parts, builder):
+    """cached_catalogue() for a coroutine function builder."""
+    key = _key(await acatalogue_version(), parts)
+    value = await cache.aget(key, _MISSING)
+    if value is _MISSING:
+        with primary_reads():
+            value = await builder()
+        await cache.aadd(key, value, catalogue_timeout())
+    return value
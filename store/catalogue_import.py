@@ -0,0 +1,245 @@
+# store/catalogue_import.py
+"""
+Bulk catalogue import from supplier feeds (see the import_products command).
+
+A feed is CSV (with a header) or JSON Lines, optionally gzipped, with one
+product per row: sku, name, price, and optionally category (a name), digital
+and image (an http(s) URL, or a path under the image root). It is read in a
+single streaming pass and written a batch at a time:
+
+- categories are resolved through in-memory {name: id} and {slug: id} maps
+  (a feed name matches an existing category by either, both being unique),
+  and the ones not seen before are inserted in one bulk_create per batch;
+- products are upserted on sku with one bulk_create(update_conflicts=True)
+  per batch, so re-running a feed updates rather than duplicates;
+- images are fetched (or copied) and thumbnailed in a thread pool, and only
+  when the source changed: the stored file name is derived from it.
+
+bulk_create and bulk_update send no model signals, so each batch refreshes
+the open carts holding its products, and finish() does the rest of what the
+signals would have done (search index, catalogue and suggestion caches).
+"""
+import csv
+import gzip
+import hashlib
+import json
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from .catalogue_cache import invalidate_catalogue
+from .images import generate_thumbnails
+from .models import Category, Order, Product
+from .search import rebuild_index
+from .suggestions import forget_category_pool
+from .utils import forget_cart_product
+
+BATCH_SIZE = 1000
+IMAGE_WORKERS = 8
+# (connect, read) seconds per image download
+IMAGE_TIMEOUT = (3.05, 20)
+PRODUCT_FIELDS = ['name', 'price', 'digital', 'category']
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def open_feed(path):
+    """A text stream over a feed file; .gz files are decompressed on the fly."""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def feed_format(path):
+    name = str(path).removesuffix('.gz')
+    return 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_records(stream, format):
+    """Yields the feed's records as dicts, in order, without reading ahead."""
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            # A malformed line still takes its place, so row numbers (and resume) stay exact
+            yield record if isinstance(record, dict) else {}
+
+
+def clean(record):
+    """Validates one feed record; returns the normalised row or raises RowError."""
+    sku = str(record.get('sku') or '').strip()
+    name = str(record.get('name') or '').strip()
+    if not sku or not name:
+        raise RowError('sku and name are required')
+    if len(sku) > 64:
+        raise RowError('sku is longer than 64 characters')
+    try:
+        price = Decimal(str(record.get('price')).strip())
+        if not price.is_finite():
+            # NaN passes quantize() and would only blow up in the range check below
+            raise InvalidOperation
+        price = price.quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise RowError(f'invalid price {record.get("price")!r}')
+    if not 0 <= price < Decimal('100000'):
+        raise RowError(f'price {price} out of range')
+    digital = record.get('digital')
+    if not isinstance(digital, bool):
+        digital = str(digital or '').strip().lower() in TRUE_VALUES
+    return {
+        'sku': sku,
+        'name': name[:200],
+        'price': price,
+        'digital': digital,
+        'category': str(record.get('category') or '').strip()[:100],
+        'image': str(record.get('image') or '').strip(),
+    }
+
+
+def image_name(product, source):
+    """
+    Storage name for a product image (under Product.image's upload_to): stable
+    for a sku and source, new when the source changes.
+    """
+    digest = hashlib.md5(source.encode()).hexdigest()[:10]
+    extension = posixpath.splitext(urlsplit(source).path)[1].lower() or '.jpg'
+    name = f'{slugify(product.sku) or "product"}-{digest}{extension}'
+    return product.image.field.generate_filename(product, name)
+
+
+class CatalogueImporter:
+    def __init__(self, image_root=None, image_workers=IMAGE_WORKERS, session=None):
+        self.image_root = Path(image_root) if image_root else None
+        self.image_workers = image_workers
+        self.session = session or requests.Session()
+        self.categories = {}  # slug: id
+        self.category_names = {}  # name: id
+        self.remember_categories(Category.objects.all())
+        self.touched_categories = set()
+        self.stats = {'rows': 0, 'skipped': 0, 'images': 0, 'image_errors': 0}
+        self.errors = []  # (row number, message) of the first few problems
+
+    def note_error(self, row_number, message):
+        if len(self.errors) < 20:
+            self.errors.append((row_number, message))
+
+    # --- Categories ---
+
+    def remember_categories(self, categories):
+        for name, slug, pk in categories.values_list('name', 'slug', 'id'):
+            self.category_names[name] = pk
+            self.categories[slug] = pk
+
+    def category_id(self, name, slug):
+        return self.category_names.get(name) or self.categories.get(slug)
+
+    def category_ids(self, names):
+        """{name: id} for the batch's category names, creating the ones not seen before."""
+        slugs = {name: slugify(name) for name in names if name}
+        new = {name: slug for name, slug in slugs.items() if slug and not self.category_id(name, slug)}
+        if new:
+            # A category added since (or a second feed name with the same slug) conflicts
+            # on name or slug; it is skipped here and picked up by the lookup below
+            Category.objects.bulk_create(
+                [Category(name=name, slug=slug) for name, slug in new.items()], ignore_conflicts=True,
+            )
+            self.remember_categories(Category.objects.filter(Q(name__in=new) | Q(slug__in=new.values())))
+        return {name: self.category_id(name, slug) for name, slug in slugs.items()}
+
+    # --- Products ---
+
+    def import_batch(self, rows):
+        """Upserts one batch of clean()ed rows and fetches their new images."""
+        # The last row wins when a sku repeats within a batch (ON CONFLICT can't touch a row twice)
+        rows = list({row['sku']: row for row in rows}.values())
+        category_ids = self.category_ids({row['category'] for row in rows})
+
+        with transaction.atomic():
+            Product.objects.bulk_create(
+                [
+                    Product(sku=row['sku'], name=row['name'], price=row['price'], digital=row['digital'],
+                            category_id=category_ids.get(row['category']))
+                    for row in rows
+                ],
+                update_conflicts=True, unique_fields=['sku'], update_fields=PRODUCT_FIELDS,
+            )
+            products = Product.objects.in_bulk([row['sku'] for row in rows], field_name='sku')
+            # Price changes reach the open carts holding these products, as Product.save() would
+            Order.objects.filter(complete=False, orderitem__product__in=products.values()).recalculate_totals()
+
+        for product in products.values():
+            forget_cart_product(product.pk)
+            if product.category_id:
+                self.touched_categories.add(product.category_id)
+        self.import_images(rows, products)
+        self.stats['rows'] += len(rows)
+
+    # --- Images ---
+
+    def read_image(self, source):
+        if urlsplit(source).scheme in ('http', 'https'):
+            response = self.session.get(source, timeout=IMAGE_TIMEOUT)
+            response.raise_for_status()
+            return response.content
+        if self.image_root is None:
+            raise ValueError('local image paths need an image root')
+        path = (self.image_root / source).resolve()
+        if not path.is_relative_to(self.image_root.resolve()):
+            raise ValueError('path is outside the image root')
+        return path.read_bytes()
+
+    def fetch_image(self, product, source):
+        """Runs in the thread pool: downloads/copies, stores and thumbnails one image."""
+        name = image_name(product, source)
+        content = ContentFile(self.read_image(source))
+        # Left behind by an interrupted run; replaced rather than saved under a new name
+        if product.image.storage.exists(name):
+            product.image.storage.delete(name)
+        product.image.name = product.image.storage.save(name, content)
+        product.thumbnails = generate_thumbnails(product.image)
+        return product
+
+    def import_images(self, rows, products):
+        jobs = []
+        for row in rows:
+            product = products[row['sku']]
+            # The name encodes the source, so an unchanged image isn't fetched again
+            if row['image'] and product.image.name != image_name(product, row['image']):
+                jobs.append((product, row['image']))
+        if not jobs:
+            return
+
+        updated = []
+        with ThreadPoolExecutor(max_workers=self.image_workers) as pool:
+            futures = [(source, pool.submit(self.fetch_image, product, source)) for product, source in jobs]
+            for source, future in futures:
+                try:
+                    updated.append(future.result())
+                except Exception as exc:
+                    self.stats['image_errors'] += 1
+                    self.note_error(None, f'image {source}: {exc}')
+        Product.objects.bulk_update(updated, ['image', 'thumbnails'])
+        self.stats['images'] += len(updated)
+
+    def finish(self):
+        """What the skipped model signals would have done, once for the whole import."""
+        rebuild_index()
+        for category_id in self.touched_categories:
+            forget_category_pool(category_id)
+        invalidate_catalogue()
@@ -0,0 +1,171 @@
+# store/exports.py
+"""
+Bulk export of orders for finance, as CSV or JSON Lines.
+
+One row per order line, with the order's status, payment and totals and its
+shipping address repeated on each line (an order without lines still gets
+one row). Orders placed before checkout attached the address to the order
+fall back to the customer's latest unattached address. Rows are produced as a stream: orders are read with
+QuerySet.iterator() as plain values_list() tuples, and the lines and
+addresses of each chunk of orders are fetched with one query each, so memory
+stays bounded by the chunk size however many orders are exported. Both the
+admin export view (OrderAdmin) and the export_orders command consume the
+same generators.
+"""
+import csv
+import datetime
+import json
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Q
+from django.utils import timezone
+
+from .models import Order, OrderItem, ShippingAddress
+
+CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+
+ORDER_COLUMNS = (
+    ('order_id', 'id'),
+    ('date_ordered', 'date_ordered'),
+    ('status', 'status'),
+    ('payment_method', 'payment_method'),
+    ('transaction_id', 'transaction_id'),
+    ('customer_id', 'customer_id'),
+    ('customer_name', 'customer__name'),
+    ('customer_email', 'customer__email'),
+    ('item_count', 'item_count'),
+    ('subtotal', 'subtotal'),
+)
+LINE_COLUMNS = (
+    ('product_id', 'product_id'),
+    ('product_name', 'product__name'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'product__price'),
+    ('line_total', 'line_total'),
+)
+ADDRESS_COLUMNS = (
+    ('ship_name', 'name'),
+    ('ship_email', 'email'),
+    ('ship_address', 'address'),
+    ('ship_address2', 'address2'),
+    ('ship_city', 'city'),
+    ('ship_state', 'state'),
+    ('ship_zipcode', 'zipcode'),
+)
+HEADER = tuple(name for name, _ in ORDER_COLUMNS + LINE_COLUMNS + ADDRESS_COLUMNS)
+
+CUSTOMER_ID = [name for name, _ in ORDER_COLUMNS].index('customer_id')
+NO_LINE = (None,) * len(LINE_COLUMNS)
+NO_ADDRESS = (None,) * len(ADDRESS_COLUMNS)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def export_queryset(date_from=None, date_to=None, status=None, using=None):
+    """
+    Completed orders placed between date_from and date_to (datetime.date,
+    both inclusive), optionally only those with `status`.
+    """
+    orders = Order.objects.filter(complete=True)
+    if using:
+        orders = orders.using(using)
+    # Plain range bounds rather than __date, so an index on date_ordered can be used
+    if date_from:
+        orders = orders.filter(date_ordered__gte=day_start(date_from))
+    if date_to:
+        orders = orders.filter(date_ordered__lt=day_start(date_to + datetime.timedelta(days=1)))
+    if status:
+        orders = orders.filter(status=status)
+    return orders
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def order_rows(orders, chunk_size=CHUNK_SIZE):
+    """Yields a HEADER-shaped tuple per order line of `orders`, oldest order first."""
+    db = orders.db
+    rows = (
+        orders.order_by('id')
+        .values_list(*(field for _, field in ORDER_COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+    for chunk in chunks(rows, chunk_size):
+        ids = [row[0] for row in chunk]
+
+        lines = defaultdict(list)
+        line_rows = (
+            OrderItem.objects.using(db).filter(order_id__in=ids)
+            .annotate(line_total=ExpressionWrapper(
+                F('quantity') * F('product__price'),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .order_by('order_id', 'date_added', 'id')
+            .values_list('order_id', *(field for _, field in LINE_COLUMNS))
+        )
+        for order_id, *line in line_rows:
+            lines[order_id].append(tuple(line))
+
+        # The most recent address wins when an order has several, and for a customer's
+        # addresses saved without an order
+        addresses, latest = {}, {}
+        customer_ids = {row[CUSTOMER_ID] for row in chunk if row[CUSTOMER_ID] is not None}
+        address_rows = (
+            ShippingAddress.objects.using(db)
+            .filter(Q(order_id__in=ids) | Q(order__isnull=True, customer_id__in=customer_ids))
+            .order_by('date_added', 'id')
+            .values_list('order_id', 'customer_id', *(field for _, field in ADDRESS_COLUMNS))
+        )
+        for order_id, customer_id, *address in address_rows:
+            if order_id is None:
+                latest[customer_id] = tuple(address)
+            else:
+                addresses[order_id] = tuple(address)
+
+        for order in chunk:
+            address = addresses.get(order[0]) or latest.get(order[CUSTOMER_ID], NO_ADDRESS)
+            for line in lines.get(order[0]) or [NO_LINE]:
+                yield order + line + address
+
+
+def plain(value):
+    """A JSON/CSV friendly version of a database value."""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class Echo:
+    """A file-like object whose write() returns what it was given, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow([plain(value) for value in row])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, map(plain, row)))) + '\n'
+
+
+def export_lines(rows, format):
+    """The text lines of an export of `rows` in `format` ('csv' or 'jsonl')."""
+    if format not in FORMATS:
+        raise ValueError(f'Unknown export format {format!r}; expected one of {", ".join(FORMATS)}.')
+    return csv_lines(rows) if format == 'csv' else jsonl_lines(rows)
@@ -0,0 +1,158 @@
+# store/facets.py
+"""
+Faceted filtering for the catalogue listings: category, price bucket and
+product type (digital or physical).
+
+The counts shown next to each filter option come from one precomputed "cube":
+the number of products per (category, price bucket, type) cell, built with a
+single GROUP BY and kept in the catalogue cache (see catalogue_cache.py).
+Any facet count for any combination of filters is then a sum over that small
+list, so a listing page never runs COUNT(*) queries itself. The warm_facets
+command rebuilds the cube ahead of traffic, e.g. from cron.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.utils.http import urlencode
+
+from .catalogue_cache import acached_catalogue, cached_catalogue
+from .models import Product
+
+# (key, label, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = (
+    ('under-25', 'Under $25', None, Decimal('25')),
+    ('25-50', '$25 to $50', Decimal('25'), Decimal('50')),
+    ('50-100', '$50 to $100', Decimal('50'), Decimal('100')),
+    ('100-250', '$100 to $250', Decimal('100'), Decimal('250')),
+    ('250-plus', '$250 and up', Decimal('250'), None),
+)
+PRODUCT_TYPES = (
+    ('digital', 'Digital'),
+    ('physical', 'Physical'),
+)
+FILTER_PARAMS = ('price', 'type')
+
+
+def price_condition(bucket_key):
+    for key, _, low, high in PRICE_BUCKETS:
+        if key == bucket_key:
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            return condition
+    return None
+
+
+def type_condition(type_key):
+    if type_key == 'digital':
+        return Q(digital=True)
+    if type_key == 'physical':
+        return Q(digital=False) | Q(digital__isnull=True)
+    return None
+
+
+def parse_filters(params):
+    """The known, valid filters from a QueryDict; anything else is dropped."""
+    filters = {}
+    if price_condition(params.get('price')) is not None:
+        filters['price'] = params['price']
+    if type_condition(params.get('type')) is not None:
+        filters['type'] = params['type']
+    return filters
+
+
+def apply_filters(queryset, filters):
+    if 'price' in filters:
+        queryset = queryset.filter(price_condition(filters['price']))
+    if 'type' in filters:
+        queryset = queryset.filter(type_condition(filters['type']))
+    return queryset
+
+
+def cube_rows():
+    bucket = Case(
+        *[When(price_condition(key), then=Value(key)) for key, *_ in PRICE_BUCKETS],
+        output_field=CharField(),
+    )
+    product_type = Case(When(digital=True, then=Value('digital')), default=Value('physical'), output_field=CharField())
+    return (
+        Product.objects.order_by()
+        .values_list('category_id', bucket, product_type)
+        .annotate(n=Count('id'))
+    )
+
+
+def build_cube():
+    """[(category_id, price bucket, product type, count), ...] in one aggregate query."""
+    return [tuple(row) for row in cube_rows()]
+
+
+async def abuild_cube():
+    return [tuple(row) async for row in cube_rows()]
+
+
+def facet_cube():
+    return cached_catalogue(('facet-cube',), build_cube)
+
+
+async def afacet_cube():
+    return await acached_catalogue(('facet-cube',), abuild_cube)
+
+
+def facet_counts(category_id=None, filters=None, cube=None):
+    """
+    Counts for every filter option, each computed with the *other* active
+    filters applied (the usual faceted-search behaviour), plus the total
+    matching the current selection. Reads only the cached cube, which async
+    callers fetch themselves with afacet_cube().
+    """
+    filters = filters or {}
+    if cube is None:
+        cube = facet_cube()
+    price, product_type = filters.get('price'), filters.get('type')
+    categories, prices, types = {}, {}, {}
+    total = 0
+
+    for cell_category, cell_price, cell_type, n in cube:
+        in_category = category_id is None or cell_category == category_id
+        in_price = price is None or cell_price == price
+        in_type = product_type is None or cell_type == product_type
+
+        if in_price and in_type:
+            categories[cell_category] = categories.get(cell_category, 0) + n
+        if in_category and in_type:
+            prices[cell_price] = prices.get(cell_price, 0) + n
+        if in_category and in_price:
+            types[cell_type] = types.get(cell_type, 0) + n
+        if in_category and in_price and in_type:
+            total += n
+
+    return {
+        'categories': categories,
+        'price': [(key, label, prices.get(key, 0)) for key, label, *_ in PRICE_BUCKETS],
+        'type': [(key, label, types.get(key, 0)) for key, label in PRODUCT_TYPES],
+        'total': total,
+    }
+
+
+def facet_options(counts, filters, sort):
+    """
+    The price and type filter menus for a listing template: per facet a list of
+    {'key', 'label', 'count', 'active', 'query'} where `query` is the query
+    string that toggles that option while keeping the sort and other filters.
+    """
+    menus = {}
+    for name in FILTER_PARAMS:
+        options = []
+        for key, label, count in counts[name]:
+            active = filters.get(name) == key
+            params = {'sort': sort, **filters}
+            if active:
+                params.pop(name)
+            else:
+                params[name] = key
+            options.append({'key': key, 'label': label, 'count': count, 'active': active, 'query': urlencode(params)})
+        menus[name] = options
+    return menus
@@ -0,0 +1,204 @@
+# store/fake_razorpay.py
+"""
+A local stand-in for the Razorpay orders API, for tests and for working on
+checkout offline (see the fake_razorpay command). Point
+settings.RAZORPAY_BASE_URL at FakeRazorpay.url.
+
+Besides the happy path it can answer with errors, fail after creating an
+order (the ambiguous case idempotency keys exist for) and respond slowly, so
+timeouts, retries and the circuit breaker can be exercised for real over HTTP.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def error_body(code, description):
+    return {'error': {'code': code, 'description': description}}
+
+
+class FakeRazorpay:
+    def __init__(self, key_id, key_secret, host='127.0.0.1', port=0):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.orders = {}
+        self.requests = []  # (method, path) of every request received
+        # Queued outcomes for the next order creations: (status, create_anyway, html)
+        self.failures = []
+        self.delay = 0  # seconds to wait before answering
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail_next(self, count=1, status=503, create_anyway=False, html=False):
+        """
+        Answers the next `count` order creations with `status`, optionally after
+        creating the order, and with an HTML page (as a proxy would) if `html`.
+        """
+        self.failures.extend([(status, create_anyway, html)] * count)
+
+    def order_requests(self, method='POST'):
+        return [path for m, path in self.requests if m == method and path.startswith('/v1/orders')]
+
+    def signature(self, order_id, payment_id):
+        """The signature Razorpay's checkout returns with a successful payment."""
+        message = f'{order_id}|{payment_id}'.encode()
+        return hmac.new(self.key_secret.encode(), message, hashlib.sha256).hexdigest()
+
+    def pay(self, order_id):
+        """Marks an order paid and returns the callback parameters the checkout would send."""
+        payment_id = 'pay_' + secrets.token_hex(7)
+        with self._lock:
+            order = self.orders[order_id]
+            order.update(status='paid', amount_paid=order['amount'], amount_due=0, attempts=order['attempts'] + 1)
+        return {
+            'razorpay_order_id': order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature': self.signature(order_id, payment_id),
+        }
+
+    def webhook(self, event, order_id, payment_id=None, secret='', event_id=None, amount=None, currency='INR'):
+        """
+        A signed webhook delivery as Razorpay POSTs it: (body, headers). The payment
+        is for the gateway order's amount unless `amount` says otherwise.
+        """
+        payment_id = payment_id or 'pay_' + secrets.token_hex(7)
+        if amount is None:
+            amount = self.orders.get(order_id, {}).get('amount')
+        body = json.dumps({
+            'entity': 'event',
+            'event': event,
+            'contains': ['payment'],
+            'payload': {'payment': {'entity': {
+                'id': payment_id,
+                'entity': 'payment',
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'status': 'failed' if event == 'payment.failed' else 'captured',
+            }}},
+            'created_at': int(time.time()),
+        }).encode()
+        headers = {
+            'X-Razorpay-Signature': hmac.new(secret.encode(), body, hashlib.sha256).hexdigest(),
+            'X-Razorpay-Event-Id': event_id or 'evt_' + secrets.token_hex(7),
+        }
+        return body, headers
+
+    # --- API ---
+
+    def create_order(self, data):
+        amount = data.get('amount')
+        if not isinstance(amount, int) or amount < 100:
+            return 400, error_body('BAD_REQUEST_ERROR', 'The amount must be atleast INR 1.00')
+        order = {
+            'id': 'order_' + secrets.token_hex(7),
+            'entity': 'order',
+            'amount': amount,
+            'amount_paid': 0,
+            'amount_due': amount,
+            'currency': data.get('currency', 'INR'),
+            'receipt': data.get('receipt'),
+            'status': 'created',
+            'attempts': 0,
+            'notes': data.get('notes', {}),
+            'created_at': int(time.time()),
+        }
+        with self._lock:
+            failure = self.failures.pop(0) if self.failures else None
+            if failure is None or failure[1]:
+                self.orders[order['id']] = order
+        if failure is not None and failure[2]:
+            return failure[0], f'<html><body><h1>{failure[0]} Bad Gateway</h1></body></html>'.encode()
+        if failure is not None:
+            return failure[0], error_body('SERVER_ERROR', 'The server encountered an error.')
+        return 200, order
+
+    def list_orders(self, query):
+        items = list(self.orders.values())
+        if 'receipt' in query:
+            items = [order for order in items if order['receipt'] == query['receipt'][0]]
+        return 200, {'entity': 'collection', 'count': len(items), 'items': items}
+
+    def fetch_order(self, order_id):
+        if order_id not in self.orders:
+            return 400, error_body('BAD_REQUEST_ERROR', 'The id provided does not exist')
+        return 200, self.orders[order_id]
+
+    def handle(self, method, path, headers, body):
+        expected = 'Basic ' + base64.b64encode(f'{self.key_id}:{self.key_secret}'.encode()).decode()
+        if headers.get('Authorization') != expected:
+            return 401, error_body('BAD_REQUEST_ERROR', 'Authentication failed')
+
+        url = urlsplit(path)
+        if url.path == '/v1/orders' and method == 'POST':
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return 400, error_body('BAD_REQUEST_ERROR', 'Invalid JSON')
+            return self.create_order(data)
+        if url.path == '/v1/orders' and method == 'GET':
+            return self.list_orders(parse_qs(url.query))
+        if url.path.startswith('/v1/orders/') and method == 'GET':
+            return self.fetch_order(url.path.rsplit('/', 1)[1])
+        return 404, error_body('BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, method):
+                fake.requests.append((method, self.path))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload = fake.handle(method, self.path, self.headers, body)
+                if fake.delay:
+                    time.sleep(fake.delay)
+                content_type = 'text/html' if isinstance(payload, bytes) else 'application/json'
+                content = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (timed out) first
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
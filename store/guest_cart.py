@@ -0,0 +1,105 @@
+# store/guest_cart.py
+"""
+The guest cart cookie.
+
+A guest's cart is kept in the `cart` cookie as {product_id: quantity} in a
+compact, versioned encoding, "1:<id>-<qty>.<id>-<qty>...", signed with
+SECRET_KEY so the server only reads carts it wrote itself (prices always
+come from the database). Cookies from before the signed format (raw JSON,
+{id: quantity} or {id: {"quantity": n}}) are still read, and are rewritten
+in the new format the next time the cart changes.
+
+read_cart() parses the cookie at most once per request; every reader of the
+guest cart goes through it.
+"""
+import json
+
+from django.conf import settings
+
+COOKIE_NAME = 'cart'
+SALT = 'store.guest_cart'
+VERSION = '1'
+MAX_AGE = 60 * 60 * 24 * 30
+# Keeps the signed cookie well under the browsers' 4 KB limit
+MAX_LINES = 200
+
+
+def encode(quantities):
+    lines = '.'.join(f'{product_id}-{quantity}' for product_id, quantity in sorted(quantities.items()))
+    return f'{VERSION}:{lines}'
+
+
+def _add(quantities, product_id, quantity):
+    try:
+        product_id, quantity = int(product_id), int(quantity)
+    except (TypeError, ValueError):
+        return
+    if product_id > 0 and quantity > 0:
+        quantities[product_id] = quantity
+
+
+def decode(value):
+    """{product_id: quantity} from an encode()d value; unknown versions read as empty."""
+    version, _, lines = value.partition(':')
+    quantities = {}
+    if version != VERSION:
+        return quantities
+    for line in lines.split('.') if lines else ():
+        product_id, _, quantity = line.partition('-')
+        _add(quantities, product_id, quantity)
+    return quantities
+
+
+def decode_legacy(value):
+    """{product_id: quantity} from an unsigned JSON cart cookie, ignoring malformed entries."""
+    try:
+        cart = json.loads(value)
+    except ValueError:
+        return {}
+    quantities = {}
+    if not isinstance(cart, dict):
+        return quantities
+    for product_id, quantity in cart.items():
+        if isinstance(quantity, dict):
+            quantity = quantity.get('quantity')
+        _add(quantities, product_id, quantity)
+    return quantities
+
+
+def read_cart(request):
+    """The guest cart as {product_id: quantity}, parsed once per request."""
+    cached = getattr(request, '_guest_cart', None)
+    if cached is not None:
+        return cached
+
+    quantities = {}
+    raw = request.COOKIES.get(COOKIE_NAME)
+    if raw:
+        value = request.get_signed_cookie(COOKIE_NAME, default=None, salt=SALT)
+        quantities = decode(value) if value is not None else decode_legacy(raw)
+    request._guest_cart = quantities
+    return quantities
+
+
+def set_cart(request, quantities):
+    """
+    Replaces the request's guest cart with {product_id: quantity}; lines of 0
+    or less are dropped. Persist it with write_cookie() on the response.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if len(quantities) > MAX_LINES:
+        raise ValueError(f'A guest cart holds at most {MAX_LINES} different products.')
+    request._guest_cart = quantities
+    return quantities
+
+
+def write_cookie(request, response):
+    """Stores the request's guest cart in the cookie on `response`; an empty cart deletes it."""
+    quantities = read_cart(request)
+    if quantities:
+        response.set_signed_cookie(
+            COOKIE_NAME, encode(quantities), salt=SALT, max_age=MAX_AGE,
+            secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+        )
+    elif COOKIE_NAME in request.COOKIES:
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
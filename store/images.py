@@ -0,0 +1,99 @@
+# store/images.py
+"""
+Derivative images for Product.image.
+
+Each uploaded image gets downscaled copies at a few fixed widths, in WebP and
+JPEG, stored next to the original (products/lamp.png -> products/lamp-png-300w.webp;
+the source extension keeps lamp.png and lamp.jpg apart). What was generated is
+recorded on Product.thumbnails, so templates can build a srcset without
+touching the storage backend. Records from an older naming scheme
+(THUMBNAIL_VERSION) count as missing until generate_thumbnails rebuilds them.
+"""
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+THUMBNAIL_WIDTHS = (150, 300, 600, 1200)
+# (file extension, Pillow format, MIME type), best format first
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+QUALITY = 80
+# Bumped when thumbnail names change, so older records are regenerated
+THUMBNAIL_VERSION = 2
+# What a missing, unreadable or oversized original raises; callers skip the product on these
+THUMBNAIL_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def thumbnail_name(source_name, width, extension):
+    stem, source_extension = posixpath.splitext(source_name)
+    source_extension = source_extension.lstrip('.').lower() or 'img'
+    return f'{stem}-{source_extension}-{width}w.{extension}'
+
+
+def generate_thumbnails(image_field):
+    """
+    Writes the thumbnails for an ImageField file and returns the metadata to
+    store on Product.thumbnails: {'source': name, 'width': w, 'widths': [...], 'version': v}.
+    Widths at or above the original's width are skipped (no upscaling).
+    """
+    storage = image_field.storage
+    with image_field.open('rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+
+    # Both output formats are written without alpha, so flatten onto white
+    if original.mode in ('RGBA', 'LA', 'P'):
+        original = original.convert('RGBA')
+        background = Image.new('RGB', original.size, (255, 255, 255))
+        background.paste(original, mask=original.getchannel('A'))
+        original = background
+    elif original.mode != 'RGB':
+        original = original.convert('RGB')
+
+    widths = []
+    for width in THUMBNAIL_WIDTHS:
+        if width >= original.width:
+            continue
+        height = round(original.height * width / original.width)
+        resized = original.resize((width, height), Image.Resampling.LANCZOS)
+        for extension, pil_format, _ in THUMBNAIL_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, quality=QUALITY, optimize=True)
+            name = thumbnail_name(image_field.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+        widths.append(width)
+
+    return {'source': image_field.name, 'width': original.width, 'widths': widths, 'version': THUMBNAIL_VERSION}
+
+
+def thumbnails_are_current(product):
+    return (
+        bool(product.image)
+        and product.thumbnails.get('source') == product.image.name
+        and product.thumbnails.get('version') == THUMBNAIL_VERSION
+    )
+
+
+def update_thumbnails(product):
+    """Generates the product's thumbnails and records them without re-saving the model."""
+    product.thumbnails = generate_thumbnails(product.image)
+    type(product).objects.filter(pk=product.pk).update(thumbnails=product.thumbnails)
+    return product.thumbnails
+
+
+def srcset(product, extension):
+    """'url 150w, url 300w, ...' for one format, ending with the original image."""
+    storage = product.image.storage
+    candidates = [
+        f'{storage.url(thumbnail_name(product.image.name, width, extension))} {width}w'
+        for width in product.thumbnails.get('widths', [])
+    ]
+    if extension == 'jpg' and product.thumbnails.get('width'):
+        candidates.append(f'{product.image.url} {product.thumbnails["width"]}w')
+    return ', '.join(candidates)
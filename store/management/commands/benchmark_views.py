@@ -0,0 +1,150 @@
+# store/management/commands/benchmark_views.py
+import json
+import logging
+import platform
+from io import StringIO
+
+import django
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from store import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the storefront views through the test client against a freshly seeded test '
+        'database. Reports p50/p95/p99 latency, query count and rows fetched per view, and fails '
+        'when the results regress against a --baseline file. With --throughput, instead compares '
+        'requests per second of one sync worker against one async worker (ASYNC_VIEWS).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000, help='Products to seed.')
+        parser.add_argument('--categories', type=int, default=20, help='Categories to seed.')
+        parser.add_argument('--customers', type=int, default=200, help='Customers to seed.')
+        parser.add_argument('--orders', type=int, default=2000, help='Completed orders to seed.')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per scenario before timing.')
+        parser.add_argument('--cold-cache', action='store_true', help='Clear the cache before every timed request.')
+        parser.add_argument('--only', nargs='*', default=None, help='Only run these scenario names (e.g. home cart_view).')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 slowdown against the baseline, as a fraction (default 0.25).')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore p95 slowdowns smaller than this many milliseconds.')
+        parser.add_argument('--throughput', action='store_true',
+                            help='Measure sync vs async views throughput instead of per-view latency.')
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests per --throughput run.')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Requests in flight at once on the async worker (default 10).')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1.')
+        if options['throughput'] and (options['requests'] < 1 or options['concurrency'] < 1):
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        if options['throughput'] and options['baseline']:
+            raise CommandError('--baseline compares latency runs; it cannot be used with --throughput.')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {exc}')
+
+        # 1. Run against a throwaway copy of the database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        # Failing views are reported in the results; a traceback per iteration would bury them
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        try:
+            results = self.run(options)
+        finally:
+            request_logger.disabled = False
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'pool': bool(connection.settings_dict.get('OPTIONS', {}).get('pool')),
+                'cache': cache.__class__.__name__,
+                'dataset': {key: options[key] for key in ('products', 'categories', 'customers', 'orders')},
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'cold_cache': options['cold_cache'],
+                'throughput': options['throughput'],
+                'requests': options['requests'] if options['throughput'] else None,
+                'concurrency': options['concurrency'] if options['throughput'] else None,
+            },
+            'results': results,
+        }
+
+        # 2. Report
+        if options['throughput']:
+            self.print_throughput(results)
+        else:
+            self.print_table(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+        # 3. Compare
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline, options['tolerance'], options['min_delta_ms'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(self.style.ERROR(f'REGRESSION {line}'))
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def run(self, options):
+        self.stdout.write('Seeding benchmark data...')
+        call_command(
+            'generate_products',
+            products=options['products'], categories=options['categories'],
+            customers=options['customers'], orders=options['orders'],
+            stdout=self.stdout if options['verbosity'] > 1 else StringIO(),
+        )
+        benchmarks.seed_fixtures()
+        cache.clear()
+
+        scenarios = benchmarks.default_scenarios()
+        if options['throughput']:
+            scenarios = [s for s in scenarios if s.name in benchmarks.THROUGHPUT_SCENARIOS]
+        if options['only']:
+            scenarios = [s for s in scenarios if s.name in options['only']]
+            if not scenarios:
+                raise CommandError('--only matched no scenarios.')
+        if options['throughput']:
+            return benchmarks.run_throughput(scenarios, options['requests'], options['concurrency'], options['warmup'])
+        return benchmarks.run_benchmarks(scenarios, options['iterations'], options['warmup'], options['cold_cache'])
+
+    def print_table(self, results, baseline):
+        self.stdout.write(f'{"scenario":32} {"status":>6} {"p50":>9} {"p95":>9} {"p99":>9} {"queries":>8} {"rows":>7}')
+        for key, r in results.items():
+            line = (f'{key:32} {r["status"]:>6} {r["p50_ms"]:>7.2f}ms {r["p95_ms"]:>7.2f}ms '
+                    f'{r["p99_ms"]:>7.2f}ms {r["queries"]:>8} {r["rows"]:>7}')
+            if baseline and key in baseline:
+                line += f'   (baseline p95 {baseline[key]["p95_ms"]:.2f}ms, {baseline[key]["queries"]} queries)'
+            self.stdout.write(self.style.ERROR(line) if r['error'] else line)
+
+    def print_throughput(self, results):
+        self.stdout.write(f'{"worker":8} {"in flight":>9} {"requests":>9} {"req/s":>9} {"p50":>9} {"p95":>9} {"errors":>7}')
+        for mode, r in results.items():
+            line = (f'{mode:8} {r["concurrency"]:>9} {r["requests"]:>9} {r["requests_per_second"]:>9.1f} '
+                    f'{r["p50_ms"]:>7.2f}ms {r["p95_ms"]:>7.2f}ms {r["errors"]:>7}')
+            self.stdout.write(self.style.ERROR(line) if r['errors'] else line)
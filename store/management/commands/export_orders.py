@@ -0,0 +1,74 @@
+# store/management/commands/export_orders.py
+import argparse
+import datetime
+import gzip
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import exports
+from store.models import Order
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid date {value!r}; use YYYY-MM-DD')
+
+
+def open_output(path, compress):
+    """A text stream for the export, or None to write through self.stdout."""
+    if compress:
+        # Wrapping sys.stdout.buffer leaves it open when the gzip stream is closed
+        return gzip.open(path or sys.stdout.buffer, 'wt', encoding='utf-8', newline='')
+    if path:
+        return open(path, 'w', encoding='utf-8', newline='')
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports completed orders as CSV or JSON Lines, one row per order line, streaming them so memory '
+        'stays flat for any number of orders. Writes to stdout, or to --output (gzip-compressed when the '
+        'name ends in .gz or with --gzip).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=exports.FORMATS, default='csv', help='Output format (default csv).')
+        parser.add_argument('--from', dest='date_from', type=parse_date, help='First order date, YYYY-MM-DD.')
+        parser.add_argument('--to', dest='date_to', type=parse_date, help='Last order date (inclusive), YYYY-MM-DD.')
+        parser.add_argument('--status', choices=[value for value, _ in Order.STATUSES], help='Only orders with this status.')
+        parser.add_argument('--output', '-o', help='File to write; default stdout.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                            help=f'Orders fetched per round trip (default {exports.CHUNK_SIZE}).')
+        parser.add_argument('--database', default=None, help='Database alias to read from, e.g. a replica.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        orders = exports.export_queryset(options['date_from'], options['date_to'], options['status'],
+                                         using=options['database'])
+        rows = exports.order_rows(orders, options['chunk_size'])
+        lines = exports.export_lines(rows, options['format'])
+
+        output = options['output']
+        compress = options['gzip'] or (output or '').endswith('.gz')
+        stream = open_output(output, compress)
+
+        count = 0
+        try:
+            for line in lines:
+                if stream is None:
+                    self.stdout.write(line, ending='')
+                else:
+                    stream.write(line)
+                count += 1
+        finally:
+            if stream is not None:
+                stream.close()
+
+        if output:
+            rows_written = count - 1 if options['format'] == 'csv' else count
+            self.stderr.write(self.style.SUCCESS(f'Exported {rows_written} order lines to {output}.'))
@@ -0,0 +1,27 @@
+# store/management/commands/fake_razorpay.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.fake_razorpay import FakeRazorpay
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs a local fake of the Razorpay orders API for working on checkout offline. Start the '
+        'site with RAZORPAY_BASE_URL set to the URL it prints.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=9009, help='Port to listen on (default 9009).')
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before every answer.')
+
+    def handle(self, *args, **options):
+        fake = FakeRazorpay(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET, port=options['port'])
+        fake.delay = options['delay']
+        self.stdout.write(f'Fake Razorpay listening on {fake.url} (RAZORPAY_BASE_URL={fake.url}); Ctrl-C to stop.')
+        try:
+            fake.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.server.server_close()
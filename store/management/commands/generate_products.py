@@ -1,45 +1,253 @@
 # store/management/commands/generate_products.py
-from django.core.management.base import BaseCommand
-from store.models import Category, Product
-from faker import Faker
 import random
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from multiprocessing import Pool
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from faker import Faker
+
+from store.catalogue_cache import invalidate_catalogue
+from store.models import Category, Customer, Order, OrderItem, Product, ShippingAddress
+from store.search import rebuild_index
+from store.suggestions import forget_category_pool
+
+BASE_CATEGORIES = ['Electronics', 'Books', 'Apparel', 'Home Goods']
+# Usernames of generated shoppers, so a fresh run can remove only what it created
+CUSTOMER_PREFIX = 'loadtest_'
+ORDER_HISTORY_DAYS = 365
+
+
+def fake_rows(job):
+    """
+    Builds one chunk of fake rows. Runs in worker processes in --workers mode,
+    so it must be a picklable top-level function. Each chunk is seeded from
+    (seed, start), which makes the output identical with or without workers.
+    """
+    kind, seed, start, count, n_categories = job
+    fake = Faker()
+    fake.seed_instance(seed + start)
+    rng = random.Random(seed + start)
+
+    if kind == 'products':
+        # (name, price in cents, digital, category index)
+        return [
+            (fake.catch_phrase(), rng.randint(1000, 50000), rng.random() < 0.5, rng.randrange(n_categories))
+            for _ in range(count)
+        ]
+    # customers: (index, name, email)
+    return [(start + i, fake.name(), fake.email()) for i in range(count)]
+
 
 class Command(BaseCommand):
-    help = 'Generates 50 dummy products and 4 categories.'
+    help = (
+        'Generates a synthetic catalogue (categories, products) and optionally customers with '
+        'completed order histories, in batched bulk_create chunks. Deterministic for a given --seed.'
+    )
 
-    def handle(self, *args, **kwargs):
-        fake = Faker()
-        
-        # 1. Clear existing products (optional, for fresh runs)
-        Product.objects.all().delete()
-        Category.objects.all().delete()
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50, help='Number of products to create.')
+        parser.add_argument('--categories', type=int, default=len(BASE_CATEGORIES), help='Number of categories.')
+        parser.add_argument('--customers', type=int, default=0, help='Number of customers (with user accounts) to create.')
+        parser.add_argument('--orders', type=int, default=0, help='Number of completed orders to create.')
+        parser.add_argument('--items-per-order', type=int, default=3, help='Maximum lines per order (at least 1).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create batch.')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives the same data.')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Pre-generate fake data in this many worker processes (0 = in-process).')
+        parser.add_argument('--append', action='store_true',
+                            help='Keep existing data instead of clearing products, categories and generated customers.')
+
+    def handle(self, *args, **options):
+        if options['categories'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--categories and --batch-size must be at least 1.')
+        self.batch_size = options['batch_size']
+        self.seed = options['seed']
+        started = time.monotonic()
+
+        pool = Pool(options['workers']) if options['workers'] > 0 else None
+        try:
+            self.map_rows = pool.imap if pool else map
+
+            if not options['append']:
+                self.clear(orders=options['orders'] or options['customers'])
+
+            categories = self.create_categories(options['categories'])
+            self.create_products(options['products'], categories)
+            customer_ids = self.create_customers(options['customers'])
+            if options['orders']:
+                self.create_orders(options['orders'], options['items_per_order'], customer_ids)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        # bulk_create and clear()'s plain DELETEs send no signals, so refresh the search index
+        # and retire cached catalogue pages explicitly
+        rebuild_index()
+        invalidate_catalogue()
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.monotonic() - started:.1f}s.'))
+
+    def chunks(self, kind, total, n_categories=0):
+        """Yields fake row chunks of batch_size, generated in order."""
+        jobs = (
+            (kind, self.seed, start, min(self.batch_size, total - start), n_categories)
+            for start in range(0, total, self.batch_size)
+        )
+        return self.map_rows(fake_rows, jobs)
+
+    def clear(self, orders):
+        """
+        Removes the catalogue (and generated orders) with plain batched DELETEs.
+        QuerySet.delete() would load every row to send post_delete, whose
+        receivers unindex, invalidate and evict one row at a time; handle()
+        rebuilds the index and retires the cached catalogue once instead.
+        """
+        # 1. Clear existing products (optional, for fresh runs); lines keep their order
+        # (on_delete=SET_NULL), as with QuerySet.delete()
+        OrderItem.objects.filter(product__isnull=False).update(product=None)
+        self.delete_rows(Product, 'id', list(Product.objects.values_list('pk', flat=True)))
+        category_ids = list(Category.objects.values_list('pk', flat=True))
+        self.delete_rows(Category, 'id', category_ids)
+        for category_id in category_ids + [None]:
+            forget_category_pool(category_id)
         self.stdout.write(self.style.WARNING('Cleared existing Products and Categories.'))
 
-        # 2. Create Categories
-        category_names = ['Electronics', 'Books', 'Apparel', 'Home Goods']
-        categories = []
-        for name in category_names:
-            category, created = Category.objects.get_or_create(
-                name=name, 
-                slug=name.lower().replace(' ', '-')
-            )
-            categories.append(category)
-        
-        self.stdout.write(self.style.SUCCESS(f'Created {len(categories)} categories.'))
-
-        # 3. Create 50 Products
-        products_to_create = []
-        for i in range(50):
-            product = Product(
-                name=fake.catch_phrase(),
-                price=round(random.uniform(10.00, 500.00), 2),
-                # Assign a random category from the list
-                category=random.choice(categories), 
-                digital=random.choice([True, False]),
+        if orders:
+            # Only data created by earlier runs
+            order_ids = list(
+                Order.objects.filter(customer__user__username__startswith=CUSTOMER_PREFIX).values_list('pk', flat=True)
             )
-            products_to_create.append(product)
+            self.delete_rows(OrderItem, 'order', order_ids)
+            ShippingAddress.objects.filter(order__in=order_ids).update(order=None)
+            self.delete_rows(Order, 'id', order_ids)
+            User.objects.filter(username__startswith=CUSTOMER_PREFIX).delete()
+            self.stdout.write(self.style.WARNING('Cleared previously generated customers and orders.'))
+
+    def delete_rows(self, model, field, values):
+        """Deletes the rows of `model` whose `field` is in `values`, with one plain DELETE per batch."""
+        table = connection.ops.quote_name(model._meta.db_table)
+        column = connection.ops.quote_name(model._meta.get_field(field).column)
+        with connection.cursor() as cursor:
+            for start in range(0, len(values), self.batch_size):
+                batch = values[start:start + self.batch_size]
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', batch)
+
+    def create_categories(self, count):
+        # 2. Create Categories: the classic four first, then uniquely numbered fake ones
+        fake = Faker()
+        fake.seed_instance(self.seed)
+        names = BASE_CATEGORIES[:count] + [
+            f'{fake.word().title()} {i}' for i in range(len(BASE_CATEGORIES), count)
+        ]
+        Category.objects.bulk_create(
+            [Category(name=name, slug=slugify(name)) for name in names],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,  # --append may find some already there
+        )
+        by_name = Category.objects.in_bulk(names, field_name='name')
+        self.stdout.write(self.style.SUCCESS(f'Created {len(names)} categories.'))
+        return [by_name[name] for name in names]
+
+    def create_products(self, count, categories):
+        # 3. Create Products in batches
+        created = 0
+        for rows in self.chunks('products', count, len(categories)):
+            Product.objects.bulk_create([
+                Product(
+                    name=name,
+                    price=Decimal(cents) / 100,
+                    digital=digital,
+                    category=categories[category_index],
+                )
+                for name, cents, digital, category_index in rows
+            ])
+            created += len(rows)
+            self.stdout.write(f'  products: {created}/{count}')
+        self.stdout.write(self.style.SUCCESS(f'Successfully generated {count} dummy products.'))
+
+    def create_customers(self, count):
+        """Creates users + customer profiles; returns the IDs of all generated customers."""
+        if count:
+            offset = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+            # Generated shoppers can't log in; hashing one password per row would dominate the run
+            password = make_password(None)
+            created = 0
+            for rows in self.chunks('customers', count):
+                with transaction.atomic():
+                    users = User.objects.bulk_create([
+                        User(username=f'{CUSTOMER_PREFIX}{offset + index}', email=email, password=password)
+                        for index, name, email in rows
+                    ])
+                    Customer.objects.bulk_create([
+                        Customer(user=user, name=name, email=email)
+                        for user, (index, name, email) in zip(users, rows)
+                    ])
+                created += len(rows)
+                self.stdout.write(f'  customers: {created}/{count}')
+            self.stdout.write(self.style.SUCCESS(f'Created {count} customers.'))
+
+        return list(
+            Customer.objects.filter(user__username__startswith=CUSTOMER_PREFIX).values_list('id', flat=True)
+        )
+
+    def create_orders(self, count, items_per_order, customer_ids):
+        """Creates completed orders with lines, spread over the last year, with stored totals."""
+        if not customer_ids:
+            raise CommandError('--orders needs customers: pass --customers or keep generated ones with --append.')
+
+        # Compact in-memory price list (in cents) for computing the stored order totals
+        product_ids, prices = array('q'), array('q')
+        for pk, price in Product.objects.values_list('id', 'price').iterator(chunk_size=self.batch_size):
+            product_ids.append(pk)
+            prices.append(int(price * 100))
+        if not product_ids:
+            raise CommandError('--orders needs products to put in them.')
+
+        rng = random.Random(self.seed)
+        now = timezone.now()
+        max_lines = max(1, min(items_per_order, len(product_ids)))
+        created = 0
 
-        Product.objects.bulk_create(products_to_create)
+        while created < count:
+            orders, order_lines = [], []
+            for _ in range(min(self.batch_size, count - created)):
+                picks = rng.sample(range(len(product_ids)), rng.randint(1, max_lines))
+                lines = [(product_ids[i], rng.randint(1, 5)) for i in picks]
+                order = Order(
+                    customer_id=rng.choice(customer_ids),
+                    complete=True,
+                    status='Paid',
+                    payment_method='Razorpay',
+                    transaction_id=f'LOADTEST-{self.seed}-{created + len(orders)}',
+                    item_count=sum(quantity for _, quantity in lines),
+                    subtotal=Decimal(sum(prices[i] * quantity for i, (_, quantity) in zip(picks, lines))) / 100,
+                )
+                # auto_now_add overrides this on insert; it's written back with bulk_update below
+                order.date_ordered = now - timedelta(seconds=rng.randrange(ORDER_HISTORY_DAYS * 86400))
+                orders.append(order)
+                order_lines.append(lines)
 
-        self.stdout.write(self.style.SUCCESS('Successfully generated 50 dummy products.'))
+            with transaction.atomic():
+                dates = [order.date_ordered for order in orders]
+                Order.objects.bulk_create(orders)
+                for order, date in zip(orders, dates):
+                    order.date_ordered = date
+                Order.objects.bulk_update(orders, ['date_ordered'])
+                OrderItem.objects.bulk_create([
+                    OrderItem(order_id=order.pk, product_id=product_id, quantity=quantity)
+                    for order, lines in zip(orders, order_lines)
+                    for product_id, quantity in lines
+                ])
+            created += len(orders)
+            self.stdout.write(f'  orders: {created}/{count}')
 
+        self.stdout.write(self.style.SUCCESS(f'Created {count} orders.'))
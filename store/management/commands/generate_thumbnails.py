@@ -0,0 +1,33 @@
+# store/management/commands/generate_thumbnails.py
+from django.core.management.base import BaseCommand
+from store.catalogue_cache import invalidate_catalogue
+from store.images import THUMBNAIL_ERRORS, thumbnails_are_current, update_thumbnails
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generates the responsive thumbnails for product images that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails that already exist.')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Products fetched per database round-trip.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('id', 'name', 'image', 'thumbnails')
+        generated = failed = 0
+
+        for product in products.iterator(chunk_size=options['chunk_size']):
+            if thumbnails_are_current(product) and not options['force']:
+                continue
+            try:
+                update_thumbnails(product)
+                generated += 1
+            except THUMBNAIL_ERRORS as exc:
+                # Missing, unreadable or oversized originals shouldn't stop the backfill
+                failed += 1
+                self.stderr.write(self.style.WARNING(f'Skipped product {product.id} ({product.image.name}): {exc}'))
+
+        if generated:
+            # Cached pages still reference the originals
+            invalidate_catalogue()
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {generated} products ({failed} failed).'))
@@ -0,0 +1,91 @@
+# store/management/commands/import_products.py
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalogue_import import (
+    BATCH_SIZE, IMAGE_WORKERS, CatalogueImporter, RowError, clean, feed_format, open_feed, read_records,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports products from a CSV or JSON Lines feed (optionally .gz) in one streaming pass, upserting '
+        'categories and products on sku in batches and fetching images in a thread pool. Progress is '
+        'checkpointed after every batch, so an interrupted import continues where it stopped with --resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('feed', help='Path of the CSV or JSONL feed.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Feed format; by default from the file name.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Rows per batch (default {BATCH_SIZE}).')
+        parser.add_argument('--image-root', help='Directory that local image paths in the feed are relative to.')
+        parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS,
+                            help=f'Threads fetching images (default {IMAGE_WORKERS}).')
+        parser.add_argument('--checkpoint', help='Progress file (default: <feed>.checkpoint).')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows a previous run already imported.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['image_workers'] < 1:
+            raise CommandError('--batch-size and --image-workers must be at least 1.')
+        feed = options['feed']
+        if not os.path.exists(feed):
+            raise CommandError(f'No such feed: {feed}')
+        checkpoint = options['checkpoint'] or f'{feed}.checkpoint'
+        done = self.load_checkpoint(checkpoint, feed) if options['resume'] else 0
+
+        importer = CatalogueImporter(options['image_root'], options['image_workers'])
+        started = time.monotonic()
+        position = flushed = done
+        batch = []
+        with open_feed(feed) as stream:
+            for position, record in enumerate(read_records(stream, options['format'] or feed_format(feed)), 1):
+                if position <= done:
+                    continue
+                try:
+                    batch.append(clean(record))
+                except RowError as exc:
+                    importer.stats['skipped'] += 1
+                    importer.note_error(position, str(exc))
+                if position - flushed >= options['batch_size']:
+                    self.flush(importer, batch, checkpoint, feed, position, started)
+                    batch, flushed = [], position
+            if position > flushed:
+                self.flush(importer, batch, checkpoint, feed, position, started)
+
+        importer.finish()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        for row_number, message in importer.errors:
+            self.stderr.write(self.style.WARNING(f'{"row " + str(row_number) if row_number else "warning"}: {message}'))
+        elapsed = time.monotonic() - started
+        stats = importer.stats
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["rows"]} products ({stats["skipped"]} rows skipped, {stats["images"]} images, '
+            f'{stats["image_errors"]} image errors) in {elapsed:.1f}s, {stats["rows"] / max(elapsed, 1e-6):.0f} rows/s.'
+        ))
+
+    def flush(self, importer, batch, checkpoint, feed, position, started):
+        if batch:
+            importer.import_batch(batch)
+        # Only written once the batch is in the database, so resuming never skips unsaved rows
+        with open(checkpoint, 'w') as f:
+            json.dump({'feed': os.path.abspath(feed), 'rows': position}, f)
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'  rows: {position} ({importer.stats["rows"] / max(elapsed, 1e-6):.0f} rows/s)')
+
+    def load_checkpoint(self, checkpoint, feed):
+        try:
+            with open(checkpoint) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            raise CommandError(f'Unreadable checkpoint {checkpoint}; delete it to start over.')
+        if state.get('feed') != os.path.abspath(feed):
+            raise CommandError(f'{checkpoint} belongs to {state.get("feed")}, not {feed}.')
+        self.stdout.write(f'Resuming after row {state["rows"]}.')
+        return state['rows']
@@ -0,0 +1,37 @@
+# store/management/commands/process_payment_events.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.payment_events import BATCH_SIZE, process_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Applies stored Razorpay webhook events to their orders in batches. Runs until the queue is '
+        'empty, or with --loop keeps polling for new events (the Procfile worker).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Events per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new events.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty, with --loop (default 1).')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                if options['loop']:
+                    # Like between requests: drop a connection that is broken or past CONN_MAX_AGE
+                    close_old_connections()
+                outcomes = process_pending(options['batch_size'])
+                if outcomes:
+                    summary = ', '.join(f'{outcome}={count}' for outcome, count in sorted(outcomes.items()))
+                    self.stdout.write(f'Processed {sum(outcomes.values())} events ({summary}).')
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,29 @@
+# store/management/commands/recalculate_order_totals.py
+from django.core.management.base import BaseCommand
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored item_count and subtotal of existing orders from their order lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--open-only', action='store_true', help='Only recompute open carts (complete=False).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of orders updated per statement.')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.order_by('pk')
+        if options['open_only']:
+            orders = orders.filter(complete=False)
+
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        # Walk the table by primary key so each UPDATE touches a bounded batch
+        while True:
+            pks = list(orders.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            updated += Order.objects.filter(pk__in=pks).recalculate_totals()
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Recalculated totals for {updated} orders.'))
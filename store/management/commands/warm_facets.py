@@ -0,0 +1,26 @@
+# store/management/commands/warm_facets.py
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from store.catalogue_cache import catalogue_key, catalogue_timeout
+from store.facets import build_cube
+from store.routers import primary_reads
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the cached facet counts (products per category, price bucket and type) so '
+        'listing pages never compute them on a request. Run it periodically, e.g. from cron.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with primary_reads():
+            cube = build_cube()
+        cache.set(catalogue_key('facet-cube'), cube, catalogue_timeout())
+        self.stdout.write(self.style.SUCCESS(
+            f'Cached {len(cube)} facet cells for {sum(cell[-1] for cell in cube)} products '
+            f'in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,186 @@
+# store/middleware.py
+"""
+Per-request query instrumentation.
+
+QueryInstrumentationMiddleware counts the SQL statements a request runs, how
+long they took, how many were repeats, and how long template rendering took
+(timed by TimedDjangoTemplates, the template backend configured in settings).
+Each request gets a Server-Timing header (visible in the browser dev tools) and
+one structured 'store.perf' log line. Views listed in settings.QUERY_BUDGETS
+get a query ceiling: going over it logs a warning, or raises
+QueryBudgetExceeded when settings.QUERY_BUDGET_RAISE is on (the test suite).
+
+The middleware works under WSGI and ASGI. Under ASGI, queries (from sync views
+and the async ORM alike) run on the request's sync thread, which has its own
+connections, so the query counter is installed on that thread's connections.
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger('store.perf')
+
+# The stats of the request being handled in this thread/task, read by the template timer
+_current = ContextVar('store_request_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []  # (sql, params) in execution order
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper() around every query
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries.append((sql, repr(params)))
+
+    @property
+    def duplicates(self):
+        """Statements re-run with identical SQL and parameters."""
+        return len(self.queries) - len(set(self.queries))
+
+    @property
+    def similar(self):
+        """Statements re-run with the same SQL but any parameters: the N+1 signature."""
+        return len(self.queries) - len({sql for sql, _ in self.queries})
+
+    def most_repeated(self):
+        sql, count = Counter(sql for sql, _ in self.queries).most_common(1)[0]
+        return sql, count
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with rendering time added to the current
+    request's stats. Only backend templates are timed: render() and
+    TemplateResponse go through one per page, while {% include %} and
+    {% extends %} render inside it and aren't counted twice.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+def _count_queries(stack, stats):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(stats))
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _count_queries(stack, stats)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        stack = ExitStack()
+        try:
+            # Entered and closed on the request's sync thread, where its queries run
+            await sync_to_async(_count_queries)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request, response, stats, total):
+        """Adds the Server-Timing header, logs the request and checks its query budget."""
+        match = request.resolver_match
+        if match is None:  # static files, 404s from the resolver
+            return response
+        view = match.view_name
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{len(stats.queries)} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        logger.info(
+            'view=%s method=%s status=%s queries=%d duplicates=%d similar=%d sql_ms=%.1f template_ms=%.1f total_ms=%.1f',
+            view, request.method, response.status_code, len(stats.queries), stats.duplicates, stats.similar,
+            stats.sql_time * 1000, stats.template_time * 1000, total * 1000,
+            extra={'perf': {
+                'view': view,
+                'method': request.method,
+                'status': response.status_code,
+                'queries': len(stats.queries),
+                'duplicates': stats.duplicates,
+                'similar': stats.similar,
+                'sql_ms': round(stats.sql_time * 1000, 1),
+                'template_ms': round(stats.template_time * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+            }},
+        )
+
+        self.check_budget(view, match.url_name, stats)
+        return response
+
+    def check_budget(self, view, url_name, stats):
+        budgets = getattr(settings, 'QUERY_BUDGETS', {})
+        budget = budgets.get(view, budgets.get(url_name))
+        if budget is None:
+            return
+        budget += getattr(settings, 'QUERY_BUDGET_EXTRA', 0)
+        if len(stats.queries) <= budget:
+            return
+
+        sql, count = stats.most_repeated()
+        message = (
+            f'{view} ran {len(stats.queries)} queries (budget {budget}); '
+            f'most repeated ({count}x): {sql[:200]}'
+        )
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
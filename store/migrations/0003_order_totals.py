@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:59
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    money = DecimalField(max_digits=10, decimal_places=2)
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(total=Sum('quantity')).values('total')), 0),
+        subtotal=Coalesce(
+            Subquery(lines.annotate(total=Sum(F('quantity') * F('product__price'), output_field=money)).values('total')),
+            Decimal('0.00'),
+            output_field=money,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_shippingaddress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:04
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Folds existing duplicates together so the new unique constraints can be added:
+    extra open carts are merged into the customer's newest one, then repeated
+    (order, product) lines are merged into one line with the summed quantity.
+    """
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+
+    customers = (
+        Order.objects.filter(complete=False, customer__isnull=False)
+        .values('customer').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('customer', flat=True)
+    )
+    touched = set()
+    for customer_id in customers:
+        keep, *extra = Order.objects.filter(customer=customer_id, complete=False).order_by('-date_ordered', '-id')
+        OrderItem.objects.filter(order__in=extra).update(order=keep)
+        Order.objects.filter(pk__in=[order.pk for order in extra]).delete()
+        touched.add(keep.pk)
+
+    duplicates = (
+        OrderItem.objects.filter(order__isnull=False, product__isnull=False)
+        .values('order', 'product').annotate(n=Count('id'), quantity=Sum('quantity')).filter(n__gt=1)
+    )
+    for row in duplicates:
+        keep, *extra = OrderItem.objects.filter(order=row['order'], product=row['product']).order_by('id')
+        OrderItem.objects.filter(pk=keep.pk).update(quantity=row['quantity'])
+        OrderItem.objects.filter(pk__in=[item.pk for item in extra]).delete()
+        touched.add(row['order'])
+
+    # Refresh the stored totals of the orders that changed
+    money = DecimalField(max_digits=10, decimal_places=2)
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.filter(pk__in=touched).update(
+        item_count=Coalesce(Subquery(lines.annotate(total=Sum('quantity')).values('total')), 0),
+        subtotal=Coalesce(
+            Subquery(lines.annotate(total=Sum(F('quantity') * F('product__price'), output_field=money)).values('total')),
+            Decimal('0.00'),
+            output_field=money,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('complete', True)), fields=['customer', 'date_ordered'], name='order_customer_history_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('complete', False)), fields=('customer',), name='one_open_order_per_customer'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
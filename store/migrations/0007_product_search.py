@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:10
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    # rowid is the product id; prefix indexes keep 2- and 3-letter prefix queries cheap
+    "CREATE VIRTUAL TABLE store_product_search USING fts5("
+    "name, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE store_product_search_vocab USING fts5vocab(store_product_search, 'row')",
+    "INSERT INTO store_product_search(rowid, name, category) "
+    "SELECT p.id, p.name, COALESCE(c.name, '') FROM store_product p "
+    "LEFT JOIN store_category c ON c.id = p.category_id",
+]
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS store_product_search_vocab',
+    'DROP TABLE IF EXISTS store_product_search',
+]
+
+# The to_tsvector expression must match SearchVector('name', config='simple') in store/search.py
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX IF NOT EXISTS product_name_search_idx ON store_product "
+    "USING GIN (to_tsvector('simple'::regconfig, COALESCE(name, '')))",
+    'CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON store_product USING GIN (name gin_trgm_ops)',
+]
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS product_name_trgm_idx',
+    'DROP INDEX IF EXISTS product_name_search_idx',
+]
+
+
+def run_for_vendor(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgres}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_thumbnails'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_BACKWARD, POSTGRES_BACKWARD),
+        ),
+    ]
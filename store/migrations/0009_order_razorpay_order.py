@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_order_id',
+            field=models.CharField(blank=True, max_length=40, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_receipt',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
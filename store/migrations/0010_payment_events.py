@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+def completed_orders_are_paid(apps, schema_editor):
+    # Orders completed before payments were tracked went through checkout; new ones start 'Open'.
+    # Cash on delivery orders (finalize_cod_order's COD- transaction ids) are still to be paid.
+    Order = apps.get_model('store', 'Order')
+    completed = Order.objects.filter(complete=True)
+    completed.filter(transaction_id__startswith='COD-').update(payment_method='COD', status='Pending')
+    completed.exclude(transaction_id__startswith='COD-').update(payment_method='Razorpay', status='Paid')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_order_razorpay_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='payment_method',
+            field=models.CharField(blank=True, choices=[('COD', 'Cash on delivery'), ('Razorpay', 'Razorpay')], default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('Open', 'Open'), ('Pending', 'Pending'), ('Paid', 'Paid'), ('Payment_Failed', 'Payment failed')], default='Open', max_length=20),
+        ),
+        migrations.RunPython(completed_orders_are_paid, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('event', models.CharField(max_length=64)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='payment_event_pending_idx')],
+            },
+        ),
+    ]
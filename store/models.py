@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from decimal import Decimal
@@ -24,9 +26,23 @@ class Category(models.Model):
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True) 
     name = models.CharField(max_length=200)
+    # The supplier's stock-keeping unit: what import_products matches rows on
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     price = models.DecimalField(max_digits=7, decimal_places=2)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
     digital = models.BooleanField(default=False, null=True, blank=False)
+    # Generated image widths, see images.py: {'source': name, 'width': w, 'widths': [...]}
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        # Support the keyset-paginated catalogue orderings (see pagination.SORT_ORDERS)
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='product_category_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -50,6 +66,22 @@ class Customer(models.Model):
     def __str__(self):
         return self.user.username
 
+class OrderQuerySet(models.QuerySet):
+    def recalculate_totals(self):
+        """
+        Recomputes item_count and subtotal from the order lines in a single UPDATE.
+        """
+        lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        item_count = lines.annotate(total=Sum('quantity')).values('total')
+        subtotal = lines.annotate(
+            total=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=10, decimal_places=2))
+        ).values('total')
+        return self.update(
+            item_count=Coalesce(Subquery(item_count), 0),
+            subtotal=Coalesce(Subquery(subtotal), Decimal('0.00'), output_field=DecimalField(max_digits=10, decimal_places=2)),
+        )
+
+
 # Model 3: Order (The Shopping Cart or Completed Purchase)
 class Order(models.Model):
     # Order linked to a User, can be null for Guest/Session Cart
@@ -58,24 +90,63 @@ class Order(models.Model):
     complete = models.BooleanField(default=False)
     # This ID will be used for Razorpay transactions
     transaction_id = models.CharField(max_length=100, null=True) 
+    # The gateway order paying for this order, and the idempotency key it was created with
+    razorpay_order_id = models.CharField(max_length=40, null=True, blank=True, unique=True)
+    razorpay_receipt = models.CharField(max_length=40, null=True, blank=True)
+
+    PAYMENT_METHODS = [('COD', 'Cash on delivery'), ('Razorpay', 'Razorpay')]
+    STATUSES = [
+        ('Open', 'Open'),
+        ('Pending', 'Pending'),
+        ('Paid', 'Paid'),
+        ('Payment_Failed', 'Payment failed'),
+    ]
+    payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUSES, default='Open')
     get_total_with_shipping = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Denormalized cart totals, kept in sync whenever an OrderItem changes
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Newest-first order history for a customer. Partial rather than (customer, complete,
+            # date_ordered): Django filters booleans as a bare `WHERE complete`, which SQLite
+            # can only match against an index's WHERE clause, not an indexed column.
+            models.Index(
+                fields=['customer', 'date_ordered'],
+                condition=models.Q(complete=True),
+                name='order_customer_history_idx',
+            ),
+        ]
+        constraints = [
+            # A customer has at most one open cart, so get_or_create can't race into duplicates
+            models.UniqueConstraint(
+                fields=['customer'],
+                condition=models.Q(complete=False),
+                name='one_open_order_per_customer',
+            ),
+        ]
 
     def __str__(self):
         return str(self.id)
     
     @property
     def get_cart_total(self):
-        """Calculates the total value of all items in the order."""
-        orderitems = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitems]) 
-        return total
+        """The total value of all items in the order (stored, no query)."""
+        return self.subtotal
     
     @property
     def get_cart_items(self):
-        """Calculates the total quantity of all items in the order (for the navbar count)."""
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        """The total quantity of all items in the order, for the navbar count (stored, no query)."""
+        return self.item_count
+
+    def update_totals(self):
+        """Recomputes the stored totals from the order lines and refreshes this instance."""
+        Order.objects.filter(pk=self.pk).recalculate_totals()
+        self.refresh_from_db(fields=['item_count', 'subtotal'])
     def get_total_with_shipping(self):
         """
         Calculates the final total, setting shipping to 0.00 (free).
@@ -87,6 +158,26 @@ class Order(models.Model):
         return subtotal + shipping_cost 
 
 
+class OrderItemQuerySet(models.QuerySet):
+    def for_order(self, order):
+        """
+        The lines of an order with their product loaded and line_total computed
+        in the database, so rendering a cart costs one query however long it is.
+        """
+        return self.filter(order=order).with_totals()
+
+    def with_totals(self):
+        """for_order() without the filter, e.g. to prefetch the lines of many orders."""
+        return (
+            self.select_related('product')
+            .annotate(line_total=ExpressionWrapper(
+                F('quantity') * F('product__price'),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            ))
+            .order_by('date_added', 'pk')
+        )
+
+
 # Model 4: OrderItem (A single product line item in an Order)
 class OrderItem(models.Model):
     # --- IMPORTANT: Using string references for local models to prevent E300 error ---
@@ -95,14 +186,61 @@ class OrderItem(models.Model):
     
     quantity = models.IntegerField(default=0, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One line per product in an order; quantity changes update the line
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_order_product'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Saving the line and refreshing the order totals (see signals.py) must succeed together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     @property
     def get_total(self):
         """Calculates the total price for a single order item."""
-        # Note: self.product will be the actual object once the ORM loads
+        # Lines loaded through OrderItem.objects.for_order() carry the DB-computed total
+        if hasattr(self, 'line_total'):
+            return self.line_total
         total = self.product.price * self.quantity
         return total
 
+
+class PaymentEvent(models.Model):
+    """
+    A payment gateway webhook delivery, stored as received and processed later
+    by the process_payment_events command (see payment_events.py).
+
+    Append-only: save() only inserts. The worker records its outcome with
+    queryset updates of processed_at/result; the payload is never changed.
+    """
+    # X-Razorpay-Event-Id: the gateway re-sends an event with the same id until it is acknowledged
+    event_id = models.CharField(max_length=64, unique=True)
+    event = models.CharField(max_length=64)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    result = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's queue: only unprocessed events are indexed
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='payment_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event} ({self.event_id})'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Payment events are append-only.')
+        super().save(*args, **kwargs)
+
+
 class ShippingAddress(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
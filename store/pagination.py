@@ -0,0 +1,113 @@
+# store/pagination.py
+"""
+Keyset (cursor) pagination for the catalogue listings and order history.
+
+Instead of OFFSET, each page remembers the sort key of its last row and the
+next page asks for rows strictly after it, so fetching page 500 costs the
+same index range scan as fetching page 1.
+"""
+from django.db.models import Q
+
+PAGE_SIZE = 24
+
+# Sort name -> ORDER BY. The last column must be unique so the cursor is exact.
+SORT_ORDERS = {
+    'newest': ('-id',),
+    'oldest': ('id',),
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'name_asc': ('name', 'id'),
+    'name_desc': ('-name', '-id'),
+}
+# Labels for the sort menu, in display order
+SORT_LABELS = (
+    ('newest', 'Newest'),
+    ('price_asc', 'Price: low to high'),
+    ('price_desc', 'Price: high to low'),
+    ('name_asc', 'Name: A to Z'),
+    ('name_desc', 'Name: Z to A'),
+    ('oldest', 'Oldest'),
+)
+DEFAULT_SORT = 'newest'
+
+# A customer's orders, newest first (see the order_customer_history_idx index)
+ORDER_HISTORY = ('-date_ordered', '-id')
+
+CURSOR_SEPARATOR = '_'
+
+
+def get_sort(value):
+    """Returns a known sort name, falling back to the default."""
+    return value if value in SORT_ORDERS else DEFAULT_SORT
+
+
+def encode_cursor(obj, ordering):
+    return CURSOR_SEPARATOR.join(str(getattr(obj, field.lstrip('-'))) for field in ordering)
+
+
+def decode_cursor(cursor, ordering, model):
+    """Turns a cursor string back into typed values; returns None if it is malformed."""
+    # Only the first column (e.g. a name) may contain the separator; the rest are numbers
+    parts = cursor.rsplit(CURSOR_SEPARATOR, len(ordering) - 1)
+    if len(parts) != len(ordering):
+        return None
+    try:
+        return [
+            model._meta.get_field(field.lstrip('-')).to_python(raw)
+            for field, raw in zip(ordering, parts)
+        ]
+    except Exception:
+        return None
+
+
+def rows_after(ordering, values):
+    """
+    Builds the "strictly after this row" filter for a multi-column ordering, e.g.
+    (price > p) OR (price = p AND id > i) for ('price', 'id').
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[i]})
+        for previous, value in zip(ordering[:i], values[:i]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+def _page_queryset(queryset, sort, cursor, ordering=None):
+    ordering = ordering or SORT_ORDERS[get_sort(sort)]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor, ordering, queryset.model)
+        if values is not None:
+            queryset = queryset.filter(rows_after(ordering, values))
+    return queryset, ordering
+
+
+def _finish_page(items, ordering, per_page):
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1], ordering)
+    return items, next_cursor
+
+
+def keyset_page(queryset, sort=DEFAULT_SORT, cursor=None, per_page=PAGE_SIZE, ordering=None):
+    """
+    Returns (items, next_cursor) for one page of the queryset.
+
+    next_cursor is None on the last page. An invalid cursor starts from the top.
+    `ordering` (e.g. ORDER_HISTORY) replaces the catalogue sort for other listings.
+    """
+    queryset, ordering = _page_queryset(queryset, sort, cursor, ordering)
+    # Fetch one extra row to know whether another page exists
+    return _finish_page(list(queryset[:per_page + 1]), ordering, per_page)
+
+
+async def akeyset_page(queryset, sort=DEFAULT_SORT, cursor=None, per_page=PAGE_SIZE, ordering=None):
+    """keyset_page() for async views."""
+    queryset, ordering = _page_queryset(queryset, sort, cursor, ordering)
+    return _finish_page([item async for item in queryset[:per_page + 1]], ordering, per_page)
@@ -0,0 +1,158 @@
+# store/payment_events.py
+"""
+Payment webhook ingestion and the worker that turns events into order updates.
+
+The webhook view only verifies the signature and stores the raw event
+(record_event: a single INSERT, redeliveries ignored), so a burst of
+deliveries during a sale costs the web workers next to nothing.
+process_pending(), run by the process_payment_events command, then applies
+the events in batches: one query for the pending events, one for their
+orders, one bulk UPDATE for the orders and one UPDATE per outcome for the
+events. Applying an event is idempotent: a replayed event, or a webhook
+arriving after the checkout redirect already finalized the order, changes
+nothing.
+
+An order is only marked Paid when the payment covers it: the amount and
+currency must match the order's current total, and the gateway order must
+have been created for that total (its receipt carries the amount). A
+payment for a cart that changed after the gateway order was created marks
+the order Payment_Failed and is logged for a refund.
+"""
+import logging
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, PaymentEvent
+from .payments import CURRENCY, amount_in_paise, idempotency_key
+
+logger = logging.getLogger('store.payments')
+
+PAID_EVENTS = ('payment.captured', 'order.paid')
+FAILED_EVENTS = ('payment.failed',)
+ORDER_FIELDS = ['complete', 'status', 'payment_method', 'transaction_id']
+BATCH_SIZE = 500
+
+
+def record_event(event_id, payload):
+    """Stores a verified webhook delivery; a redelivered event_id is ignored."""
+    event = PaymentEvent(event_id=event_id, event=str(payload.get('event', ''))[:64], payload=payload)
+    PaymentEvent.objects.bulk_create([event], ignore_conflicts=True)
+
+
+def event_refs(payload):
+    """(gateway order id, payment id) an event is about; either may be None."""
+    entities = payload.get('payload') or {}
+    payment = (entities.get('payment') or {}).get('entity') or {}
+    order = (entities.get('order') or {}).get('entity') or {}
+    return payment.get('order_id') or order.get('id'), payment.get('id')
+
+
+def event_amount(payload):
+    """(amount in paise, currency) an event reports as paid; (None, None) if it has none."""
+    entities = payload.get('payload') or {}
+    payment = (entities.get('payment') or {}).get('entity') or {}
+    order = (entities.get('order') or {}).get('entity') or {}
+    if 'amount' in payment:
+        return payment['amount'], payment.get('currency')
+    return order.get('amount_paid'), order.get('currency')
+
+
+def covers(order, amount, currency=CURRENCY):
+    """Whether a payment of `amount` `currency` through the order's gateway order pays for it."""
+    expected = amount_in_paise(order)
+    return (amount == expected and currency == CURRENCY
+            and order.razorpay_receipt == idempotency_key(order, expected))
+
+
+def receipt_amount(order):
+    """The amount the order's gateway order was created for, read from its receipt; None if unknown."""
+    prefix = idempotency_key(order, '')
+    receipt = order.razorpay_receipt or ''
+    if receipt.startswith(prefix) and receipt[len(prefix):].isdigit():
+        return int(receipt[len(prefix):])
+    return None
+
+
+def apply_event(order, event, payment_id, amount=None, currency=None):
+    """Applies one event to `order` in memory and returns the outcome recorded on the event."""
+    if event in PAID_EVENTS:
+        if order.status == 'Paid':
+            return 'duplicate'
+        if not covers(order, amount, currency):
+            logger.warning('Payment %s of %s %s does not cover order %s (total %s)',
+                           payment_id, amount, currency, order.pk, amount_in_paise(order))
+            order.status = 'Payment_Failed'
+            order.transaction_id = payment_id or order.transaction_id
+            return 'mismatch'
+        order.complete = True
+        order.status = 'Paid'
+        order.payment_method = 'Razorpay'
+        order.transaction_id = payment_id or order.transaction_id
+        return 'finalized'
+    if event in FAILED_EVENTS:
+        if order.status == 'Paid':
+            # A failed attempt reported after a later attempt succeeded
+            return 'ignored'
+        if order.status == 'Payment_Failed':
+            return 'duplicate'
+        order.status = 'Payment_Failed'
+        return 'failed'
+    return 'ignored'
+
+
+def mark_paid(order, payment_id):
+    """
+    Finalizes an order paid through the gateway unless that already happened;
+    a single conditional UPDATE, so it is safe to race with the worker. The
+    checkout signature covers the gateway order, so the amount paid is the one
+    in its receipt; if that no longer matches the total the order is marked
+    Payment_Failed instead and False is returned.
+    """
+    paid = Order.objects.filter(pk=order.pk).exclude(status='Paid')
+    if not covers(order, receipt_amount(order)):
+        logger.warning('Payment %s of %s does not cover order %s (total %s)',
+                       payment_id, receipt_amount(order), order.pk, amount_in_paise(order))
+        paid.update(status='Payment_Failed', transaction_id=payment_id)
+        return False
+    paid.update(complete=True, status='Paid', payment_method='Razorpay', transaction_id=payment_id)
+    return True
+
+
+def process_pending(batch_size=BATCH_SIZE):
+    """Applies up to `batch_size` pending events, oldest first. Returns a Counter of outcomes."""
+    with transaction.atomic():
+        events = PaymentEvent.objects.filter(processed_at__isnull=True).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Several workers can drain the queue side by side
+            events = events.select_for_update(skip_locked=True)
+        events = list(events[:batch_size])
+        if not events:
+            return Counter()
+
+        refs = {event.pk: event_refs(event.payload) for event in events}
+        orders = Order.objects.select_for_update().in_bulk(
+            {order_id for order_id, _ in refs.values() if order_id}, field_name='razorpay_order_id',
+        )
+
+        outcomes = defaultdict(list)
+        changed = {}
+        for event in events:
+            order_id, payment_id = refs[event.pk]
+            order = orders.get(order_id)
+            if order is None:
+                outcome = 'unknown_order'
+            else:
+                outcome = apply_event(order, event.event, payment_id, *event_amount(event.payload))
+                if outcome in ('finalized', 'failed', 'mismatch'):
+                    changed[order.pk] = order
+            outcomes[outcome].append(event.pk)
+
+        if changed:
+            Order.objects.bulk_update(changed.values(), ORDER_FIELDS)
+        now = timezone.now()
+        for outcome, pks in outcomes.items():
+            PaymentEvent.objects.filter(pk__in=pks).update(processed_at=now, result=outcome)
+
+    return Counter({outcome: len(pks) for outcome, pks in outcomes.items()})
@@ -0,0 +1,301 @@
+# store/payments.py
+"""
+The Razorpay payment gateway, as used by the checkout views.
+
+One RazorpayGateway per process wraps razorpay.Client around a pooled
+requests session, so gateway calls reuse keep-alive connections instead of
+opening a TLS connection per checkout. Every call is bounded by
+settings.RAZORPAY_TIMEOUT, and creating a gateway order as a whole, recovery
+lookup included, by settings.RAZORPAY_DEADLINE, which stays under the
+worker timeout. Only connection attempts that never reached the gateway are
+retried (with exponential backoff).
+
+Creating a gateway order is not a safe request to repeat blindly: a timed-out
+POST may still have created the order. Each attempt therefore carries an
+idempotency key derived from the Order ID and amount (sent as the Razorpay
+receipt), and an ambiguous failure is resolved by looking the receipt up
+(once, through the circuit breaker) before giving up. A checkout that reloads the payment page reuses the gateway
+order stored on the Order without calling the gateway at all.
+
+When the gateway keeps failing, a circuit breaker fails calls fast for a
+while instead of letting every checkout wait out its timeout, which is what
+exhausts the worker pool during a gateway latency spike.
+"""
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from decimal import Decimal
+
+import razorpay
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('store.payments')
+
+CURRENCY = 'INR'
+SHIPPING_FEE = Decimal('10.00')
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """The gateway timed out, failed, or the circuit breaker is open; safe to retry later."""
+
+
+class CircuitOpen(GatewayUnavailable):
+    """Raised without calling the gateway while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds; then lets one trial call through (half-open),
+    closing again if it succeeds. State is per process, like the pool.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == 'open':
+                raise CircuitOpen('Payment gateway temporarily unavailable (circuit open).')
+            if state == 'half-open':
+                # Only one trial call at a time: the others keep failing fast until it reports back
+                self.opened_at = self.clock()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    logger.warning('Payment gateway circuit opened after %d failures', self.failures)
+                self.opened_at = self.clock()
+
+
+class TimeoutSession(requests.Session):
+    """A session whose requests all get a default (connect, read) timeout."""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def build_session(timeout, retries, backoff, pool_size):
+    session = TimeoutSession(timeout)
+    retry = Retry(
+        total=retries,
+        # Only requests that never reached the gateway, which are safe to resend even as a
+        # POST; a slow or failed answer is left to RazorpayGateway and its deadline
+        connect=retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=backoff,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def amount_in_paise(order):
+    """The grand total shown on the review page, in the smallest currency unit Razorpay expects."""
+    return int((order.get_cart_total + SHIPPING_FEE) * 100)
+
+
+def idempotency_key(order, amount):
+    """The receipt for a gateway order: stable for an Order and amount, new when the cart changes."""
+    return f'order_{order.pk}_{amount}'
+
+
+class RazorpayGateway:
+    # Failures that say nothing about whether the gateway did the work. RequestException
+    # includes answers that aren't JSON, such as a proxy's HTML 502 page.
+    unavailable_errors = (requests.RequestException, razorpay.errors.ServerError, razorpay.errors.GatewayError)
+
+    def __init__(self, key_id, key_secret, base_url=None, timeout=(3.05, 10), retries=2,
+                 backoff=0.3, pool_size=10, breaker=None, deadline=20):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.session = build_session(timeout, retries, backoff, pool_size)
+        options = {'base_url': base_url} if base_url else {}
+        self.client = razorpay.Client(session=self.session, auth=(key_id, key_secret), **options)
+        self.breaker = breaker or CircuitBreaker()
+
+    def call(self, operation, *args, **kwargs):
+        self.breaker.before_call()
+        try:
+            result = operation(*args, **kwargs)
+        except self.unavailable_errors as exc:
+            self.breaker.record_failure()
+            raise GatewayUnavailable(f'Payment gateway error: {exc!r}') from exc
+        except razorpay.errors.BadRequestError as exc:
+            # The gateway is up; the request was wrong
+            self.breaker.record_success()
+            raise PaymentGatewayError(str(exc)) from exc
+        self.breaker.record_success()
+        return result
+
+    def timeout_until(self, deadline):
+        """
+        (connect, read) timeouts for one call that ends by `deadline` (a
+        time.monotonic() value), even if every connection attempt times out.
+        """
+        remaining = deadline - time.monotonic()
+        attempts = self.retries + 1
+        connect = min(self.timeout[0], remaining / (2 * attempts))
+        # urllib3 sleeps backoff * 2 ** (n - 1) before the nth retry; their sum stays under this
+        read = min(self.timeout[1], remaining - attempts * connect - self.backoff * 2 ** self.retries)
+        if read <= 0:
+            raise GatewayUnavailable('Payment gateway deadline exceeded.')
+        return connect, read
+
+    def find_order(self, receipt, timeout=None):
+        """The gateway order created with this receipt, or None."""
+        orders = self.client.order.all({'receipt': receipt}, timeout=timeout or self.timeout)
+        return next(iter(orders.get('items', [])), None)
+
+    def gateway_order(self, order, amount, receipt):
+        """
+        Creates (or finds) the gateway order for `receipt` and returns its id,
+        within self.deadline seconds. HTTP only, no ORM.
+        """
+        deadline = time.monotonic() + self.deadline
+        data = {'amount': amount, 'currency': CURRENCY, 'receipt': receipt, 'payment_capture': 1,
+                'notes': {'order_id': str(order.pk)}}
+        try:
+            return self.call(self.client.order.create, data, timeout=self.timeout_until(deadline))['id']
+        except CircuitOpen:
+            raise
+        except GatewayUnavailable as failure:
+            # The POST may have gone through before the failure, so look the receipt up once,
+            # in what is left of the deadline; an open circuit skips it
+            try:
+                created = self.call(self.find_order, receipt, self.timeout_until(deadline))
+            except PaymentGatewayError:
+                created = None
+            if created is None:
+                raise failure
+            logger.info('Recovered gateway order %s for receipt %s', created['id'], receipt)
+            return created['id']
+
+    def create_order(self, order, amount):
+        """
+        Returns the gateway order id for `order`, charging `amount` (in paise),
+        creating the gateway order at most once per idempotency key.
+        """
+        receipt = idempotency_key(order, amount)
+        if order.razorpay_order_id and order.razorpay_receipt == receipt:
+            return order.razorpay_order_id
+
+        order.razorpay_order_id = self.gateway_order(order, amount, receipt)
+        order.razorpay_receipt = receipt
+        order.save(update_fields=['razorpay_order_id', 'razorpay_receipt'])
+        return order.razorpay_order_id
+
+    async def acreate_order(self, order, amount):
+        """
+        create_order() for async views. The HTTP call runs outside the
+        request's sync thread, so a slow gateway holds neither the event loop
+        nor the thread the request's queries run on.
+        """
+        receipt = idempotency_key(order, amount)
+        if order.razorpay_order_id and order.razorpay_receipt == receipt:
+            return order.razorpay_order_id
+
+        order.razorpay_order_id = await sync_to_async(self.gateway_order, thread_sensitive=False)(
+            order, amount, receipt
+        )
+        order.razorpay_receipt = receipt
+        await order.asave(update_fields=['razorpay_order_id', 'razorpay_receipt'])
+        return order.razorpay_order_id
+
+    def verify_payment_signature(self, razorpay_order_id, payment_id, signature):
+        """True if the checkout callback was signed by the gateway for this order."""
+        try:
+            self.client.utility.verify_payment_signature({
+                'razorpay_order_id': razorpay_order_id,
+                'razorpay_payment_id': payment_id,
+                'razorpay_signature': signature,
+            })
+        except razorpay.errors.SignatureVerificationError:
+            return False
+        return True
+
+
+def verify_webhook_signature(body, signature):
+    """True if a webhook body (bytes) was signed with settings.RAZORPAY_WEBHOOK_SECRET."""
+    secret = getattr(settings, 'RAZORPAY_WEBHOOK_SECRET', '')
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, built from settings on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = RazorpayGateway(
+                    settings.RAZORPAY_KEY_ID,
+                    settings.RAZORPAY_KEY_SECRET,
+                    base_url=getattr(settings, 'RAZORPAY_BASE_URL', None),
+                    timeout=getattr(settings, 'RAZORPAY_TIMEOUT', (3.05, 10)),
+                    retries=getattr(settings, 'RAZORPAY_RETRIES', 2),
+                    pool_size=getattr(settings, 'RAZORPAY_POOL_SIZE', 10),
+                    deadline=getattr(settings, 'RAZORPAY_DEADLINE', 20),
+                    breaker=CircuitBreaker(
+                        getattr(settings, 'RAZORPAY_BREAKER_FAILURES', 5),
+                        getattr(settings, 'RAZORPAY_BREAKER_RESET', 30),
+                    ),
+                )
+    return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting.startswith('RAZORPAY_'):
+        _gateway = None
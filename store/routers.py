@@ -0,0 +1,151 @@
+# store/routers.py
+"""
+Read-replica routing.
+
+Catalogue reads (Product, Category) go to one of the replicas listed in
+settings.DATABASE_REPLICAS; every write, and every other read, goes to the
+primary ('default'). Order history is read from a replica explicitly, with
+.using(read_alias()), because the router can't tell a history read from a
+cart read.
+
+Replicas lag behind the primary, so routing is pinned to the primary once a
+request has written anything: for the rest of that request, and, through a
+short-lived cookie set by ReplicaPinningMiddleware, for the shopper's next few
+seconds of requests (typically the redirect after a POST). Data cached for
+longer than replication lag takes (the catalogue cache) is built inside
+primary_reads(), so a lagging replica can't put pre-change data under a
+freshly bumped catalogue version.
+"""
+import itertools
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_pin'
+
+# Routing state of the current request: {'pinned': reads go to the primary, 'wrote': this
+# request has written}. A mutable dict, so writes made inside sync_to_async threads (which
+# run in a copy of the context) are still seen by the middleware.
+_state = ContextVar('store_db_routing', default=None)
+_round_robin = {}
+# Set inside primary_reads(); a separate variable so concurrent tasks of one request don't share it
+_primary_reads = ContextVar('store_db_primary_reads', default=False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_to_primary():
+    state = _state.get()
+    if state is None:
+        # Outside a request (management commands, tests): pin this thread/task from now on
+        _state.set({'pinned': True, 'wrote': True})
+    else:
+        state['pinned'] = state['wrote'] = True
+
+
+def is_pinned():
+    if _primary_reads.get():
+        return True
+    state = _state.get()
+    return state is not None and state['pinned']
+
+
+@contextmanager
+def primary_reads():
+    """Sends the reads of this block to the primary, without pinning the rest of the request."""
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def choose_replica(aliases):
+    """Picks a replica according to settings.REPLICA_SELECTION ('random' or 'round_robin')."""
+    if getattr(settings, 'REPLICA_SELECTION', 'random') == 'round_robin':
+        key = tuple(aliases)
+        if key not in _round_robin:
+            _round_robin[key] = itertools.cycle(aliases)
+        return next(_round_robin[key])
+    return random.choice(aliases)
+
+
+def read_alias():
+    """The database to read from when replica lag is acceptable: a replica unless pinned."""
+    aliases = replicas()
+    if not aliases or is_pinned():
+        return PRIMARY
+    return choose_replica(aliases)
+
+
+class ReplicaRouter:
+    # 'app_label.model_name' of the models whose reads may be served by a replica
+    replica_models = {'store.product', 'store.category'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in self.replica_models:
+            return read_alias()
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # Everything read later in this request must see this write
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == PRIMARY
+
+
+class ReplicaPinningMiddleware:
+    """
+    Scopes replica pinning to one request, carrying it over to the following
+    requests for settings.REPLICA_PIN_SECONDS after a write.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = {'pinned': PIN_COOKIE in request.COOKIES, 'wrote': False}
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.carry_pin(response, state)
+
+    async def __acall__(self, request):
+        state = {'pinned': PIN_COOKIE in request.COOKIES, 'wrote': False}
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.carry_pin(response, state)
+
+    def carry_pin(self, response, state):
+        if state['wrote'] and replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,209 @@
+# store/search.py
+"""
+Product search over Product.name and Category.name.
+
+On SQLite the products are mirrored into an FTS5 table (store_product_search,
+rowid = product id), created by migration 0007 and kept in sync by signals.py.
+Every query word matches as a prefix. A word that matches nothing is swapped
+for its closest indexed spellings (fts5vocab + difflib). Results are ranked with
+bm25, with name matches weighted above category matches.
+
+On PostgreSQL the same API uses to_tsvector/to_tsquery prefix matching, plus
+the pg_trgm % operator for typos, each served by its GIN index from migration
+0007; category matches are resolved to category ids first, so every branch of
+the OR is an indexed condition on store_product and the planner can combine
+them with a BitmapOr instead of scanning the table. Other databases fall back
+to a plain icontains filter.
+"""
+import difflib
+import re
+
+from django.db import connection
+from django.db.models import F, Q, Value
+
+from .models import Category, Product
+from .pagination import PAGE_SIZE
+
+SEARCH_TABLE = 'store_product_search'
+VOCAB_TABLE = 'store_product_search_vocab'
+# Name matches count five times as much as category matches
+NAME_WEIGHT, CATEGORY_WEIGHT = 10.0, 2.0
+MAX_TERMS = 8
+# Words shorter than this are only prefix-matched, never spell-corrected
+TYPO_MIN_LENGTH = 4
+TYPO_CANDIDATES = 3
+TYPO_CUTOFF = 0.75
+
+WORD_RE = re.compile(r'\w+')
+
+
+def terms(query):
+    """The lowercased words of a query, at most MAX_TERMS of them."""
+    return WORD_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def uses_fts5():
+    return connection.vendor == 'sqlite'
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+# --- Index maintenance (SQLite; PostgreSQL indexes the table columns directly) ---
+
+INDEX_SELECT = (
+    'SELECT p.id, p.name, COALESCE(c.name, \'\') FROM store_product p '
+    'LEFT JOIN store_category c ON c.id = p.category_id'
+)
+
+
+def _chunks(product_ids, size=500):
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), size):
+        chunk = product_ids[start:start + size]
+        yield chunk, ', '.join(['%s'] * len(chunk))
+
+
+def index_products(product_ids):
+    """(Re)indexes the given products; ids that no longer exist are dropped from the index."""
+    if not uses_fts5():
+        return
+    with connection.cursor() as cursor:
+        for chunk, placeholders in _chunks(product_ids):
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE}(rowid, name, category) {INDEX_SELECT} WHERE p.id IN ({placeholders})',
+                chunk,
+            )
+
+
+def unindex_products(product_ids):
+    if not uses_fts5():
+        return
+    with connection.cursor() as cursor:
+        for chunk, placeholders in _chunks(product_ids):
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+
+
+def rebuild_index():
+    """Re-creates the whole index in two statements. Run it after bulk imports."""
+    if not uses_fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(f'INSERT INTO {SEARCH_TABLE}(rowid, name, category) {INDEX_SELECT}')
+
+
+# --- Querying ---
+
+def _close_spellings(cursor, term):
+    """Indexed words spelled like `term`, looked up among those sharing its first letter."""
+    cursor.execute(
+        f'SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s',
+        [term[0], chr(ord(term[0]) + 1)],
+    )
+    vocabulary = [row[0] for row in cursor.fetchall()]
+    return difflib.get_close_matches(term, vocabulary, TYPO_CANDIDATES, TYPO_CUTOFF)
+
+
+def _fts_match(cursor, words):
+    """Builds the FTS5 MATCH expression: every word as a prefix, or else its close spellings."""
+    clauses = []
+    for word in words:
+        if len(word) >= TYPO_MIN_LENGTH:
+            cursor.execute(
+                f'SELECT 1 FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s LIMIT 1',
+                [word, word + '\uffff'],
+            )
+            if cursor.fetchone() is None:
+                spellings = _close_spellings(cursor, word)
+                if spellings:
+                    clauses.append('(' + ' OR '.join(f'"{s}"' for s in spellings) + ')')
+                    continue
+        clauses.append(f'"{word}"*')
+    return ' AND '.join(clauses)
+
+
+def _fts_ids(words, limit, offset):
+    with connection.cursor() as cursor:
+        match = _fts_match(cursor, words)
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY bm25({SEARCH_TABLE}, %s, %s), rowid LIMIT %s OFFSET %s',
+            [match, NAME_WEIGHT, CATEGORY_WEIGHT, limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def postgres_matches(words):
+    """The products matching `words` on PostgreSQL, best first, as a queryset."""
+    from django.contrib.postgres.lookups import TrigramSimilar
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+
+    # Must match the expressions of the GIN indexes in migration 0007
+    vector = SearchVector('name', config='simple')
+    query = SearchQuery(' & '.join(f'{word}:*' for word in words), config='simple', search_type='raw')
+    text = ' '.join(words)
+    # Categories are few: matching them by name first leaves an indexed category_id = ANY(...)
+    category_ids = list(Category.objects.filter(name__icontains=text).values_list('id', flat=True))
+    return (
+        Product.objects.annotate(
+            search=vector,
+            similarity=TrigramSimilarity('name', text),
+            rank=SearchRank(vector, query),
+        )
+        .filter(
+            Q(search=query)
+            # name % text: pg_trgm's similarity_threshold (0.3 by default), served by the trigram index.
+            # An explicit lookup, as name__trigram_similar only exists with django.contrib.postgres installed
+            | Q(TrigramSimilar(F('name'), Value(text)))
+            | Q(category_id__in=category_ids)
+        )
+        .order_by('-rank', '-similarity', 'id')
+    )
+
+
+def _postgres_ids(words, limit, offset):
+    return list(postgres_matches(words).values_list('id', flat=True)[offset:offset + limit])
+
+
+def _fallback_ids(words, limit, offset):
+    condition = Q()
+    for word in words:
+        condition &= Q(name__icontains=word) | Q(category__name__icontains=word)
+    return list(Product.objects.filter(condition).order_by('id').values_list('id', flat=True)[offset:offset + limit])
+
+
+def search_ids(query, limit, offset=0):
+    """Ranked ids of the products matching `query`."""
+    words = terms(query)
+    if not words:
+        return []
+    if uses_fts5():
+        return _fts_ids(words, limit, offset)
+    if uses_postgres():
+        return _postgres_ids(words, limit, offset)
+    return _fallback_ids(words, limit, offset)
+
+
+def search_products(query, page=1, per_page=PAGE_SIZE):
+    """Returns (products, has_next) for one page of results, best match first."""
+    offset = (page - 1) * per_page
+    # One extra id tells whether another page exists
+    ids = search_ids(query, per_page + 1, offset)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    by_id = Product.objects.select_related('category').in_bulk(ids)
+    return [by_id[pk] for pk in ids if pk in by_id], has_next
+
+
+def autocomplete(query, limit=8):
+    """Top matches as small dicts for the search box suggestions."""
+    ids = search_ids(query, limit)
+    rows = Product.objects.filter(pk__in=ids).values('id', 'name', 'category__name')
+    by_id = {row['id']: row for row in rows}
+    return [
+        {'id': pk, 'name': by_id[pk]['name'], 'category': by_id[pk]['category__name'] or ''}
+        for pk in ids if pk in by_id
+    ]
@@ -0,0 +1,123 @@
+# store/signals.py
+import logging
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .backends import forget_user
+from .cart import refreshes_totals
+from .catalogue_cache import invalidate_catalogue
+from .images import THUMBNAIL_ERRORS, thumbnails_are_current, update_thumbnails
+from .search import index_products, unindex_products
+from .models import Category, Customer, Order, OrderItem, Product
+from .suggestions import forget_category_pool
+from .utils import forget_cart_product
+
+logger = logging.getLogger('store.images')
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    """Keeps Order.item_count / Order.subtotal in sync with the order lines."""
+    if not instance.order_id or refreshes_totals(instance.order_id):
+        return
+    if OrderItem.order.is_cached(instance):
+        # Refresh the loaded order too, so the caller sees the new totals
+        instance.order.update_totals()
+    else:
+        Order.objects.filter(pk=instance.order_id).recalculate_totals()
+
+
+@receiver(post_save, sender=Product)
+def update_open_order_totals(sender, instance, created, **kwargs):
+    """A price change must be reflected in every open cart holding the product."""
+    if not created:
+        Order.objects.filter(complete=False, orderitem__product=instance).recalculate_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_cart_product_cache(sender, instance, **kwargs):
+    forget_cart_product(instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_category(sender, instance, raw=False, using=None, **kwargs):
+    # A product moved to another category must leave that category's suggestion pool too
+    if not raw and not instance._state.adding:
+        instance._previous_category_id = (
+            Product.objects.using(using).filter(pk=instance.pk).values_list('category_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_suggestion_pool(sender, instance, **kwargs):
+    forget_category_pool(instance.category_id)
+    previous = getattr(instance, '_previous_category_id', instance.category_id)
+    if previous != instance.category_id:
+        forget_category_pool(previous)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def refresh_catalogue_cache(sender, instance, **kwargs):
+    invalidate_catalogue()
+
+
+@receiver(post_save, sender=Product)
+def generate_product_thumbnails(sender, instance, raw=False, **kwargs):
+    """Builds the responsive image sizes when a product gets a new image."""
+    if not raw and instance.image and not thumbnails_are_current(instance):
+        try:
+            update_thumbnails(instance)
+        except THUMBNAIL_ERRORS as exc:
+            # An unreadable upload keeps the original only; it shouldn't fail the save
+            logger.warning('Skipped thumbnails for product %s (%s): %s', instance.pk, instance.image.name, exc)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    """A renamed category changes what its products match."""
+    if not created and not raw:
+        index_products(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # Deleting the category nulls product.category with a bulk UPDATE, which sends no signals
+    instance._search_product_ids = list(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorised_products(sender, instance, **kwargs):
+    index_products(getattr(instance, '_search_product_ids', []))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_cached_user(sender, instance, **kwargs):
+    """The logged-in user is cached with its profile (see backends.py)."""
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def refresh_cached_customer(sender, instance, **kwargs):
+    if instance.user_id:
+        forget_user(instance.user_id)
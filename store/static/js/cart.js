@@ -13,50 +13,78 @@ function getCookie(name) {
 }
 
 // 2. Main function to update the user's cart (order)
-function updateUserOrder(productId, action) {
-    console.log('Sending data to backend...');
-
+//    action: 'add' (increment by quantity), 'set' (replace quantity) or 'remove'
+function updateUserOrder(productId, action, quantity) {
     var url = '/update_item/'; // The URL we'll define in urls.py
+    var payload = {'productId': productId, 'action': action};
+    if (quantity !== undefined) {
+        payload.quantity = quantity;
+    }
 
-    fetch(url, {
+    return fetch(url, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
             'X-CSRFToken': getCookie('csrftoken'), // CSRF Token is mandatory for POST requests
         },
-        body: JSON.stringify({'productId': productId, 'action': action})
+        body: JSON.stringify(payload)
     })
     .then((response) => {
         return response.json();
     })
     .then((data) => {
-        // Update the cart count in the navbar with the count from the Django response
-        document.getElementById('cart-count').innerText = data.cart_items;
-        console.log('Cart updated. New count:', data.cart_items);
-        
-        // Optional: If the user is on the cart page, reload it to show the change
-        if (window.location.pathname.includes('/cart/')) {
-             window.location.reload(); 
+        if (data.error) {
+            alert(data.error);
+            return data;
         }
+        // Update the cart count in the navbar with the count from the Django response
+        document.getElementById('cart-count').innerText = data.cart.item_count;
+        renderCartTotals(data);
+        return data;
     });
 }
 
+// Refreshes the cart page (if we're on it) from an API response, without a reload
+function renderCartTotals(data) {
+    var subtotal = document.getElementById('cart-subtotal');
+    if (!subtotal) {
+        return;
+    }
+    subtotal.innerText = '$' + data.cart.subtotal;
+    document.getElementById('cart-total').innerText = '$' + data.cart.total;
+
+    if (data.line) {
+        var row = document.querySelector('[data-cart-line="' + data.line.product_id + '"]');
+        if (row && data.line.quantity === 0) {
+            row.remove();
+        } else if (row) {
+            row.querySelector('.line-total').innerText = '$' + data.line.line_total;
+            row.querySelector('input[name="quantity"]').value = data.line.quantity;
+        }
+    }
+}
+
 // 3. Attach click handlers to all "Add to Cart" buttons
+//    (delegated, so cards appended later by infinite scroll work too)
 document.addEventListener('DOMContentLoaded', function() {
-    var updateBtns = document.getElementsByClassName('update-cart');
-
-    for (var i = 0; i < updateBtns.length; i++) {
-        updateBtns[i].addEventListener('click', function() {
-            var productId = this.dataset.product;
-            var action = this.dataset.action;
-            
-            if (user === 'AnonymousUser') {
-                alert('Please log in or implement session cart for guests!');
-            } else {
-                updateUserOrder(productId, action);
-            }
-        });
-    }
+    document.addEventListener('click', function(event) {
+        var button = event.target.closest('.update-cart');
+        if (!button) {
+            return;
+        }
+        // Guests too: their cart is kept in a signed cookie set by the server
+        updateUserOrder(button.dataset.product, button.dataset.action);
+    });
+
+    // Quantity forms on the cart page go through the JSON API when JS is available
+    document.addEventListener('submit', function(event) {
+        var form = event.target.closest('.cart-quantity-form');
+        if (!form) {
+            return;
+        }
+        event.preventDefault();
+        updateUserOrder(form.dataset.product, 'set', parseInt(form.quantity.value, 10) || 0);
+    });
 
     // Initialize cart count on load using the context value
     document.getElementById('cart-count').innerText = initialCartCount; 
@@ -0,0 +1,39 @@
+// store/static/js/search.js
+
+// Fills the navbar search box's <datalist> from the autocomplete endpoint while typing.
+// Requests are debounced, and a response for an outdated query is ignored.
+document.addEventListener('DOMContentLoaded', function () {
+    var input = document.querySelector('input[data-autocomplete-url]');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var latest = '';
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        var query = input.value.trim();
+        if (query.length < 2) {
+            list.innerHTML = '';
+            return;
+        }
+        timer = setTimeout(function () {
+            latest = query;
+            fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (query !== latest) {
+                        return;
+                    }
+                    list.innerHTML = '';
+                    data.results.forEach(function (result) {
+                        var option = document.createElement('option');
+                        option.value = result.name;
+                        option.label = result.category;
+                        list.appendChild(option);
+                    });
+                });
+        }, 150);
+    });
+});
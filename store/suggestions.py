@@ -0,0 +1,52 @@
+# store/suggestions.py
+"""
+Random "You may also like" suggestions without ORDER BY RANDOM().
+
+Each category keeps a cached pool of product IDs, shuffled once when the pool
+is built. A product page samples from that pool in Python and loads the few
+chosen rows by primary key, so the cost doesn't grow with the category.
+"""
+import random
+
+from django.core.cache import cache
+
+from .models import Product
+
+SUGGESTION_COUNT = 4
+# Largest pool kept per category; bigger categories rotate through it via the timeout
+POOL_SIZE = 500
+POOL_TIMEOUT = 60 * 60
+
+
+def pool_cache_key(category_id):
+    return f'store:suggestion-pool:{category_id}'
+
+
+def category_pool(category_id):
+    """Returns the cached list of product IDs suggestions are drawn from."""
+    key = pool_cache_key(category_id)
+    pool = cache.get(key)
+    if pool is None:
+        # The only random sort, paid once per pool rebuild instead of once per page view
+        pool = list(
+            Product.objects.filter(category=category_id)
+            .order_by('?')
+            .values_list('id', flat=True)[:POOL_SIZE]
+        )
+        cache.set(key, pool, POOL_TIMEOUT)
+    return pool
+
+
+def forget_category_pool(category_id):
+    cache.delete(pool_cache_key(category_id))
+
+
+def suggested_products(product, count=SUGGESTION_COUNT):
+    """Returns up to `count` random products from the same category, excluding `product`."""
+    pool = category_pool(product.category_id)
+    # Sample one extra in case the product itself is picked
+    picked = [pk for pk in random.sample(pool, min(count + 1, len(pool))) if pk != product.pk][:count]
+    if not picked:
+        return []
+    products = Product.objects.select_related('category').in_bulk(picked)
+    return [products[pk] for pk in picked if pk in products]
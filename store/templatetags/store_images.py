@@ -0,0 +1,35 @@
+# store/templatetags/store_images.py
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..images import THUMBNAIL_FORMATS, srcset, thumbnails_are_current
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', **attrs):
+    """
+    Renders a responsive <picture> for product.image: a WebP <source> and a
+    JPEG <img> srcset built from the generated thumbnails, so the browser only
+    downloads the width it needs. Extra keyword arguments become <img> attributes:
+
+        {% product_image product sizes="300px" class="card-img-top" alt=product.name %}
+
+    Products whose thumbnails haven't been generated yet (or are out of date)
+    fall back to the original.
+    """
+    attrs.setdefault('alt', product.name)
+    attrs.setdefault('loading', 'lazy')
+    img_attrs = format_html_join(' ', '{}="{}"', attrs.items())
+
+    if not product.thumbnails.get('widths') or not thumbnails_are_current(product):
+        return format_html('<img src="{}" {}>', product.image.url, img_attrs)
+
+    extension, _, mime_type = THUMBNAIL_FORMATS[0]
+    return format_html(
+        '<picture><source type="{}" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        mime_type, srcset(product, extension), sizes,
+        product.image.url, srcset(product, 'jpg'), sizes, img_attrs,
+    )
@@ -1,3 +1,1689 @@
-from django.test import TestCase
+import contextvars
+import csv
+import gzip
+import importlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+from contextlib import redirect_stdout
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_delete
+from django.template import Context, Template, engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from PIL import Image
+
+from . import (async_views, benchmarks, cart, exports, facets, guest_cart, images, payment_events, payments,
+               routers, search, suggestions, utils)
+from .backends import CachedUserBackend
+from .catalogue_cache import cached_catalogue, catalogue_key
+from .context_processors import cart_context
+from .exports import HEADER
+from .fake_razorpay import FakeRazorpay
+from .middleware import QueryBudgetExceeded, RequestStats
+from .models import Category, Customer, Order, OrderItem, PaymentEvent, Product, ShippingAddress
+from .pagination import PAGE_SIZE
+from .utils import cart_data, cookie_cart
+
+# Views over their settings.QUERY_BUDGETS fail the tests, whichever runner runs them. The
+# budgets hold for the shared-cache setup, which the test process's one cache stands in for.
+_enforce_query_budgets = override_settings(
+    QUERY_BUDGET_RAISE=True,
+    QUERY_BUDGET_EXTRA=0,
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    AUTHENTICATION_BACKENDS=['store.backends.CachedUserBackend'],
+)
+
+
+def setUpModule():
+    _enforce_query_budgets.enable()
+
+
+def tearDownModule():
+    _enforce_query_budgets.disable()
+
+
+class CartDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'pass')
+        cls.customer = Customer.objects.create(user=cls.user, name='shopper', email='shopper@example.com')
+        cls.category = Category.objects.create(name='Books')
+        cls.product = Product.objects.create(category=cls.category, name='Novel', price='12.50')
+        cls.order = Order.objects.create(customer=cls.customer)
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.COOKIES = {}
+        return request
+
+    def test_cart_is_resolved_once_per_request(self):
+        request = self.get_request()
+        with self.assertNumQueries(1):
+            data = cart_data(request)
+            context = cart_context(request)
+            self.assertIs(cart_data(request), data)
+        self.assertEqual(context['cart_items_count'], 3)
+        self.assertEqual(data['order'], self.order)
+
+    def test_missing_customer_and_order_are_created(self):
+        user = User.objects.create_user('newcomer', 'new@example.com', 'pass')
+        request = self.get_request()
+        request.user = user
+        data = cart_data(request)
+        self.assertEqual(data['customer'].user, user)
+        self.assertFalse(data['order'].complete)
+        self.assertEqual(data['cart_items_count'], 0)
+
+    def test_homepage_renders_with_shared_cart(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cart_items_count'], 3)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Product.objects.create(name='Novel', price='12.50')
+        cls.pen = Product.objects.create(name='Pen', price='2.00')
+
+    def setUp(self):
+        self.order = Order.objects.create()
+
+    def assertTotals(self, item_count, subtotal):
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.get_cart_items, item_count)
+        self.assertEqual(self.order.get_cart_total, Decimal(subtotal))
+
+    def test_totals_follow_line_changes(self):
+        line = OrderItem.objects.create(order=self.order, product=self.book, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.pen, quantity=5)
+        self.assertTotals(7, '35.00')
+
+        line.quantity = 1
+        line.save()
+        self.assertTotals(6, '22.50')
+
+        line.delete()
+        self.assertTotals(5, '10.00')
+
+        OrderItem.objects.filter(order=self.order).delete()
+        self.assertTotals(0, '0.00')
+
+    def test_price_change_updates_open_carts_only(self):
+        OrderItem.objects.create(order=self.order, product=self.book, quantity=2)
+        closed = Order.objects.create(complete=True)
+        OrderItem.objects.create(order=closed, product=self.book, quantity=1)
+
+        self.book.price = Decimal('20.00')
+        self.book.save()
+
+        self.assertTotals(2, '40.00')
+        closed.refresh_from_db()
+        self.assertEqual(closed.subtotal, Decimal('12.50'))
+
+    def test_recalculate_command(self):
+        OrderItem.objects.create(order=self.order, product=self.book, quantity=2)
+        Order.objects.update(item_count=0, subtotal=0)
+
+        call_command('recalculate_order_totals', stdout=StringIO())
+        self.assertTotals(2, '25.00')
+
+
+class CartRenderingQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bulkbuyer', 'bulk@example.com', 'pass')
+        customer = Customer.objects.create(user=cls.user, name='bulkbuyer', email='bulk@example.com')
+        cls.order = Order.objects.create(customer=customer)
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('1.25') * (i + 1)) for i in range(50)
+        )
+
+    def count_queries(self, url_name):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cart_query_count_is_independent_of_line_count(self):
+        OrderItem.objects.create(order=self.order, product=self.products[0], quantity=1)
+        single_line = {name: self.count_queries(name) for name in ('store:cart', 'store:checkout')}
+
+        for product in self.products[1:]:
+            OrderItem.objects.create(order=self.order, product=product, quantity=2)
+        fifty_lines = {name: self.count_queries(name) for name in ('store:cart', 'store:checkout')}
+
+        self.assertEqual(single_line, fifty_lines)
+
+    def test_line_totals_are_computed_in_the_database(self):
+        OrderItem.objects.create(order=self.order, product=self.products[3], quantity=4)
+        with self.assertNumQueries(1):
+            totals = [item.get_total for item in OrderItem.objects.for_order(self.order)]
+        self.assertEqual(totals, [Decimal('20.00')])
+
+
+class AuthenticationCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('regular', 'regular@example.com', 'pass')
+        cls.customer = Customer.objects.create(user=cls.user, name='Regular', email='regular@example.com')
+        Order.objects.create(customer=cls.customer)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_user_is_loaded_with_its_customer_and_cached(self):
+        backend = CachedUserBackend()
+        with self.assertNumQueries(1):
+            user = backend.get_user(self.user.pk)
+            self.assertEqual(user.customer.name, 'Regular')
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk).customer.pk, self.customer.pk)
+
+        # Profile and account changes are seen on the next request
+        self.customer.name = 'Renamed'
+        self.customer.save()
+        self.assertEqual(backend.get_user(self.user.pk).customer.name, 'Renamed')
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    def test_logged_in_requests_skip_the_session_and_user_queries(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:cart'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('store:cart'))
+        self.assertEqual(response.context['user'], self.user)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"django_session"', tables)
+        self.assertNotIn('"auth_user"', tables)
+        self.assertEqual(len(queries), 2)  # the open order and its lines
+
+    def test_password_change_ends_other_sessions(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('store:cart'))
+        self.user.set_password('new password')
+        self.user.save()
+        self.assertFalse(self.client.get(reverse('store:cart')).context['user'].is_authenticated)
+
+
+class GuestCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('2.00'), digital=True) for i in range(30)
+        )
+
+    def setUp(self):
+        utils._cart_product_cache.clear()
+
+    def get_request(self, cart):
+        request = RequestFactory().get('/')
+        request.COOKIES['cart'] = json.dumps(cart)
+        return request
+
+    def test_products_are_loaded_in_one_query(self):
+        cart = {str(product.id): 1 for product in self.products}
+        cart['999999'] = 4  # deleted product, dropped silently
+        with self.assertNumQueries(1):
+            data = cookie_cart(self.get_request(cart))
+        self.assertEqual(len(data['items']), 30)
+        self.assertEqual(data['cart_items_count'], 30)
+        self.assertEqual(data['order']['get_cart_total'], Decimal('60.00'))
+        self.assertFalse(data['order']['shipping'])
+
+    @override_settings(CART_PRODUCT_CACHE_TTL=60)
+    def test_cached_products_skip_the_database(self):
+        cart = {str(self.products[0].id): 2}
+        cookie_cart(self.get_request(cart))
+        with self.assertNumQueries(0):
+            data = cookie_cart(self.get_request(cart))
+        self.assertEqual(data['cart_items_count'], 2)
+
+        # Saving the product evicts it, so the new price is picked up
+        self.products[0].price = Decimal('5.00')
+        self.products[0].save()
+        data = cookie_cart(self.get_request(cart))
+        self.assertEqual(data['order']['get_cart_total'], Decimal('10.00'))
+
+    def test_signed_compact_format(self):
+        quantities = {self.products[0].id: 2, self.products[1].id: 1}
+        response = HttpResponse()
+        request = RequestFactory().get('/')
+        guest_cart.set_cart(request, quantities)
+        guest_cart.write_cookie(request, response)
+        value = response.cookies['cart'].value
+        self.assertTrue(value.startswith(f'1:{self.products[0].id}-2.{self.products[1].id}-1:'))
+
+        request = RequestFactory().get('/')
+        request.COOKIES['cart'] = value
+        self.assertEqual(guest_cart.read_cart(request), quantities)
+        self.assertEqual(cookie_cart(request)['cart_items_count'], 3)
+
+        # A tampered cookie is not trusted, and not mistaken for a legacy one
+        request = RequestFactory().get('/')
+        request.COOKIES['cart'] = value.replace('-2.', '-9.')
+        self.assertEqual(guest_cart.read_cart(request), {})
+
+    def test_cookie_is_parsed_once_per_request(self):
+        request = self.get_request({str(self.products[0].id): 2})
+        self.assertIs(guest_cart.read_cart(request), guest_cart.read_cart(request))
+
+    def test_guests_update_the_cart_through_the_api(self):
+        url = reverse('store:update_item')
+        response = self.client.post(url, {'productId': self.products[0].id, 'action': 'add', 'quantity': 2},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['cart'], {'item_count': 2, 'subtotal': '4.00', 'total': '14.00'})
+        response = self.client.post(url, {'productId': self.products[0].id, 'action': 'remove'},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['line'], {'product_id': self.products[0].id, 'quantity': 0,
+                                                   'line_total': '0.00'})
+        self.assertEqual(response.cookies['cart'].value, '')  # deleted
+
+    def test_login_merges_the_guest_cart_in_one_transaction(self):
+        user = User.objects.create_user('shopper', 'shopper@example.com', 'pass')
+        customer = Customer.objects.create(user=user, name='Shopper', email='shopper@example.com')
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=order, product=self.products[0], quantity=1)
+
+        self.client.post(reverse('store:update_items'), {'items': [
+            {'productId': product.id, 'quantity': 2} for product in self.products[:10]
+        ]}, content_type='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('store:login'), {'username': 'shopper', 'password': 'pass'})
+        self.assertRedirects(response, reverse('store:home'), fetch_redirect_response=False)
+        self.assertEqual(response.cookies['cart'].value, '')
+        # Existing line bumped and nine lines added with one statement each, not one per product
+        self.assertEqual(sum('INSERT INTO "store_orderitem"' in q['sql'] for q in queries.captured_queries), 1)
+
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.subtotal), (21, Decimal('42.00')))
+        self.assertEqual(order.orderitem_set.get(product=self.products[0]).quantity, 3)
+
+
+class CatalogueListingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books')
+        cls.games = Category.objects.create(name='Games')
+        Product.objects.bulk_create(
+            Product(
+                name=f'Product {i}',
+                price=Decimal(10 + i % 7),
+                category=cls.books if i % 2 else cls.games,
+            )
+            for i in range(60)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def collect(self, sort, category=None):
+        """Walks every page through the JSON fragment endpoint."""
+        ids, after = [], ''
+        while True:
+            params = {'sort': sort, 'after': after, 'format': 'json'}
+            if category:
+                params['category'] = category
+            response = self.client.get(reverse('store:product_cards'), params)
+            page = response.json()
+            ids += [int(pk) for pk in re.findall(r'data-product="(\d+)"', page['html'])]
+            if not page['next_cursor']:
+                return ids
+            after = page['next_cursor']
+
+    def test_keyset_pages_cover_the_catalogue_in_order(self):
+        expected = {
+            'newest': Product.objects.order_by('-id'),
+            'price_asc': Product.objects.order_by('price', 'id'),
+            'price_desc': Product.objects.order_by('-price', '-id'),
+        }
+        for sort, queryset in expected.items():
+            with self.subTest(sort=sort):
+                self.assertEqual(self.collect(sort), list(queryset.values_list('id', flat=True)))
+
+        books = Product.objects.filter(category=self.books).order_by('price', 'id')
+        self.assertEqual(self.collect('price_asc', 'books'), list(books.values_list('id', flat=True)))
+
+    def test_home_renders_first_page_with_cursor(self):
+        response = self.client.get(reverse('store:home'))
+        self.assertEqual(len(response.context['products']), PAGE_SIZE)
+        self.assertEqual(response.context['next_cursor'], str(response.context['products'][-1].id))
+
+        response = self.client.get(reverse('store:category_filter', args=['books']))
+        self.assertTrue(all(p.category_id == self.books.id for p in response.context['products']))
+
+    def test_fragment_exposes_next_cursor_header(self):
+        response = self.client.get(reverse('store:product_cards'))
+        self.assertTrue(response['X-Next-Cursor'])
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        response = self.client.get(reverse('store:home'), {'sort': 'price_asc', 'after': 'oops'})
+        self.assertEqual(response.status_code, 200)
+
+
+class SuggestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books')
+        cls.games = Category.objects.create(name='Games')
+        cls.book_list = Product.objects.bulk_create(
+            Product(name=f'Book {i}', price='5.00', category=cls.books) for i in range(30)
+        )
+        Product.objects.create(name='Chess', price='9.00', category=cls.games)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_suggestions_come_from_the_same_category(self):
+        product = self.book_list[0]
+        for _ in range(10):
+            picked = suggestions.suggested_products(product)
+            self.assertEqual(len(picked), suggestions.SUGGESTION_COUNT)
+            self.assertNotIn(product, picked)
+            self.assertTrue(all(p.category_id == self.books.id for p in picked))
+
+    def test_cached_pool_avoids_random_sort(self):
+        product = self.book_list[0]
+        suggestions.suggested_products(product)
+        with CaptureQueriesContext(connection) as queries:
+            suggestions.suggested_products(product)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('RANDOM()', queries[0]['sql'].upper())
+
+    def test_new_product_refreshes_the_pool(self):
+        suggestions.category_pool(self.games.id)
+        chess_set = Product.objects.create(name='Chess set', price='19.00', category=self.games)
+        self.assertIn(chess_set.id, suggestions.category_pool(self.games.id))
+
+    def test_moved_product_leaves_the_old_pool(self):
+        chess_set = Product.objects.create(name='Chess set', price='19.00', category=self.games)
+        self.assertIn(chess_set.id, suggestions.category_pool(self.games.id))
+        chess_set.category = Category.objects.create(name='Boards', slug='boards')
+        chess_set.save()
+        self.assertNotIn(chess_set.id, suggestions.category_pool(self.games.id))
+        self.assertIn(chess_set.id, suggestions.category_pool(chess_set.category_id))
+
+    def test_product_detail_renders_suggestions(self):
+        response = self.client.get(reverse('store:product_detail', args=[self.book_list[1].id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['suggested_products']), suggestions.SUGGESTION_COUNT)
+
+
+class CatalogueCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books')
+        cls.product = Product.objects.create(name='Novel', price='12.50', category=cls.books)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_catalogue_pages_are_served_from_cache(self):
+        for url in (reverse('store:home'), reverse('store:category_filter', args=['books']),
+                    reverse('store:product_detail', args=[self.product.id])):
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertContains(response, 'Novel')
+
+    def test_product_changes_invalidate_cached_pages(self):
+        self.client.get(reverse('store:home'))
+        self.product.name = 'Renamed novel'
+        self.product.save()
+        self.assertContains(self.client.get(reverse('store:home')), 'Renamed novel')
+
+        Category.objects.create(name='Garden')
+        self.assertContains(self.client.get(reverse('store:home')), 'Garden')
+
+    def test_cart_badge_is_not_cached(self):
+        user = User.objects.create_user('badge', 'badge@example.com', 'pass')
+        order = Order.objects.create(customer=Customer.objects.create(user=user, email='badge@example.com'))
+        self.client.get(reverse('store:home'))
+
+        self.client.force_login(user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=7)
+        response = self.client.get(reverse('store:home'))
+        self.assertEqual(response.context['cart_items_count'], 7)
+
+    def test_missing_product_is_a_404(self):
+        self.assertEqual(self.client.get(reverse('store:product_detail', args=[999999])).status_code, 404)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('repeat', 'repeat@example.com', 'pass')
+        cls.customer = Customer.objects.create(user=cls.user, name='Repeat', email='repeat@example.com')
+        products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=Decimal('5.00')) for i in range(3)
+        )
+        # Same timestamp for several orders, so the id tiebreak matters
+        cls.orders = Order.objects.bulk_create(
+            Order(customer=cls.customer, complete=True, status='Paid', payment_method='COD') for _ in range(25)
+        )
+        Order.objects.update(date_ordered=timezone.now())
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=2) for order in cls.orders for product in products
+        )
+        Order.objects.all().recalculate_totals()
+        Order.objects.create(customer=cls.customer)  # the open cart shown in the navbar
+        other = User.objects.create_user('other', 'other@example.com', 'pass')
+        cls.other_order = Order.objects.create(
+            customer=Customer.objects.create(user=other, name='Other', email='other@example.com'), complete=True,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pages_walk_the_history_with_constant_queries(self):
+        seen = []
+        url = reverse('store:view_orders')
+        self.client.get(url)  # warms the session and user caches
+        query_counts = set()
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            query_counts.add(len(queries))
+            seen += [order.id for order in response.context['orders']]
+            cursor = response.context['next_cursor']
+            url = f'{reverse("store:view_orders")}?{urlencode({"after": cursor})}' if cursor else None
+
+        self.assertEqual(seen, sorted((order.id for order in self.orders), reverse=True))
+        self.assertEqual(len(query_counts), 1)
+        first = response.context['orders'][0]
+        self.assertEqual((first.item_count, first.total, len(first.lines)), (6, Decimal('40.00'), 3))
+
+    def test_detail_shows_only_the_shoppers_own_orders(self):
+        response = self.client.get(reverse('store:order_detail', args=[self.orders[0].id]))
+        self.assertContains(response, 'Product 2')
+        self.assertEqual(response.context['total'], Decimal('40.00'))
+        self.assertEqual(self.client.get(reverse('store:order_detail', args=[self.other_order.id])).status_code, 404)
+
+    def check_out(self, address):
+        response = self.client.post(reverse('store:checkout'), {
+            'full_name': 'Repeat Shopper', 'email': 'repeat@example.com', 'address_line_1': address,
+            'address_line_2': 'Flat 2', 'city': 'Pune', 'state': 'MH', 'zipcode': '411001', 'payment_method': 'COD',
+        })
+        self.assertRedirects(response, reverse('store:initiate_payment'), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse('store:initiate_payment')), address)
+        self.client.get(reverse('store:finalize_cod_order'))
+
+    def test_checkout_address_stays_with_the_order(self):
+        self.client.get(reverse('store:cart'))  # warms the session and user caches
+        first = Order.objects.get(customer=self.customer, complete=False)
+        self.check_out('1 First Street')
+        second = Order.objects.create(customer=self.customer)  # the next cart
+        self.check_out('2 Second Street')
+        Order.objects.create(customer=self.customer)
+
+        response = self.client.get(reverse('store:order_detail', args=[first.id]))
+        self.assertContains(response, '1 First Street')
+        self.assertContains(response, 'Flat 2')
+        self.assertNotContains(response, '2 Second Street')
+        self.assertContains(self.client.get(reverse('store:order_detail', args=[second.id])), '2 Second Street')
+
+    def test_history_needs_login(self):
+        self.client.logout()
+        self.assertRedirects(self.client.get(reverse('store:view_orders')), reverse('store:login'),
+                             fetch_redirect_response=False)
+
+
+class OrderLookupIndexTests(TestCase):
+    """The hot cart/order queries must be answered from an index on SQLite."""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('indexed', 'indexed@example.com', 'pass')
+        cls.customer = Customer.objects.create(user=user, email='indexed@example.com')
+        cls.product = Product.objects.create(name='Lamp', price='30.00')
+        cls.order = Order.objects.create(customer=cls.customer)
+
+    def plan(self, queryset):
+        return queryset.explain()
+
+    def test_open_cart_lookup_uses_an_index(self):
+        plan = self.plan(Order.objects.filter(customer=self.customer, complete=False))
+        self.assertRegex(plan, r'USING (COVERING )?INDEX one_open_order_per_customer')
+
+    def test_order_history_is_read_in_index_order(self):
+        plan = self.plan(
+            Order.objects.filter(customer=self.customer, complete=True).order_by('-date_ordered')
+        )
+        self.assertIn('order_customer_history_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_order_line_lookup_uses_the_unique_index(self):
+        plan = self.plan(OrderItem.objects.filter(order=self.order, product=self.product))
+        self.assertIn('(order_id=? AND product_id=?)', plan)
+
+    def test_one_open_cart_per_customer(self):
+        Order.objects.create(customer=self.customer, complete=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(customer=self.customer)
+
+    def test_one_line_per_product(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+
+
+class CartApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('api', 'api@example.com', 'pass')
+        cls.customer = Customer.objects.create(user=cls.user, email='api@example.com')
+        cls.lamp = Product.objects.create(name='Lamp', price='30.00')
+        cls.mug = Product.objects.create(name='Mug', price='4.50')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, url_name, payload):
+        return self.client.post(reverse(url_name), json.dumps(payload), content_type='application/json')
+
+    def test_add_set_and_remove(self):
+        data = self.post('store:update_item', {'productId': self.lamp.id, 'action': 'add'}).json()
+        data = self.post('store:update_item', {'productId': self.lamp.id, 'action': 'add', 'quantity': 2}).json()
+        self.assertEqual(data['line'], {'product_id': self.lamp.id, 'quantity': 3, 'line_total': '90.00'})
+        self.assertEqual(data['cart'], {'item_count': 3, 'subtotal': '90.00', 'total': '100.00'})
+
+        data = self.post('store:update_item', {'productId': self.lamp.id, 'action': 'set', 'quantity': 1}).json()
+        self.assertEqual(data['line']['quantity'], 1)
+        self.assertEqual(data['cart']['subtotal'], '30.00')
+
+        data = self.post('store:update_item', {'productId': self.lamp.id, 'action': 'remove'}).json()
+        self.assertEqual(data['line']['quantity'], 0)
+        self.assertEqual(data['cart']['item_count'], 0)
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_bulk_update(self):
+        self.post('store:update_item', {'productId': self.mug.id, 'action': 'add'})
+        data = self.post('store:update_items', {'items': [
+            {'productId': self.lamp.id, 'quantity': 2},
+            {'productId': self.mug.id, 'quantity': 0},
+        ]}).json()
+        self.assertEqual(data['cart']['subtotal'], '60.00')
+        self.assertEqual(data['lines'], [{'product_id': self.lamp.id, 'quantity': 2, 'line_total': '60.00'}])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post('store:update_item', {'action': 'add'}).status_code, 400)
+        self.assertEqual(self.post('store:update_item', {'productId': self.lamp.id, 'action': 'zap'}).status_code, 400)
+        self.assertEqual(self.post('store:update_item', {'productId': 999999, 'action': 'add'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('store:update_item')).status_code, 405)
+
+    def test_cart_page_form_uses_atomic_update(self):
+        self.post('store:update_item', {'productId': self.lamp.id, 'action': 'add'})
+        self.client.post(reverse('store:update_cart', args=[self.lamp.id]), {'quantity': 4})
+        order = Order.objects.get(customer=self.customer, complete=False)
+        self.assertEqual((order.item_count, order.subtotal), (4, Decimal('120.00')))
+        self.client.get(reverse('store:remove_from_cart', args=[self.lamp.id]))
+        self.assertFalse(order.orderitem_set.exists())
+
+    def test_removed_lines_send_post_delete(self):
+        deleted = []
+
+        def record(sender, instance, **kwargs):
+            deleted.append(instance.product_id)
+
+        post_delete.connect(record, sender=OrderItem)
+        self.addCleanup(post_delete.disconnect, record, sender=OrderItem)
+        self.post('store:update_item', {'productId': self.lamp.id, 'action': 'add', 'quantity': 2})
+        self.post('store:update_item', {'productId': self.mug.id, 'action': 'add'})
+        self.post('store:update_item', {'productId': self.lamp.id, 'action': 'add', 'quantity': -2})
+        data = self.post('store:update_item', {'productId': self.mug.id, 'action': 'remove'}).json()
+        self.assertEqual(deleted, [self.lamp.id, self.mug.id])
+        self.assertEqual(data['cart']['item_count'], 0)
+
+    def test_removing_a_line_refreshes_the_totals_once(self):
+        order = Order.objects.create()
+        cart.add_item(order, self.lamp, 2)
+        cart.add_item(order, self.mug, 1)
+        with CaptureQueriesContext(connection) as queries:
+            cart.remove_item(order, self.lamp)
+        totals = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "store_order"')]
+        self.assertEqual(len(totals), 1)
+        self.assertEqual((order.item_count, order.subtotal), (1, Decimal(self.mug.price)))
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    """Simulated double-clicks and parallel tabs must not lose increments."""
+
+    def test_parallel_adds_are_not_lost(self):
+        product = Product.objects.create(name='Lamp', price='30.00')
+        order = Order.objects.create()
+        workers, adds_per_worker = 8, 10
+
+        def worker():
+            try:
+                for _ in range(adds_per_worker):
+                    # Each request loads its own copy of the order
+                    cart.add_item(Order.objects.get(pk=order.pk), product, 1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order.refresh_from_db()
+        self.assertEqual(OrderItem.objects.get(order=order, product=product).quantity, workers * adds_per_worker)
+        self.assertEqual(order.item_count, workers * adds_per_worker)
+
+
+class ProductThumbnailTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, size=(800, 400), mode='RGBA'):
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 30, 30, 255) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+        return SimpleUploadedFile('lamp.png', buffer.getvalue(), content_type='image/png')
+
+    def test_thumbnails_are_generated_on_upload(self):
+        product = Product.objects.create(name='Lamp', price='30.00', image=self.upload())
+        product.refresh_from_db()
+        self.assertEqual(product.thumbnails['widths'], [150, 300, 600])
+        self.assertEqual(product.thumbnails['width'], 800)
+
+        storage = product.image.storage
+        with storage.open(images.thumbnail_name(product.image.name, 300, 'webp')) as thumb:
+            self.assertEqual(Image.open(thumb).size, (300, 150))
+        self.assertTrue(storage.exists(images.thumbnail_name(product.image.name, 150, 'jpg')))
+
+    def test_sources_with_the_same_stem_keep_their_own_thumbnails(self):
+        uploads = {}
+        for name, color, pil_format in [('lamp.png', (200, 30, 30), 'PNG'), ('lamp.jpg', (30, 30, 200), 'JPEG')]:
+            buffer = BytesIO()
+            Image.new('RGB', (400, 200), color).save(buffer, pil_format)
+            uploads[color] = SimpleUploadedFile(name, buffer.getvalue())
+        products = {
+            color: Product.objects.create(name='Lamp', price='30.00', image=upload) for color, upload in uploads.items()
+        }
+
+        names = set()
+        for color, product in products.items():
+            name = images.thumbnail_name(product.image.name, 150, 'jpg')
+            names.add(name)
+            with product.image.storage.open(name) as thumb:
+                red, _, blue = Image.open(thumb).convert('RGB').getpixel((75, 37))
+            self.assertEqual(red > blue, color[0] > color[2])
+        self.assertEqual(len(names), 2)
+
+    def test_unreadable_upload_is_saved_without_thumbnails(self):
+        with self.assertLogs('store.images', level='WARNING') as logs:
+            product = Product.objects.create(
+                name='Lamp', price='30.00', image=SimpleUploadedFile('broken.png', b'not an image')
+            )
+        self.assertIn(f'product {product.pk}', logs.output[0])
+        product.refresh_from_db()
+        self.assertEqual(product.thumbnails, {})
+
+    def test_template_tag_renders_srcset(self):
+        product = Product.objects.create(name='Lamp', price='30.00', image=self.upload())
+        html = Template('{% load store_images %}{% product_image product sizes="300px" class="card" %}').render(
+            Context({'product': product})
+        )
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('-150w.webp 150w', html)
+        self.assertIn(f'{product.image.url} 800w', html)
+        self.assertIn('class="card"', html)
+        self.assertIn('alt="Lamp"', html)
+
+        # Thumbnails recorded under an older naming scheme fall back to the original
+        product.thumbnails['version'] = images.THUMBNAIL_VERSION - 1
+        html = Template('{% load store_images %}{% product_image product %}').render(Context({'product': product}))
+        self.assertNotIn('srcset', html)
+        self.assertIn(f'src="{product.image.url}"', html)
+
+    def test_backfill_command(self):
+        product = Product.objects.create(name='Lamp', price='30.00', image=self.upload(size=(200, 100), mode='RGB'))
+        Product.objects.filter(pk=product.pk).update(thumbnails={})
+
+        call_command('generate_thumbnails', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.thumbnails['widths'], [150])
+
+    def test_backfill_skips_oversized_originals(self):
+        bomb = Product.objects.create(name='Mural', price='90.00', image=self.upload(size=(200, 100), mode='RGB'))
+        lamp = Product.objects.create(name='Lamp', price='30.00', image=self.upload(size=(200, 20), mode='RGB'))
+        Product.objects.update(thumbnails={})
+
+        errors = StringIO()
+        # Pillow refuses images over twice this many pixels
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 5000):
+            call_command('generate_thumbnails', stdout=StringIO(), stderr=errors)
+        self.assertIn(f'Skipped product {bomb.pk}', errors.getvalue())
+        lamp.refresh_from_db()
+        self.assertEqual(lamp.thumbnails['widths'], [150])
+
+
+class GenerateProductsCommandTests(TestCase):
+    def generate(self, *args):
+        call_command('generate_products', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_generates_catalogue_and_order_history(self):
+        self.generate('--products', '120', '--categories', '6', '--customers', '15', '--orders', '40',
+                      '--items-per-order', '4', '--batch-size', '25')
+        self.assertEqual(Category.objects.count(), 6)
+        self.assertEqual(Product.objects.count(), 120)
+        self.assertEqual(Customer.objects.count(), 15)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 40)
+
+        # Stored totals match the generated lines
+        order = Order.objects.order_by('?').first()
+        lines = OrderItem.objects.for_order(order)
+        self.assertTrue(1 <= len(lines) <= 4)
+        self.assertEqual(order.item_count, sum(line.quantity for line in lines))
+        self.assertEqual(order.subtotal, sum(line.get_total for line in lines))
+
+        # A fresh run replaces the generated orders and their lines, leaving no orphans
+        self.generate('--products', '20', '--customers', '5', '--orders', '10', '--batch-size', '4')
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertFalse(OrderItem.objects.filter(order__isnull=True).exists())
+
+    def test_fresh_run_clears_without_per_row_signals(self):
+        self.generate('--products', '30', '--customers', '3', '--orders', '5')
+        cart = Order.objects.create(customer=Customer.objects.create(
+            user=User.objects.create_user('keeper', 'keeper@example.com', 'pass'), name='Keeper', email='k@example.com',
+        ))
+        line = OrderItem.objects.create(order=cart, product=Product.objects.first(), quantity=1)
+
+        deleted = []
+        def record(sender, **kwargs):
+            deleted.append(sender)
+        post_delete.connect(record)
+        self.addCleanup(post_delete.disconnect, record)
+        self.generate('--products', '10', '--customers', '2', '--orders', '3')
+
+        self.assertNotIn(Product, deleted)
+        self.assertNotIn(Category, deleted)
+        self.assertNotIn(Order, deleted)
+        self.assertEqual((Product.objects.count(), Order.objects.filter(complete=True).count()), (10, 3))
+        # Lines of orders that aren't generated lose their product, as with on_delete=SET_NULL
+        line.refresh_from_db()
+        self.assertIsNone(line.product_id)
+        # The index is rebuilt once at the end instead
+        product = Product.objects.first()
+        self.assertIn(product.pk, search.search_ids(product.name, 50))
+
+    def test_same_seed_same_catalogue_and_append_keeps_data(self):
+        self.generate('--products', '30', '--seed', '7')
+        first = list(Product.objects.order_by('id').values_list('name', 'price', 'digital', 'category__name'))
+
+        self.generate('--products', '30', '--seed', '7')
+        second = list(Product.objects.order_by('id').values_list('name', 'price', 'digital', 'category__name'))
+        self.assertEqual(first, second)
+
+        self.generate('--products', '10', '--append')
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Category.objects.count(), 4)
+
+    def test_worker_pool_produces_the_same_rows(self):
+        self.generate('--products', '30', '--batch-size', '10')
+        serial = list(Product.objects.order_by('id').values_list('name', 'price'))
+        self.generate('--products', '30', '--batch-size', '10', '--workers', '2')
+        pooled = list(Product.objects.order_by('id').values_list('name', 'price'))
+        self.assertEqual(serial, pooled)
+
+
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Lamps', slug='lamps')
+        Product.objects.create(name='Desk Lamp', price=Decimal('25.00'), category=category)
+
+    def test_page_templates_are_timed(self):
+        response = self.client.get(reverse('store:home'))
+        template_ms = float(re.search(r'tpl;dur=([\d.]+)', response['Server-Timing']).group(1))
+        self.assertGreater(template_ms, 0)
+        # Rendering outside a request isn't attributed to anything
+        self.assertEqual(engines['django'].from_string('{{ name }}').render({'name': 'Lamp'}), 'Lamp')
+
+    def test_server_timing_header_and_perf_log(self):
+        with self.assertLogs('store.perf', level='INFO') as logs:
+            response = self.client.get(reverse('store:home'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+
+        perf = logs.records[-1].perf
+        self.assertEqual(perf['view'], 'store:home')
+        self.assertEqual(perf['status'], 200)
+        self.assertGreater(perf['queries'], 0)
+        self.assertGreater(perf['template_ms'], 0)
+
+    def test_static_and_unresolved_requests_are_not_instrumented(self):
+        response = self.client.get('/no-such-page/')
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(QUERY_BUDGETS={'store:home': 1}, QUERY_BUDGET_RAISE=True)
+    def test_budget_raises_when_strict(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'store:home ran'):
+            self.client.get(reverse('store:home'))
+
+    @override_settings(QUERY_BUDGETS={'home': 1}, QUERY_BUDGET_RAISE=False)
+    def test_budget_warns_otherwise(self):
+        with self.assertLogs('store.perf', level='WARNING') as logs:
+            response = self.client.get(reverse('store:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('(budget 1)', logs.output[-1])
+
+    @override_settings(QUERY_BUDGETS={'store:home': 0}, QUERY_BUDGET_EXTRA=1, QUERY_BUDGET_RAISE=False)
+    def test_budget_allows_for_uncached_sessions(self):
+        with self.assertLogs('store.perf', level='WARNING') as logs:
+            self.client.get(reverse('store:home'))
+        self.assertIn('(budget 1)', logs.output[-1])
+
+    def test_repeated_statements_are_counted(self):
+        stats = RequestStats()
+        stats.queries = [('SELECT a WHERE id = %s', '(1,)'), ('SELECT a WHERE id = %s', '(2,)'),
+                         ('SELECT a WHERE id = %s', '(2,)'), ('SELECT b', '()')]
+        self.assertEqual(stats.duplicates, 1)
+        self.assertEqual(stats.similar, 2)
+        self.assertEqual(stats.most_repeated(), ('SELECT a WHERE id = %s', 3))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lighting = Category.objects.create(name='Lighting', slug='lighting')
+        self.decor = Category.objects.create(name='Decor', slug='decor')
+        self.lamp = Product.objects.create(name='Walnut Desk Lamp', price=Decimal('40.00'), category=self.decor)
+        self.bulb = Product.objects.create(name='Smart Bulb', price=Decimal('15.00'), category=self.lighting)
+        self.rug = Product.objects.create(name='Wool Rug', price=Decimal('90.00'), category=self.decor)
+
+    def test_prefix_typo_and_category_matches(self):
+        self.assertEqual(search.search_ids('wal', 10), [self.lamp.pk])
+        self.assertEqual(search.search_ids('desk lam', 10), [self.lamp.pk])
+        self.assertEqual(search.search_ids('walnot', 10), [self.lamp.pk])
+        self.assertEqual(search.search_ids('lighting', 10), [self.bulb.pk])
+        self.assertEqual(search.search_ids('"; DROP TABLE', 10), [])
+
+    def test_name_matches_rank_above_category_matches(self):
+        decor_lamp = Product.objects.create(name='Decor Lamp', price=Decimal('20.00'), category=self.lighting)
+        ids = search.search_ids('decor', 10)
+        self.assertEqual(ids[0], decor_lamp.pk)
+        self.assertEqual(set(ids), {decor_lamp.pk, self.lamp.pk, self.rug.pk})
+
+    def test_index_follows_product_and_category_changes(self):
+        self.rug.name = 'Jute Rug'
+        self.rug.save()
+        self.assertEqual(search.search_ids('jute', 10), [self.rug.pk])
+        self.assertEqual(search.search_ids('wool', 10), [])
+
+        self.decor.name = 'Furnishings'
+        self.decor.save()
+        self.assertEqual(set(search.search_ids('furnishings', 10)), {self.lamp.pk, self.rug.pk})
+
+        self.decor.delete()
+        self.assertEqual(search.search_ids('furnishings', 10), [])
+        self.assertEqual(search.search_ids('jute', 10), [self.rug.pk])
+
+        self.bulb.delete()
+        self.assertEqual(search.search_ids('bulb', 10), [])
+
+    def test_bulk_created_products_are_found_after_rebuild(self):
+        Product.objects.bulk_create([Product(name=f'Candle {i}', price=Decimal('5.00')) for i in range(3)])
+        self.assertEqual(search.search_ids('candle', 10), [])
+        search.rebuild_index()
+        self.assertEqual(len(search.search_ids('candle', 10)), 3)
+
+    def test_search_page_paginates_results(self):
+        Product.objects.bulk_create([Product(name=f'Candle {i}', price=Decimal('5.00')) for i in range(PAGE_SIZE + 2)])
+        search.rebuild_index()
+        response = self.client.get(reverse('store:search'), {'q': 'candle'})
+        self.assertEqual(len(response.context['products']), PAGE_SIZE)
+        self.assertTrue(response.context['has_next'])
+
+        response = self.client.get(reverse('store:search'), {'q': 'candle', 'page': 2})
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertFalse(response.context['has_next'])
+        self.assertContains(response, 'page=1')
+
+    def test_autocomplete_is_cached(self):
+        url = reverse('store:search_autocomplete')
+        response = self.client.get(url, {'q': 'smart b'})
+        self.assertEqual(response.json()['results'], [{
+            'id': self.bulb.pk, 'name': 'Smart Bulb', 'category': 'Lighting',
+            'url': reverse('store:product_detail', args=[self.bulb.pk]),
+        }])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.client.get(url, {'q': 'Smart  B'})
+        self.assertEqual(self.client.get(url, {'q': 'x'}).json(), {'results': []})
+
+    def test_free_text_queries_make_valid_cache_keys(self):
+        queries = ['smart bulb', 'lámpara de escritorio', 'wool ' * 60, 'tab\tseparated']
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            for query in queries:
+                key = catalogue_key('search', query, 1)
+                self.assertLessEqual(len(key), 250)
+                self.assertTrue(key.isascii())
+                self.assertFalse(any(char.isspace() for char in key))
+
+                builds = []
+                for _ in range(2):
+                    cached_catalogue(('search', query, 1), lambda: builds.append(query) or [query])
+                self.assertEqual(builds, [query])
+        self.assertNotEqual(catalogue_key('autocomplete', 'a b'), catalogue_key('autocomplete', 'a  b'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL search indexes')
+class PostgresSearchPlanTests(TestCase):
+    def test_every_branch_is_served_by_an_index(self):
+        lighting = Category.objects.create(name='Lighting', slug='lighting')
+        lamp = Product.objects.create(name='Walnut Desk Lamp', price=Decimal('40.00'), category=lighting)
+        bulb = Product.objects.create(name='Lighting Bulb', price=Decimal('15.00'))
+        with connection.cursor() as cursor:
+            # The table is tiny, so rule out sequential scans to see whether the indexes can be used at all
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = search.postgres_matches(['lighting']).explain()
+        self.assertNotIn('Seq Scan on store_product', plan)
+        self.assertIn('product_name_search_idx', plan)
+        self.assertIn('product_name_trgm_idx', plan)
+        self.assertEqual(set(search.search_ids('lighting', 10)), {lamp.pk, bulb.pk})
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.games = Category.objects.create(name='Games', slug='games')
+        for name, price, digital, category in [
+            ('E-book', '9.99', True, self.books),
+            ('Hardback', '30.00', False, self.books),
+            ('Box set', '120.00', None, self.books),
+            ('Download code', '40.00', True, self.games),
+            ('Board game', '45.00', False, self.games),
+        ]:
+            Product.objects.create(name=name, price=Decimal(price), digital=digital, category=category)
+
+    def test_parse_filters_keeps_only_known_values(self):
+        params = {'price': '25-50', 'type': 'vinyl', 'sort': 'price_asc'}
+        self.assertEqual(facets.parse_filters(params), {'price': '25-50'})
+
+    def test_counts_apply_the_other_filters(self):
+        counts = facets.facet_counts(self.books.id, {'price': '25-50'})
+        self.assertEqual(counts['total'], 1)
+        # Category counts ignore the category itself but respect the price filter
+        self.assertEqual(counts['categories'], {self.books.id: 1, self.games.id: 2})
+        self.assertEqual(dict((key, n) for key, _, n in counts['price'])['under-25'], 1)
+        self.assertEqual(dict((key, n) for key, _, n in counts['type']), {'digital': 0, 'physical': 1})
+
+        # Every count agrees with a direct query
+        for key, _, n in facets.facet_counts()['price']:
+            self.assertEqual(n, facets.apply_filters(Product.objects.all(), {'price': key}).count())
+
+    def test_listing_filters_and_reads_counts_from_the_cube(self):
+        response = self.client.get(reverse('store:home'), {'type': 'digital', 'sort': 'price_desc'})
+        self.assertEqual([p.name for p in response.context['products']], ['Download code', 'E-book'])
+        self.assertEqual(response.context['result_count'], 2)
+        self.assertContains(response, 'type=digital')
+
+        # A new filter combination only costs the page query; the counts come from the cached cube
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('store:category_filter', args=['games']), {'price': '25-50'})
+        self.assertEqual(response.context['result_count'], 2)
+
+    def test_cube_is_rebuilt_after_catalogue_changes_and_by_the_command(self):
+        self.assertEqual(facets.facet_counts()['total'], 5)
+        Product.objects.create(name='Puzzle', price=Decimal('12.00'), category=self.games)
+        self.assertEqual(facets.facet_counts()['total'], 6)
+
+        Product.objects.bulk_create([Product(name='Dice', price=Decimal('3.00'), category=self.games)])
+        call_command('warm_facets', stdout=StringIO())
+        self.assertEqual(facets.facet_counts()['total'], 7)
+
+    def test_name_sort_pages_through_names_containing_the_cursor_separator(self):
+        Product.objects.all().delete()
+        names = [f'item_{i:02d}' for i in range(PAGE_SIZE + 5)]
+        Product.objects.bulk_create([Product(name=name, price=Decimal('1.00')) for name in names])
+
+        first = self.client.get(reverse('store:home'), {'sort': 'name_desc'})
+        cursor = first.context['next_cursor']
+        rest = self.client.get(reverse('store:product_cards'), {'sort': 'name_desc', 'after': cursor, 'format': 'json'})
+        second = re.findall(r'item_\d\d', rest.json()['html'])
+        seen = [p.name for p in first.context['products']] + list(dict.fromkeys(second))
+        self.assertEqual(seen, sorted(names, reverse=True))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_SELECTION='round_robin')
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        routers._round_robin.clear()
+
+    def in_fresh_context(self, func):
+        # Writes made by other tests pin the test thread; start from an unpinned state
+        return contextvars.Context().run(func)
+
+    def test_catalogue_reads_rotate_over_replicas_and_the_rest_uses_the_primary(self):
+        def route():
+            return [
+                self.router.db_for_read(Product), self.router.db_for_read(Category),
+                self.router.db_for_read(Product), self.router.db_for_read(Order),
+            ]
+        aliases = self.in_fresh_context(route)
+        self.assertEqual(sorted(aliases[:3]), ['replica1', 'replica1', 'replica2'])
+        self.assertEqual(aliases[3], 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'store'))
+
+    def test_reads_after_a_write_stick_to_the_primary(self):
+        def route():
+            before = self.router.db_for_read(Product)
+            self.assertEqual(self.router.db_for_write(OrderItem), 'default')
+            return before, self.router.db_for_read(Product), routers.read_alias()
+        before, after, history = self.in_fresh_context(route)
+        self.assertTrue(before.startswith('replica'))
+        self.assertEqual((after, history), ('default', 'default'))
+
+    def test_catalogue_cache_entries_are_built_from_the_primary(self):
+        def route():
+            cache.clear()
+            built = cached_catalogue(('routing',), lambda: self.router.db_for_read(Product))
+            # The request itself is not pinned by it
+            return built, self.router.db_for_read(Product), routers.is_pinned()
+        built, after, pinned = self.in_fresh_context(route)
+        self.assertEqual(built, 'default')
+        self.assertTrue(after.startswith('replica'))
+        self.assertFalse(pinned)
+
+    def test_middleware_carries_the_pin_to_the_next_request(self):
+        def writing_view(request):
+            routers.pin_to_primary()
+            return HttpResponse()
+
+        def reading_view(request):
+            return HttpResponse(self.router.db_for_read(Product))
+
+        factory = RequestFactory()
+        response = self.in_fresh_context(lambda: routers.ReplicaPinningMiddleware(writing_view)(factory.post('/')))
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+
+        pinned = factory.get('/')
+        pinned.COOKIES[routers.PIN_COOKIE] = '1'
+        response = self.in_fresh_context(lambda: routers.ReplicaPinningMiddleware(reading_view)(pinned))
+        self.assertEqual(response.content, b'default')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+        response = self.in_fresh_context(lambda: routers.ReplicaPinningMiddleware(reading_view)(factory.get('/')))
+        self.assertTrue(response.content.startswith(b'replica'))
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async_shopper', 'async@example.com', 'pass')
+        cls.category = Category.objects.create(name='Clocks', slug='clocks')
+        cls.product = Product.objects.create(name='Wall Clock', price=Decimal('30.00'), category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+        self.enterContext(benchmarks.views_mode(True))
+
+    def test_catalogue_and_cart_routes_switch_to_the_async_views(self):
+        self.assertIs(resolve(reverse('store:home')).func, async_views.home)
+        self.assertIs(resolve(reverse('store:update_item')).func, async_views.updateCartAjax)
+
+    async def test_home_renders_the_sync_context(self):
+        response = await self.async_client.get(reverse('store:category_filter', args=['clocks']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['products'], [self.product])
+        self.assertEqual(response.context['categories'], [(self.category, 1)])
+        self.assertEqual(response.context['result_count'], 1)
+        self.assertIn('Server-Timing', response)
+
+    async def test_product_detail_and_missing_product(self):
+        response = await self.async_client.get(reverse('store:product_detail', args=[self.product.id]))
+        self.assertContains(response, 'Wall Clock')
+        response = await self.async_client.get(reverse('store:product_detail', args=[self.product.id + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart_api_and_cart_page(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('store:update_item'),
+            json.dumps({'productId': self.product.id, 'action': 'add', 'quantity': 2}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cart'], {'item_count': 2, 'subtotal': '60.00', 'total': '70.00'})
+
+        response = await self.async_client.post(
+            reverse('store:update_items'),
+            json.dumps({'items': [{'productId': self.product.id, 'quantity': 5}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['lines'], [{'product_id': self.product.id, 'quantity': 5, 'line_total': '150.00'}])
+
+        response = await self.async_client.get(reverse('store:cart'))
+        self.assertEqual([item.quantity for item in response.context['items']], [5])
+
+    async def test_middleware_counts_queries_on_a_fully_async_stack(self):
+        # As deployed under ASYNC_VIEWS: without WhiteNoise nothing forces the chain back to sync
+        middleware = [name for name in settings.MIDDLEWARE if 'whitenoise' not in name]
+        with self.settings(MIDDLEWARE=middleware):
+            response = await self.async_client.get(reverse('store:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    async def test_guest_cart_comes_from_the_cookie(self):
+        self.async_client.cookies['cart'] = json.dumps({str(self.product.id): {'quantity': 3}})
+        response = await self.async_client.get(reverse('store:cart'))
+        self.assertEqual(response.context['order']['get_cart_items'], 3)
+
+        # The legacy cookie is rewritten in the signed format on the first change
+        response = await self.async_client.post(reverse('store:update_item'),
+                                                {'productId': self.product.id, 'action': 'add'},
+                                                content_type='application/json')
+        self.assertEqual(response.json()['line']['quantity'], 4)
+        self.assertTrue(response.cookies['cart'].value.startswith('1:'))
+
+
+@override_settings(RAZORPAY_KEY_ID='rzp_test_key', RAZORPAY_KEY_SECRET='test_secret')
+class PaymentGatewayTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeRazorpay('rzp_test_key', 'test_secret').start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('payer', 'payer@example.com', 'pass')
+        customer = Customer.objects.create(user=cls.user, name='Payer', email='payer@example.com')
+        product = Product.objects.create(name='Kettle', price=Decimal('40.00'))
+        cls.order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=cls.order, product=product, quantity=2)
+        ShippingAddress.objects.create(customer=customer, order=cls.order, name='Payer', email='payer@example.com',
+                                       address='1 Main St', city='Pune', state='MH', zipcode='411001')
+
+    def setUp(self):
+        self.fake.orders.clear()
+        self.fake.requests.clear()
+        self.fake.failures.clear()
+        self.fake.delay = 0
+        self.order.refresh_from_db()
+
+    def gateway(self, **kwargs):
+        options = {'base_url': self.fake.url, 'timeout': (1, 0.5), 'retries': 1, 'backoff': 0}
+        return payments.RazorpayGateway('rzp_test_key', 'test_secret', **{**options, **kwargs})
+
+    def test_create_order_is_idempotent_per_order_and_amount(self):
+        gateway = self.gateway()
+        first = gateway.create_order(self.order, 9000)
+        self.assertEqual(self.fake.orders[first]['receipt'], f'order_{self.order.pk}_9000')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.razorpay_order_id, first)
+
+        # Reloading the payment page doesn't call the gateway again
+        self.assertEqual(gateway.create_order(self.order, 9000), first)
+        self.assertEqual(len(self.fake.order_requests()), 1)
+        # A changed cart gets a new gateway order
+        self.assertNotEqual(gateway.create_order(self.order, 9500), first)
+
+    def test_ambiguous_failure_reuses_the_order_the_gateway_created(self):
+        self.fake.fail_next(status=500, create_anyway=True)
+        gateway_order_id = self.gateway().create_order(self.order, 9000)
+        self.assertEqual(list(self.fake.orders), [gateway_order_id])
+
+    def test_timeouts_open_the_circuit(self):
+        gateway = self.gateway(timeout=(1, 0.05), breaker=payments.CircuitBreaker(failure_threshold=2))
+        self.fake.delay = 0.2
+        with self.assertLogs('store.payments', 'WARNING') as logs:
+            for _ in range(2):
+                # razorpay.Client prints its own notice on every timeout
+                with self.assertRaises(payments.GatewayUnavailable), redirect_stdout(StringIO()):
+                    gateway.create_order(self.order, 9000)
+        self.assertIn('circuit opened after 2 failures', logs.output[0])
+        sent = len(self.fake.requests)
+        with self.assertRaises(payments.CircuitOpen):
+            gateway.create_order(self.order, 9000)
+        self.assertEqual(len(self.fake.requests), sent)
+        self.assertIsNone(Order.objects.get(pk=self.order.pk).razorpay_order_id)
+
+    def test_error_pages_that_are_not_json_count_as_unavailable(self):
+        gateway = self.gateway(breaker=payments.CircuitBreaker(failure_threshold=1))
+        self.fake.fail_next(status=502, html=True)
+        with self.assertLogs('store.payments', 'WARNING'), self.assertRaises(payments.GatewayUnavailable):
+            gateway.create_order(self.order, 9000)
+        # Counted as a failure: the circuit opened, so the recovery lookup was skipped
+        self.assertEqual(gateway.breaker.state, 'open')
+        self.assertEqual(self.fake.order_requests('GET'), [])
+
+        self.client.force_login(self.user)
+        self.fake.fail_next(status=502, html=True)
+        with self.settings(RAZORPAY_BASE_URL=self.fake.url):
+            response = self.client.get(reverse('store:process_razorpay_payment'))
+        self.assertRedirects(response, reverse('store:initiate_payment'), fetch_redirect_response=False)
+
+    def test_a_slow_gateway_is_given_up_on_by_the_deadline(self):
+        gateway = self.gateway(timeout=(1, 1), retries=2, deadline=1.5)
+        self.fake.delay = 3
+        started = time.monotonic()
+        with self.assertRaises(payments.GatewayUnavailable), redirect_stdout(StringIO()):
+            gateway.create_order(self.order, 9000)
+        self.assertLess(time.monotonic() - started, 1.5)
+        # One POST and one recovery lookup, neither of them retried
+        self.assertEqual(len(self.fake.order_requests('POST')), 1)
+        self.assertEqual(len(self.fake.order_requests('GET')), 1)
+
+    def test_circuit_half_opens_after_the_reset_timeout(self):
+        now = [0]
+        breaker = payments.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=lambda: now[0])
+        with self.assertLogs('store.payments', 'WARNING'):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        now[0] = 31
+        breaker.before_call()  # the trial call
+        with self.assertRaises(payments.CircuitOpen):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    async def test_async_create_order(self):
+        gateway_order_id = await self.gateway().acreate_order(self.order, 9000)
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.razorpay_order_id, gateway_order_id)
+
+    def test_payment_page_uses_the_gateway_and_degrades_when_it_is_down(self):
+        self.client.force_login(self.user)
+        with self.settings(RAZORPAY_BASE_URL=self.fake.url):
+            response = self.client.get(reverse('store:process_razorpay_payment'))
+            gateway_order = self.fake.orders[response.context['razorpay_order_id']]
+            self.assertEqual(gateway_order['amount'], 9000)  # 2 x 40.00 + 10.00 shipping, in paise
+
+            Order.objects.filter(pk=self.order.pk).update(razorpay_order_id=None, razorpay_receipt=None)
+            self.fake.orders.clear()
+            self.fake.fail_next(status=503)
+            response = self.client.get(reverse('store:process_razorpay_payment'))
+        self.assertRedirects(response, reverse('store:initiate_payment'), fetch_redirect_response=False)
+
+
+@override_settings(RAZORPAY_KEY_ID='rzp_test_key', RAZORPAY_KEY_SECRET='test_secret',
+                   RAZORPAY_WEBHOOK_SECRET='hook_secret')
+class PaymentWebhookTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Only its signing helpers are used; the gateway isn't called
+        cls.fake = FakeRazorpay('rzp_test_key', 'test_secret')
+        cls.addClassCleanup(cls.fake.server.server_close)
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name='Kettle', price=Decimal('40.00'))
+        cls.orders = []
+        for number in range(3):
+            user = User.objects.create_user(f'payer{number}', f'payer{number}@example.com', 'pass')
+            customer = Customer.objects.create(user=user, name=f'Payer {number}', email=user.email)
+            # The gateway order was created for 40.00 + 10.00 shipping
+            order = Order.objects.create(customer=customer, razorpay_order_id=f'order_{number}')
+            order.razorpay_receipt = payments.idempotency_key(order, 5000)
+            order.save(update_fields=['razorpay_receipt'])
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+            cls.orders.append(order)
+
+    def deliver(self, event, order_id, secret='hook_secret', amount=5000, **kwargs):
+        body, headers = self.fake.webhook(event, order_id, secret=secret, amount=amount, **kwargs)
+        return self.client.post(reverse('store:razorpay_webhook'), body, content_type='application/json',
+                                headers=headers)
+
+    def test_rejects_unsigned_deliveries(self):
+        response = self.deliver('payment.captured', 'order_0', secret='wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_stores_each_event_once_without_touching_orders(self):
+        with self.assertNumQueries(1):
+            response = self.deliver('payment.captured', 'order_0', event_id='evt_1')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        # Razorpay redelivers until it gets a 2xx; the copy is acknowledged and dropped
+        self.assertEqual(self.deliver('payment.captured', 'order_0', event_id='evt_1').status_code, 200)
+
+        event = PaymentEvent.objects.get()
+        self.assertEqual((event.event_id, event.event, event.processed_at), ('evt_1', 'payment.captured', None))
+        self.assertFalse(Order.objects.get(pk=self.orders[0].pk).complete)
+
+    def test_worker_finalizes_orders_in_one_batch(self):
+        self.deliver('payment.captured', 'order_0', payment_id='pay_0')
+        self.deliver('order.paid', 'order_0', payment_id='pay_0')
+        self.deliver('payment.captured', 'order_1', payment_id='pay_1')
+        self.deliver('payment.failed', 'order_2')
+        self.deliver('payment.captured', 'order_unknown')
+
+        # Events, orders, the bulk order UPDATE and one UPDATE per outcome, inside a transaction
+        with self.assertNumQueries(9):
+            outcomes = payment_events.process_pending()
+        self.assertEqual(outcomes, {'finalized': 2, 'duplicate': 1, 'failed': 1, 'unknown_order': 1})
+
+        paid = Order.objects.get(pk=self.orders[0].pk)
+        self.assertEqual((paid.complete, paid.status, paid.payment_method, paid.transaction_id),
+                         (True, 'Paid', 'Razorpay', 'pay_0'))
+        self.assertEqual(Order.objects.get(pk=self.orders[2].pk).status, 'Payment_Failed')
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+        # Nothing left to do, and a late failure doesn't undo a payment
+        self.assertEqual(payment_events.process_pending(), {})
+        self.deliver('payment.failed', 'order_1')
+        self.assertEqual(payment_events.process_pending(), {'ignored': 1})
+        self.assertEqual(Order.objects.get(pk=self.orders[1].pk).status, 'Paid')
+
+    def test_command_drains_the_queue(self):
+        for number in range(3):
+            self.deliver('payment.captured', f'order_{number}')
+        out = StringIO()
+        call_command('process_payment_events', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['Processed 2 events (finalized=2).', 'Processed 1 events (finalized=1).'])
+        self.assertEqual(Order.objects.filter(status='Paid').count(), 3)
+
+    def test_events_are_append_only(self):
+        self.deliver('payment.captured', 'order_0')
+        event = PaymentEvent.objects.get()
+        event.payload = {}
+        with self.assertRaises(ValueError):
+            event.save()
+
+    def test_checkout_callback_checks_the_signature(self):
+        order = self.orders[0]
+        self.client.force_login(order.customer.user)
+        params = {'razorpay_order_id': order.razorpay_order_id, 'razorpay_payment_id': 'pay_0'}
+
+        response = self.client.get(reverse('store:payment_success'), {**params, 'razorpay_signature': 'forged'})
+        self.assertRedirects(response, reverse('store:initiate_payment'), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'Open')
+
+        signature = self.fake.signature(order.razorpay_order_id, 'pay_0')
+        response = self.client.get(reverse('store:payment_success'), {**params, 'razorpay_signature': signature})
+        self.assertRedirects(response, reverse('store:order_complete'), fetch_redirect_response=False)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'Paid')
+
+        # The webhook for the same payment then changes nothing
+        self.deliver('payment.captured', order.razorpay_order_id, payment_id='pay_0')
+        self.assertEqual(payment_events.process_pending(), {'duplicate': 1})
+
+        response = self.client.get(reverse('store:order_complete'))
+        self.assertContains(response, '₹50.00')  # with shipping
+
+    def test_payments_that_do_not_cover_the_order_are_not_finalized(self):
+        self.deliver('payment.captured', 'order_0', payment_id='pay_short', amount=100)
+        self.deliver('payment.captured', 'order_1', payment_id='pay_usd', currency='USD')
+        self.deliver('payment.captured', 'order_2', payment_id='pay_2')
+        with self.assertLogs('store.payments', 'WARNING'):
+            outcomes = payment_events.process_pending()
+        self.assertEqual(outcomes, {'mismatch': 2, 'finalized': 1})
+
+        short = Order.objects.get(pk=self.orders[0].pk)
+        self.assertEqual((short.complete, short.status, short.transaction_id), (False, 'Payment_Failed', 'pay_short'))
+        self.assertEqual(Order.objects.get(pk=self.orders[1].pk).status, 'Payment_Failed')
+        self.assertEqual(Order.objects.get(pk=self.orders[2].pk).status, 'Paid')
+        self.assertEqual(PaymentEvent.objects.get(payload__payload__payment__entity__id='pay_short').result, 'mismatch')
+
+    def test_checkout_callback_checks_the_amount(self):
+        # The cart grew after the gateway order was created for 50.00
+        order = self.orders[0]
+        OrderItem.objects.filter(order=order).update(quantity=3)
+        Order.objects.filter(pk=order.pk).recalculate_totals()
+        self.client.force_login(order.customer.user)
+
+        with self.assertLogs('store.payments', 'WARNING'):
+            response = self.client.get(reverse('store:payment_success'), {
+                'razorpay_order_id': order.razorpay_order_id,
+                'razorpay_payment_id': 'pay_0',
+                'razorpay_signature': self.fake.signature(order.razorpay_order_id, 'pay_0'),
+            })
+        self.assertRedirects(response, reverse('store:initiate_payment'), fetch_redirect_response=False)
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.complete, order.status), (False, 'Payment_Failed'))
+
+    def test_migration_leaves_cash_on_delivery_orders_unpaid(self):
+        migration = importlib.import_module('store.migrations.0010_payment_events')
+        Order.objects.filter(pk=self.orders[0].pk).update(complete=True, transaction_id='COD-1-1700000000')
+        Order.objects.filter(pk=self.orders[1].pk).update(complete=True, transaction_id='pay_1')
+        migration.completed_orders_are_paid(apps, None)
+
+        states = Order.objects.order_by('pk').values_list('payment_method', 'status')
+        self.assertEqual(list(states), [('COD', 'Pending'), ('Razorpay', 'Paid'), ('', 'Open')])
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('finance', 'finance@example.com', 'pass')
+        customer = Customer.objects.create(user=cls.admin, name='Buyer', email='buyer@example.com')
+        lamp = Product.objects.create(name='Lamp, brass', price=Decimal('30.00'))
+        mug = Product.objects.create(name='Mug', price=Decimal('5.00'))
+        cls.paid = Order.objects.create(customer=customer, complete=True, status='Paid', payment_method='Razorpay')
+        OrderItem.objects.create(order=cls.paid, product=lamp, quantity=1)
+        OrderItem.objects.create(order=cls.paid, product=mug, quantity=3)
+        ShippingAddress.objects.create(customer=customer, order=cls.paid, name='Buyer', address='1 Main St',
+                                       city='Pune', state='MH', zipcode='411001')
+        cls.pending = Order.objects.create(customer=customer, complete=True, status='Pending', payment_method='COD')
+        Order.objects.filter(pk=cls.pending.pk).update(date_ordered=timezone.now() - timezone.timedelta(days=40))
+        Order.objects.create(customer=customer)  # open cart, never exported
+
+    def test_rows_are_fetched_a_chunk_at_a_time(self):
+        orders = exports.export_queryset()
+        # One cursor over the orders, then the lines and the addresses of each chunk of orders
+        with self.assertNumQueries(1 + 2 * 2):
+            rows = list(exports.order_rows(orders, chunk_size=1))
+        self.assertEqual([(row[0], row[HEADER.index('product_name')]) for row in rows],
+                         [(self.paid.pk, 'Lamp, brass'), (self.paid.pk, 'Mug'), (self.pending.pk, None)])
+        self.assertEqual(rows[1][HEADER.index('line_total')], Decimal('15.00'))
+        self.assertEqual(rows[1][HEADER.index('ship_city')], 'Pune')
+
+    def test_addresses_saved_by_checkout_are_exported(self):
+        # An order placed before checkout saved the address on the order
+        legacy_user = User.objects.create_user('legacy', 'legacy@example.com', 'pass')
+        legacy_customer = Customer.objects.create(user=legacy_user, name='Legacy', email=legacy_user.email)
+        legacy = Order.objects.create(customer=legacy_customer, complete=True, status='Pending', payment_method='COD')
+        ShippingAddress.objects.create(customer=legacy_customer, name='Legacy', address='9 Old Road', city='Goa',
+                                       state='GA', zipcode='403001')
+
+        self.client.force_login(self.admin)
+        self.client.get(reverse('store:cart'))  # warms the session and user caches
+        placed = Order.objects.get(customer__user=self.admin, complete=False)
+        self.client.post(reverse('store:checkout'), {
+            'full_name': 'Buyer', 'email': 'buyer@example.com', 'address_line_1': '5 New Lane',
+            'city': 'Delhi', 'state': 'DL', 'zipcode': '110001', 'payment_method': 'COD',
+        })
+        self.client.get(reverse('store:finalize_cod_order'))
+
+        with self.assertNumQueries(3):
+            rows = {row[0]: row for row in exports.order_rows(exports.export_queryset())}
+        city = HEADER.index('ship_city')
+        self.assertEqual((rows[placed.pk][city], rows[legacy.pk][city]), ('Delhi', 'Goa'))
+        self.assertEqual((rows[self.paid.pk][city], rows[self.pending.pk][city]), ('Pune', None))
+
+    def test_admin_streams_filtered_csv(self):
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse('admin:store_order_changelist')), 'Export orders')
+
+        today = timezone.now().date()
+        response = self.client.get(reverse('admin:store_order_export'), {
+            'format': 'csv', 'date_from': (today - timezone.timedelta(days=7)).isoformat(),
+            'date_to': today.isoformat(), 'status': 'Paid',
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(HEADER))
+        self.assertEqual([row[HEADER.index('product_name')] for row in rows[1:]], ['Lamp, brass', 'Mug'])
+
+        self.assertEqual(self.client.get(reverse('admin:store_order_export'), {'date_from': 'soon'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('admin:store_order_export')).status_code, 302)
+
+    def test_command_writes_gzipped_jsonl(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        output = f'{path}/orders.jsonl.gz'
+        call_command('export_orders', format='jsonl', status='Pending', output=output, stderr=StringIO())
+        with gzip.open(output, 'rt') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['order_id'], records[0]['payment_method'], records[0]['quantity']),
+                         (self.pending.pk, 'COD', None))
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books')
+        cls.shopper = Customer.objects.create(user=User.objects.create_user('importcart', 'ic@example.com', 'pass'),
+                                              name='Cart', email='ic@example.com')
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        override = override_settings(MEDIA_ROOT=f'{self.workdir}/media')
+        override.enable()
+        self.addCleanup(override.disable)
+        Image.new('RGB', (400, 200), (20, 120, 200)).save(f'{self.workdir}/lamp.png')
+
+    def write_feed(self, name, rows):
+        path = f'{self.workdir}/{name}'
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['sku', 'name', 'price', 'category', 'digital', 'image'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def run_import(self, path, **options):
+        out = StringIO()
+        call_command('import_products', path, image_root=self.workdir, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_upserts_products_and_categories_in_batches(self):
+        path = self.write_feed('feed.csv', [
+            {'sku': 'LAMP-1', 'name': 'Desk lamp', 'price': '30.00', 'category': 'Lighting', 'image': 'lamp.png'},
+            {'sku': 'BOOK-1', 'name': 'Atlas', 'price': '12.50', 'category': 'Books', 'digital': 'yes'},
+            {'sku': '', 'name': 'No sku', 'price': '1.00'},
+            {'sku': 'BOOK-2', 'name': 'Almanac', 'price': 'free', 'category': 'Books'},
+            {'sku': 'BOOK-3', 'name': 'Atlas II', 'price': 'NaN', 'category': 'Books'},
+        ])
+        output = self.run_import(path, batch_size=2)
+        self.assertIn('Imported 2 products (3 rows skipped, 1 images', output)
+        self.assertIn('rows/s', output)
+
+        lamp = Product.objects.get(sku='LAMP-1')
+        self.assertEqual((lamp.category.name, lamp.price, lamp.digital), ('Lighting', Decimal('30.00'), False))
+        self.assertEqual(lamp.thumbnails['widths'], [150, 300])
+        self.assertEqual(Product.objects.get(sku='BOOK-1').category, self.books)
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+        # A re-run updates in place: no duplicates, carts repriced, unchanged images not fetched again
+        order = Order.objects.create(customer=self.shopper)
+        OrderItem.objects.create(order=order, product=lamp, quantity=2)
+        path = self.write_feed('feed.csv', [
+            {'sku': 'LAMP-1', 'name': 'Desk lamp', 'price': '25.00', 'category': 'Lighting', 'image': 'lamp.png'},
+        ])
+        self.assertIn('0 images', self.run_import(path))
+        self.assertEqual(Product.objects.filter(sku='LAMP-1').count(), 1)
+        self.assertEqual(Product.objects.get(sku='LAMP-1').image.name, lamp.image.name)
+        order.refresh_from_db()
+        self.assertEqual(order.subtotal, Decimal('50.00'))
+
+    def test_feed_categories_match_existing_ones_by_name_or_slug(self):
+        scifi = Category.objects.create(name='Sci-Fi', slug='science-fiction')
+        children = Category.objects.create(name='Children', slug='kids')
+        path = self.write_feed('feed.csv', [
+            {'sku': 'NOVEL-1', 'name': 'Dune', 'price': '9.00', 'category': 'Sci-Fi'},
+            {'sku': 'KIDS-1', 'name': 'Gruffalo', 'price': '6.00', 'category': 'Kids'},
+            {'sku': 'POEM-1', 'name': 'Odes', 'price': '4.00', 'category': 'Poetry'},
+        ])
+        self.assertIn('Imported 3 products', self.run_import(path))
+        categories = dict(Product.objects.values_list('sku', 'category__name'))
+        self.assertEqual(categories, {'NOVEL-1': 'Sci-Fi', 'KIDS-1': 'Children', 'POEM-1': 'Poetry'})
+        self.assertEqual(set(Category.objects.values_list('slug', flat=True)),
+                         {'books', scifi.slug, children.slug, 'poetry'})
+
+    def test_query_count_is_per_batch_not_per_row(self):
+        path = f'{self.workdir}/feed.jsonl'
+        with open(path, 'w') as f:
+            for i in range(200):
+                f.write(json.dumps({'sku': f'SKU-{i}', 'name': f'Item {i}', 'price': i + 1,
+                                    'category': f'Category {i % 5}'}) + '\n')
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import(path, batch_size=100)
+        self.assertEqual(Product.objects.filter(sku__startswith='SKU-').count(), 200)
+        self.assertLess(len(queries), 30)
+
+    def test_resumes_after_the_last_checkpointed_row(self):
+        path = self.write_feed('feed.csv', [
+            {'sku': f'SKU-{i}', 'name': f'Item {i}', 'price': '5.00'} for i in range(3)
+        ])
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'feed': os.path.abspath(path), 'rows': 2}, f)
+        self.assertIn('Resuming after row 2', self.run_import(path, resume=True))
+        self.assertEqual(list(Product.objects.filter(sku__startswith='SKU-').values_list('sku', flat=True)),
+                         ['SKU-2'])
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('generate_products', '--products', '30', stdout=StringIO())
+        benchmarks.seed_fixtures()
+
+    def test_scenario_reports_latency_queries_and_rows(self):
+        scenario = benchmarks.Scenario('cart_view', reverse('store:cart'), authenticated=True)
+        result = benchmarks.run_scenario(scenario, iterations=3, warmup=1)
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.error, '')
+        self.assertTrue(0 < result.p50_ms <= result.p95_ms <= result.p99_ms)
+        self.assertGreater(result.queries, 0)
+        # At least the CART_LINES order lines are read
+        self.assertGreaterEqual(result.rows, benchmarks.CART_LINES)
+
+    def test_compare_flags_errors_extra_queries_and_slowdowns(self):
+        before = {'status': 200, 'p95_ms': 10.0, 'queries': 3, 'error': ''}
+        baseline = {'home[anon]': before, 'cart_view[auth]': before, 'checkout_view[auth]': before}
+        results = {
+            'home[anon]': dict(before, p95_ms=11.0),           # within tolerance
+            'cart_view[auth]': dict(before, queries=4, p95_ms=20.0),
+            'checkout_view[auth]': dict(before, status=500, error='HTTP 500'),
+            'new_view[anon]': dict(before, p95_ms=100.0),      # not in the baseline
+        }
+        regressions = benchmarks.compare(results, baseline, tolerance=0.25, min_delta_ms=2.0)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(regressions[0].startswith('cart_view[auth]: queries'))
+        self.assertIn('p95', regressions[1])
+        self.assertIn('HTTP 500', regressions[2])
@@ -1,18 +1,24 @@
 # store/urls.py
 
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'store'
 
+# The catalogue, cart and gateway views run as coroutines when ASYNC_VIEWS is on (serve with ASGI then)
+shop = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     # Basic Views
-    path('', views.home, name='home'),
-    path('cart/', views.cart_view, name='cart'),
+    path('', shop.home, name='home'),
+    path('cart/', shop.cart_view, name='cart'),
     
     
      # AJAX ENDPOINT: Uses the newly renamed function (if you renamed it to updateCartAjax)
-    path('update_item/', views.updateCartAjax, name='update_item'), 
+    path('update_item/', shop.updateCartAjax, name='update_item'), 
+    # BULK AJAX ENDPOINT: Sets several quantities in one transaction
+    path('update_items/', shop.updateCartBulkAjax, name='update_items'),
     
     # QUANTITY UPDATE FORM: Uses the new function
     path('update_cart/<int:product_id>/', views.updateCartPage, name='update_cart'),
@@ -21,7 +27,7 @@ urlpatterns = [
     path('remove_from_cart/<int:product_id>/', views.updateCartPage, name='remove_from_cart'),
 
     # Product Detail 
-    path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('product/<int:product_id>/', shop.product_detail, name='product_detail'),
 
     # Checkout & Payment Integration
     path('checkout/', views.checkout_view, name='checkout'), 
@@ -29,7 +35,7 @@ urlpatterns = [
     path('initiate_payment/', views.initiate_payment, name='initiate_payment'),
     
     # 2. Online Payment Processor endpoint (Razorpay/Payment Gateway)
-    path('process_razorpay_payment/', views.process_razorpay_payment, name='process_razorpay_payment'),
+    path('process_razorpay_payment/', shop.process_razorpay_payment, name='process_razorpay_payment'),
     
     # 3. Finalize COD Order endpoint
     path('finalize_cod_order/', views.finalize_cod_order, name='finalize_cod_order'),
@@ -37,9 +43,16 @@ urlpatterns = [
     # 4. Payment Success/Verification endpoint (Razorpay sends data here)
     path('payment_success/', views.payment_success, name='payment_success'),
 
+    # Razorpay webhooks: stored as received, applied by process_payment_events
+    path('payments/razorpay/webhook/', views.razorpay_webhook, name='razorpay_webhook'),
+
     # 5. Final Confirmation Page (Common success page for all orders)
     path('order_complete/', views.order_complete, name='order_complete'),
 
+    # Order history
+    path('orders/', views.view_orders, name='view_orders'),
+    path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
+
     # --- END E-COMMERCE WORKFLOW ---
     
     # Authentication
@@ -48,7 +61,14 @@ urlpatterns = [
     path('logout/', views.logout_user, name='logout'),
     
     # Filtering
-    path('category/<slug:category_slug>/', views.home, name='category_filter'),
+    path('category/<slug:category_slug>/', shop.home, name='category_filter'),
+
+    # Infinite scroll: next page of product cards (HTML fragment or JSON)
+    path('products/cards/', views.product_cards, name='product_cards'),
+
+    # Search
+    path('search/', views.search_view, name='search'),
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
 
     # Static Pages
     # The 'about' URL definition which the template was looking for
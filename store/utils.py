@@ -1,87 +1,143 @@
 # store/utils.py
-import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 # Assuming these are your models
 from .models import Product, Order, OrderItem, Customer 
+from .guest_cart import read_cart
+
+# In-process cache of products seen in guest carts: {product_id: (expires_at, product)}
+_cart_product_cache = {}
+
+
+def get_cart_products(product_ids):
+    """
+    Returns {product_id: Product} for the given IDs using a single query.
+
+    When settings.CART_PRODUCT_CACHE_TTL is set, products are kept in an
+    in-process cache for that many seconds so repeated guest page views
+    don't hit the database. IDs that no longer exist are simply left out.
+    """
+    ttl = getattr(settings, 'CART_PRODUCT_CACHE_TTL', 0)
+    now = time.monotonic()
+    products = {}
+    missing = []
+
+    for product_id in product_ids:
+        entry = _cart_product_cache.get(product_id) if ttl else None
+        if entry and entry[0] > now:
+            products[product_id] = entry[1]
+        else:
+            missing.append(product_id)
+
+    if missing:
+        fetched = Product.objects.in_bulk(missing)
+        products.update(fetched)
+        if ttl:
+            for product_id, product in fetched.items():
+                _cart_product_cache[product_id] = (now + ttl, product)
+
+    return products
+
+
+def forget_cart_product(product_id):
+    """Drops a product from the in-process guest cart cache (called when it changes)."""
+    _cart_product_cache.pop(product_id, None)
+
 
 def cookie_cart(request):
     """
     Handles fetching cart data for an anonymous (guest) user from browser cookies.
     """
-    try:
-        # Load the cart cookie, which is stored as a JSON string
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        # If cookie doesn't exist or is invalid, initialize an empty cart
-        cart = {}
-    
     items = []
     order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
-    cart_items_count = order['get_cart_items']
 
-    # Note: cart.items() returns (product_id_string, quantity)
-    for product_id, quantity in cart.items():
-        try:
-            # The cookie stores product IDs as strings, so convert back to int
-            product = Product.objects.get(id=int(product_id)) 
-            
-            # Calculate item total
-            total = (product.price * quantity)
-            
-            # Update order totals
-            order['get_cart_total'] += total
-            order['get_cart_items'] += quantity
-            cart_items_count = order['get_cart_items']
-            
-            # Check if shipping is required
-            if product.digital == False:
-                order['shipping'] = True
-
-            # Structure the item data
-            item = {
-                'product': product,
-                'quantity': quantity,
-                'get_total': total,
-                'product_id': product.id,
-            }
-            items.append(item)
-            
-        except Product.DoesNotExist:
-            print(f"DEBUG: Product ID {product_id} is in cookie but NOT in database!")
-            
-            # Optionally log this, but passing is common for guest carts
-            pass
+    # {product_id: quantity} from the signed cookie (or a legacy JSON one), parsed once per request
+    quantities = read_cart(request)
+
+    # One query for the whole cart; stale IDs (deleted products) are dropped silently
+    products = get_cart_products(quantities)
+
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+
+        # Calculate item total
+        total = (product.price * quantity)
+        
+        # Update order totals
+        order['get_cart_total'] += total
+        order['get_cart_items'] += quantity
+        
+        # Check if shipping is required
+        if not product.digital:
+            order['shipping'] = True
+
+        # Structure the item data
+        item = {
+            'product': product,
+            'quantity': quantity,
+            'get_total': total,
+            'product_id': product.id,
+        }
+        items.append(item)
             
-    return {'cart_items_count': cart_items_count, 'order': order, 'items': items, 'customer': None} # Added customer: None for consistency
+    return {'cart_items_count': order['get_cart_items'], 'order': order, 'items': items, 'customer': None} # Added customer: None for consistency
+
+
+def get_customer(user):
+    """
+    Returns the Customer profile for a logged-in user, creating it if it is missing.
+    """
+    try:
+        return user.customer
+    except ObjectDoesNotExist:
+        # A logged-in User may not have a Customer profile yet (e.g. created via admin)
+        return Customer.objects.create(
+            user=user,
+            name=user.username,
+            email=user.email
+        )
+
+
+def get_open_order(user):
+    """
+    Returns (customer, order) for the user's open cart.
+
+    The customer is loaded together with the order in a single query; the
+    slower get_or_create path only runs the first time a cart is needed.
+    """
+    order = (
+        Order.objects.select_related('customer')
+        .filter(customer__user=user, complete=False)
+        .first()
+    )
+    if order is not None:
+        return order.customer, order
+
+    customer = get_customer(user)
+    order, created = Order.objects.get_or_create(customer=customer, complete=False)
+    return customer, order
 
 
 def cart_data(request):
     """
     Determines the user type and returns the correct cart data structure.
-    
-    FIX: Uses try/except to handle cases where a logged-in User has no 
-    associated Customer profile, preventing RelatedObjectDoesNotExist.
+
+    The result is memoized on the request, so the context processor and the
+    views share a single cart lookup per request. Call clear_cart_cache()
+    after changing the cart if the same request needs to read it again.
     """
+    cached = getattr(request, '_cart_data', None)
+    if cached is not None:
+        return cached
+
     if request.user.is_authenticated:
         # LOGGED-IN USER: Get cart data from the database
-        user = request.user
-        
-        try:
-            # Attempt to retrieve the customer profile
-            customer = user.customer 
-            
-        except ObjectDoesNotExist:
-            # If the customer profile is missing, create it automatically.
-            # IMPORTANT: Ensure the fields (user, name, email) match your Customer model
-            customer = Customer.objects.create(
-                user=user, 
-                name=user.username,
-                email=user.email
-            )
-
-        # Proceed with fetching or creating the Order, now that 'customer' is guaranteed to exist
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
+        customer, order = get_open_order(request.user)
+        items = OrderItem.objects.for_order(order)
         cart_items_count = order.get_cart_items
         
     else:
@@ -91,5 +147,53 @@ def cart_data(request):
         order = cookie_data['order']
         items = cookie_data['items']
         customer = cookie_data['customer'] # Will be None from cookie_cart
-        
-    return {'cart_items_count': cart_items_count, 'order': order, 'items': items, 'customer': customer}
+
+    request._cart_data = {'cart_items_count': cart_items_count, 'order': order, 'items': items, 'customer': customer}
+    return request._cart_data
+
+
+async def aget_open_order(user):
+    """get_open_order() for async views."""
+    order = await (
+        Order.objects.select_related('customer')
+        .filter(customer__user=user, complete=False)
+        .afirst()
+    )
+    if order is not None:
+        return order.customer, order
+
+    customer = await sync_to_async(get_customer)(user)
+    order, created = await Order.objects.aget_or_create(customer=customer, complete=False)
+    return customer, order
+
+
+async def acart_data(request):
+    """
+    cart_data() for async views. Memoized on the request in the same place, so
+    the (sync) context processors rendering the page reuse it.
+    """
+    cached = getattr(request, '_cart_data', None)
+    if cached is not None:
+        return cached
+
+    user = await request.auser()
+    if user.is_authenticated:
+        customer, order = await aget_open_order(user)
+        # Left unevaluated like cart_data()'s: templates read it while rendering, the cart API never does
+        items = OrderItem.objects.for_order(order)
+        cart_items_count = order.get_cart_items
+    else:
+        # The guest cart is parsed from the cookie; its product lookup is shared with the sync path
+        cookie_data = await sync_to_async(cookie_cart)(request)
+        cart_items_count = cookie_data['cart_items_count']
+        order = cookie_data['order']
+        items = cookie_data['items']
+        customer = cookie_data['customer']
+
+    request._cart_data = {'cart_items_count': cart_items_count, 'order': order, 'items': items, 'customer': customer}
+    return request._cart_data
+
+
+def clear_cart_cache(request):
+    """Drops the memoized cart so the next cart_data() call reloads it."""
+    request.__dict__.pop('_cart_data', None)
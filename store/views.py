@@ -1,78 +1,191 @@
 # store/views.py
 
+import hashlib
 import json
-import razorpay
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Prefetch
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.conf import settings
 from decimal import Decimal
 # Import all necessary models
 from .models import Product, Order, OrderItem, Category, Customer # Assuming Customer is imported here
-from .utils import cart_data 
+from .pagination import ORDER_HISTORY, SORT_LABELS, get_sort, keyset_page
+from . import cart, facets, guest_cart, payment_events, payments, search, suggestions
+from .catalogue_cache import cached_catalogue
+from .routers import read_alias
+from .utils import cart_data, clear_cart_cache, get_customer, get_open_order
 
 
-# Initialize Razorpay client (Keep this at the module level)
-razorpay_client = razorpay.Client(
-    auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
-)
+def catalogue_request(request, category_slug=None):
+    """
+    Returns (queryset, sort, after, filters, cache key parts) for the catalogue
+    page the query string asks for, shared by the sync and async listings.
+    """
+    sort = get_sort(request.GET.get('sort'))
+    after = request.GET.get('after') or ''
+    filters = facets.parse_filters(request.GET)
+
+    products = facets.apply_filters(Product.objects.select_related('category'), filters)
+    if category_slug:
+        products = products.filter(category__slug=category_slug)
+
+    filter_key = ','.join(f'{name}={filters[name]}' for name in sorted(filters))
+    parts = ('page', category_slug or '', filter_key, sort, after)
+    return products, sort, after, filters, parts
+
+
+def catalogue_page(request, category_slug=None):
+    """
+    Returns (products, next_cursor, sort, filters) for one keyset-paginated page
+    of the catalogue, optionally narrowed by category and the facet filters in
+    the query string. Pages are served from the catalogue cache, keyed by
+    category, filters, sort and cursor.
+    """
+    queryset, sort, after, filters, parts = catalogue_request(request, category_slug)
+    products, next_cursor = cached_catalogue(parts, lambda: keyset_page(queryset, sort, after))
+    return products, next_cursor, sort, filters
+
+
+def listing_query(sort, filters):
+    """The sort + filter part of a listing URL, for links that must keep them."""
+    return urlencode({'sort': sort, **filters})
+
+
+# Product Features (static data)
+FEATURES = [
+    {"icon": "bi-lightning-charge", "title": "Fast Delivery", "description": "Get your order in 3-5 business days."},
+    {"icon": "bi-shield-check", "title": "Secure Payments", "description": "100% secure payment gateway with SSL."},
+    {"icon": "bi-arrow-repeat", "title": "Easy Returns", "description": "30-day no-hassle return policy."},
+]
+
+
+def home_context(request, category_slug, page, categories, cube, suggested_products, data):
+    """
+    The index.html context from already-loaded parts, so the sync and async
+    home views render the same page. `page` is what catalogue_page() returns.
+    """
+    products, next_cursor, sort, filters = page
+
+    # Facet counts come from the cached facet cube, never from per-request COUNT(*)s
+    selected_category = next((c for c in categories if c.slug == category_slug), None)
+    counts = facets.facet_counts(selected_category.id if selected_category else None, filters, cube)
+    category_counts = counts['categories']
+
+    return {
+        'products': products,
+        'next_cursor': next_cursor,
+        'sort': sort,
+        'sort_options': SORT_LABELS,
+        'after': request.GET.get('after') or '',
+        'filters': filters,
+        'listing_query': listing_query(sort, filters),
+        'facet_options': facets.facet_options(counts, filters, sort),
+        'product_count': sum(category_counts.values()),
+        'result_count': counts['total'],
+        'categories': [(category, category_counts.get(category.id, 0)) for category in categories],
+        'selected_category_slug': category_slug,
+        'carousel_products': products[:3],
+        'suggested_products': suggested_products,
+        'features': FEATURES,
+        # Data sourced from the cart_data utility
+        'customer': data['customer'],
+        'cart_items_count': data['cart_items_count'],
+    }
 
 
 def home(request, category_slug=None):
     
     # 1. Get ALL necessary data from the utility function.
     data = cart_data(request)
-    customer = data['customer']
-    cart_items_count = data['cart_items_count']
     
-    # Existing product/category logic
-    try:
-        products = Product.objects.all()
-        categories = Category.objects.all()
-    except Exception: # Use a general catch for model import/DB errors during development
-        products = []
-        categories = []
-    
-    selected_category_slug = None
-    if category_slug:
-        selected_category_slug = category_slug
-        # Filter the queryset if a category slug is provided
-        products = products.filter(category__slug=category_slug)
-    
-    # Products for Carousel (e.g., first 3 products)
-    carousel_products = products[:3]
+    # 2. One page of products; later pages are loaded through the product_cards fragment
+    page = catalogue_page(request, category_slug)
+    categories = cached_catalogue(('categories',), lambda: list(Category.objects.all()))
     
     # Products for Suggested/Featured Section (e.g., last 4 products)
     suggested_products = Product.objects.order_by('-id')[:4]
     
-    # Product Features (static data)
-    features = [
-        {"icon": "bi-lightning-charge", "title": "Fast Delivery", "description": "Get your order in 3-5 business days."},
-        {"icon": "bi-shield-check", "title": "Secure Payments", "description": "100% secure payment gateway with SSL."},
-        {"icon": "bi-arrow-repeat", "title": "Easy Returns", "description": "30-day no-hassle return policy."},
-    ]
-    
     # IMPORTANT: Removed ALL TeamMember/Testimonial queries from 'home' view
     # to eliminate the likely source of the persistent ValueError.
     
+    context = home_context(request, category_slug, page, categories, facets.facet_cube(), suggested_products, data)
+    return render(request, 'store/index.html', context)
+
+
+def product_cards(request):
+    """
+    Infinite-scroll endpoint: renders the next page of product cards.
+
+    Returns the partials/product_cards.html fragment with the next cursor in the
+    X-Next-Cursor header (HTMX-friendly), or JSON when ?format=json is given.
+    """
+    products, next_cursor, sort, filters = catalogue_page(request, request.GET.get('category') or None)
+    html = render_to_string('store/partials/product_cards.html', {'products': products}, request=request)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+    response = HttpResponse(html)
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    return response
+
+
+SEARCH_MIN_LENGTH = 2
+AUTOCOMPLETE_MAX_AGE = 60
+
+
+def search_view(request):
+    """
+    Ranked product search over product and category names (see store/search.py).
+    Result pages are cached with the rest of the catalogue.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    products, has_next = [], False
+    terms = ' '.join(search.terms(query))
+    if len(terms) >= SEARCH_MIN_LENGTH:
+        products, has_next = cached_catalogue(
+            ('search', terms, page), lambda: search.search_products(terms, page)
+        )
+
     context = {
+        'query': query,
         'products': products,
-        'categories': categories,
-        'selected_category_slug': selected_category_slug,
-        'carousel_products': carousel_products,
-        'suggested_products': suggested_products,
-        'features': features,
-        # 'team_members': team_members, # Removed
-        # 'testimonials': testimonials, # Removed
-        
-        # Data sourced from the cart_data utility
-        'customer': customer,
-        'cart_items_count': cart_items_count,
+        'page': page,
+        'has_next': has_next,
     }
-    return render(request, 'store/index.html', context)
+    return render(request, 'store/search.html', context)
+
+
+def search_autocomplete(request):
+    """Search box suggestions as JSON: {"results": [{id, name, category, url}, ...]}."""
+    terms = ' '.join(search.terms(request.GET.get('q', '')))
+    results = []
+    if len(terms) >= SEARCH_MIN_LENGTH:
+        results = cached_catalogue(('autocomplete', terms), lambda: search.autocomplete(terms))
+
+    response = JsonResponse({
+        'results': [
+            dict(row, url=reverse('store:product_detail', args=[row['id']])) for row in results
+        ],
+    })
+    # Suggestions are the same for everyone, so browsers and proxies may reuse them briefly
+    patch_cache_control(response, public=True, max_age=AUTOCOMPLETE_MAX_AGE)
+    return response
 
 
 # --- ABOUT US VIEW ---
@@ -96,18 +209,10 @@ def contact(request):
 # store/views.py
 
 def cart_view(request):
-    # Assuming you have a function/utility to get cart data
-    # (This is often where the guest/authenticated logic lives)
-    
-    if request.user.is_authenticated:
-        customer = request.user.customer
-        # Ensure 'complete=False' correctly fetches the current active cart
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all() # Fetching all items related to the order
-    else:
-        # Handle cookie/guest session data (often results in an empty or dummy order/items)
-        order = {'get_cart_total': 0, 'get_cart_items': 0} # Dummy data if needed
-        items = []
+    # The request-scoped cart: the DB order for customers, the cookie cart for guests
+    data = cart_data(request)
+    order = data['order']
+    items = data['items']
 
     context = {
         'items': items,
@@ -127,10 +232,11 @@ def checkout_view(request):
     # This logic should mirror the part of cart_view that fetches the order
 
     if request.user.is_authenticated:
-        customer = request.user.customer
-        # 1. Fetch the active Order object
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
+        # 1. Fetch the active Order object from the request-scoped cart
+        data = cart_data(request)
+        customer = data['customer']
+        order = data['order']
+        items = data['items']
     else:
         # Redirect guests to login/cart if guest checkout is not implemented
         return redirect('store:login') # Or 'store:cart' with an error message
@@ -155,14 +261,16 @@ def checkout_view(request):
             # We print the message you saw, but we MUST redirect here.
             return redirect('store:checkout') # Rerender the page and force user to enter data
 
-        # 3. Save the Shipping Address (Assuming a ShippingAddress model)
-        # Note: You need to create or update a ShippingAddress instance here
+        # 3. Save the Shipping Address on the order being placed, so it stays with the
+        #    order (order_detail, exports) when the customer later checks out another one
         shipping_address, created = ShippingAddress.objects.update_or_create(
              customer=customer,
+             order=order,
              defaults={
                  'name': full_name,
                  'email': email,
                  'address': address_line_1,
+                 'address2': address_line_2,
                  'city': city,
                  'state': state,
                  'zipcode': zipcode,
@@ -187,12 +295,158 @@ def checkout_view(request):
         }
         return render(request, 'store/checkout.html', context)
     
-# --- NEW NAME FOR AJAX VIEW ---
+# --- CART JSON API ---
+# Actions accepted by updateCartAjax: 'add' increments by `quantity` (default 1),
+# 'set' replaces the quantity, 'remove' deletes the line.
+CART_ACTIONS = ('add', 'set', 'remove')
+
+
+def money(value):
+    """Formats an amount for JSON with exactly two decimal places."""
+    return str(Decimal(value or 0).quantize(Decimal('0.01')))
+
+
+def cart_json(order, product=None):
+    """The cart totals (and optionally one line) returned by the cart API."""
+    data = {
+        'cart': {
+            'item_count': order.item_count,
+            'subtotal': money(order.subtotal),
+            'total': money(order.subtotal + SHIPPING_FEE),
+        },
+        # Kept for the navbar badge in cart.js
+        'cart_items': order.item_count,
+    }
+    if product is not None:
+        line = cart.get_line(order, product)
+        data['line'] = {
+            'product_id': product.id,
+            'quantity': line.quantity if line else 0,
+            'line_total': money(line.get_total if line else 0),
+        }
+    return data
+
+
+def parse_quantity(value, default):
+    if value is None:
+        return default
+    return int(value)
+
+
+def guest_quantity(current, action, quantity):
+    """The new quantity of a guest cart line after a cart API action."""
+    if action == 'add':
+        return current + quantity
+    if action == 'set':
+        return quantity
+    return 0
+
+
+def guest_cart_response(request, quantities, product=None, lines=False):
+    """
+    Stores an updated guest cart and answers like the cart API does for
+    customers; the totals come from the cookie cart (see utils.cookie_cart).
+    """
+    try:
+        guest_cart.set_cart(request, quantities)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    clear_cart_cache(request)
+    data = cart_data(request)
+    subtotal = data['order']['get_cart_total']
+    body = {
+        'cart': {
+            'item_count': data['cart_items_count'],
+            'subtotal': money(subtotal),
+            'total': money(subtotal + SHIPPING_FEE),
+        },
+        'cart_items': data['cart_items_count'],
+    }
+    items = {item['product_id']: item for item in data['items']}
+    if product is not None:
+        item = items.get(product.id)
+        body['line'] = {
+            'product_id': product.id,
+            'quantity': item['quantity'] if item else 0,
+            'line_total': money(item['get_total'] if item else 0),
+        }
+    if lines:
+        body['lines'] = [
+            {'product_id': item['product_id'], 'quantity': item['quantity'], 'line_total': money(item['get_total'])}
+            for item in items.values()
+        ]
+    response = JsonResponse(body)
+    guest_cart.write_cookie(request, response)
+    return response
+
+
+@require_POST
 def updateCartAjax(request):
-    # ... KEEP ALL YOUR EXISTING LOGIC AS IS ...
-    # This view still expects POST data via request.body
-    # It does NOT accept product_id from the URL.
-    pass
+    """
+    Changes one cart line from a JSON body {"productId", "action", "quantity"}
+    and returns the new line and cart totals. A guest's cart is kept in the
+    signed cart cookie (see guest_cart.py).
+    """
+    try:
+        payload = json.loads(request.body)
+        action = payload['action']
+        product_id = int(payload['productId'])
+        quantity = parse_quantity(payload.get('quantity'), 1)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid cart update.'}, status=400)
+    if action not in CART_ACTIONS:
+        return JsonResponse({'error': f'Unknown action {action!r}.'}, status=400)
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return JsonResponse({'error': 'Product not found.'}, status=404)
+
+    if not request.user.is_authenticated:
+        quantities = dict(guest_cart.read_cart(request))
+        quantities[product.id] = guest_quantity(quantities.get(product.id, 0), action, quantity)
+        return guest_cart_response(request, quantities, product)
+
+    order = cart_data(request)['order']
+    if action == 'add':
+        cart.add_item(order, product, quantity)
+    elif action == 'set':
+        cart.set_quantity(order, product, quantity)
+    else:
+        cart.remove_item(order, product)
+
+    return JsonResponse(cart_json(order, product))
+
+
+@require_POST
+def updateCartBulkAjax(request):
+    """
+    Sets several quantities at once from {"items": [{"productId", "quantity"}, ...]}
+    in a single transaction; a quantity of 0 removes the line.
+    """
+    try:
+        rows = json.loads(request.body)['items']
+        requested = {int(row['productId']): int(row['quantity']) for row in rows}
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid cart update.'}, status=400)
+
+    products = Product.objects.in_bulk(list(requested))
+    missing = sorted(set(requested) - set(products))
+    if missing:
+        return JsonResponse({'error': 'Product not found.', 'product_ids': missing}, status=404)
+
+    if not request.user.is_authenticated:
+        return guest_cart_response(request, {**guest_cart.read_cart(request), **requested}, lines=True)
+
+    order = cart_data(request)['order']
+    cart.bulk_update(order, {products[pk]: quantity for pk, quantity in requested.items()})
+
+    data = cart_json(order)
+    data['lines'] = [
+        {'product_id': item.product_id, 'quantity': item.quantity, 'line_total': money(item.get_total)}
+        for item in OrderItem.objects.for_order(order)
+    ]
+    return JsonResponse(data)
+
 
 def updateCartPage(request, product_id):
     """
@@ -204,60 +458,62 @@ def updateCartPage(request, product_id):
     # 2. Identify the customer (either authenticated or guest cookie logic)
     # This logic should be similar to what you use in your cart_data utility
     if request.user.is_authenticated:
-        customer = request.user.customer
         # Get the open order for this customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
+        order = cart_data(request)['order']
     else:
         # Placeholder: If not logged in, you need to handle session/cookie logic here
         # For a GET request (like 'Remove'), this is complex. We focus on authenticated first.
         return redirect('store:cart') 
 
-    # 3. Find the specific item in the order
-    try:
-        orderItem = OrderItem.objects.get(order=order, product=product)
-    except OrderItem.DoesNotExist:
-        # Item wasn't in the cart, just redirect
-        return redirect('store:cart')
-
-    # --- MAIN LOGIC ---
+    # --- MAIN LOGIC (atomic, see cart.py) ---
     
     if request.method == 'POST':
         # Handles the quantity update form (NOT the 'Remove' link)
         try:
             quantity = int(request.POST.get('quantity', 0))
         except ValueError:
-            quantity = orderItem.quantity # Safety fallback
-        
-        if quantity > 0:
-            orderItem.quantity = quantity
-            orderItem.save()
-        else:
-            orderItem.delete()
+            return redirect('store:cart') # Leave the line unchanged
+        cart.set_quantity(order, product, quantity)
             
     # The 'Remove' link is a GET request and runs this block
     else: 
         # Action for the removal link: simply delete the item
-        orderItem.delete()
+        cart.remove_item(order, product)
         
     return redirect('store:cart')
 
 # --- PRODUCT DETAIL VIEW ---
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, pk=product_id)
-    
-    suggested_products = Product.objects.filter(
-        category=product.category
-    ).exclude(pk=product_id).order_by('?')[:4]
-    
-    context = {
-        'product': product,
-        'suggested_products': suggested_products
-    }
+    # The product and its suggestions are the same for every visitor, so they are cached together
+    def build_detail():
+        product = Product.objects.select_related('category').filter(pk=product_id).first()
+        if product is None:
+            return None
+        return {'product': product, 'suggested_products': suggestions.suggested_products(product)}
+
+    context = cached_catalogue(('product', product_id), build_detail)
+    if context is None:
+        raise Http404('No Product matches the given query.')
     return render(request, 'store/product_detail.html', context)
 
 
 # --- USER AUTH VIEWS ---
 
+def merge_guest_cart(request, response):
+    """
+    Moves the cart a guest built up into their account's open order after
+    login, in one transaction, and clears the cart cookie on `response`.
+    """
+    quantities = guest_cart.read_cart(request)
+    if quantities:
+        _, order = get_open_order(request.user)
+        cart.merge(order, quantities)
+        guest_cart.set_cart(request, {})
+        clear_cart_cache(request)
+    guest_cart.write_cookie(request, response)
+    return response
+
+
 def register_user(request):
     """Handles user registration."""
     if request.method == 'POST':
@@ -265,7 +521,7 @@ def register_user(request):
         if form.is_valid():
             user = form.save()
             login(request, user)
-            return redirect('store:home') 
+            return merge_guest_cart(request, redirect('store:home'))
     else:
         form = UserCreationForm()
     
@@ -279,7 +535,7 @@ def login_user(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
-            return redirect('store:home')
+            return merge_guest_cart(request, redirect('store:home'))
     else:
         form = AuthenticationForm()
         
@@ -307,15 +563,16 @@ from django.contrib import messages
 import time # Used in finalize_cod_order
 from django.shortcuts import render, redirect
 from django.http import JsonResponse, HttpResponse # Use HttpResponse for the response you showed
-SHIPPING_FEE = Decimal('10.00')
+from .payments import SHIPPING_FEE, amount_in_paise
 # Ensure Razorpay/payment library is imported if needed
 def get_current_order(request):
     if not request.user.is_authenticated:
         return None, None
-    customer = request.user.customer
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
+    data = cart_data(request)
+    customer = data['customer']
+    order = data['order']
     # Ensure the order has a linked shipping address for the confirmation page
-    shipping_address = ShippingAddress.objects.filter(customer=customer).order_by('-date_added').first()
+    shipping_address = ShippingAddress.objects.filter(customer=customer, order=order).order_by('-date_added').first()
     return order, shipping_address
 
 
@@ -346,6 +603,7 @@ def initiate_payment(request):
     
     context = {
         'order': order,
+        'items': OrderItem.objects.for_order(order),
         'shipping_address': shipping_address,
         'payment_method': payment_method,
     }
@@ -382,104 +640,119 @@ def finalize_cod_order(request):
 
 
 # --- 3. process_razorpay_payment (Razorpay Setup Path) ---
+def payment_gateway_context(order, shipping_address, razorpay_order_id, amount):
+    return {
+        'order': order,
+        'razorpay_order_id': razorpay_order_id,
+        'amount': amount,
+        'total': Decimal(amount) / 100,
+        'key_id': settings.RAZORPAY_KEY_ID, # Pass your public key
+        'customer_name': shipping_address.name,
+        'customer_email': shipping_address.email,
+    }
+
+
+def payment_setup_failed(request, exc):
+    if isinstance(exc, payments.GatewayUnavailable):
+        messages.error(request, "The payment gateway is not responding. Please try again in a moment.")
+    else:
+        messages.error(request, "Payment setup failed. Please choose another payment method.")
+    return redirect('store:initiate_payment')
+
+
 def process_razorpay_payment(request):
     """
     Creates the Razorpay Order and renders the payment gateway page to launch the modal.
     """
     order, shipping_address = get_current_order(request)
     
-    if not order:
+    if not order or not shipping_address:
         messages.error(request, "Order not found.")
         return redirect('store:checkout')
 
-    # Calculate total including shipping
-    amount_due = order.get_total_with_shipping() # Assuming this method exists
-    amount_in_paise = int(amount_due * 100) # Razorpay requires amount in smallest unit
-
-    # --- RAZORPAY API CALL (MOCK/EXAMPLE) ---
-    # This requires the actual Razorpay client setup and API keys
-    # try:
-    #     razorpay_order = RAZORPAY_CLIENT.order.create({
-    #         'amount': amount_in_paise, 
-    #         'currency': 'INR',
-    #         'payment_capture': '1'
-    #     })
-    #     order.razorpay_order_id = razorpay_order['id']
-    #     order.save()
-    # except Exception as e:
-    #     messages.error(request, f"Payment setup failed: {e}")
-    #     return redirect('store:checkout')
-
-    # --- MOCK RAZORPAY DATA FOR DESIGN TESTING ---
-    mock_razorpay_order_id = 'order_xxxxxx'
-    
-    context = {
-        'order': order,
-        'razorpay_order_id': mock_razorpay_order_id, # Use the real ID here
-        'amount': amount_in_paise,
-        'key_id': settings.RAZORPAY_KEY_ID, # Pass your public key
-        'customer_name': shipping_address.name,
-        'customer_email': shipping_address.email,
-    }
+    # Pooled, timeout-bounded and idempotent: reloading this page reuses the gateway order
+    amount = amount_in_paise(order)
+    try:
+        razorpay_order_id = payments.get_gateway().create_order(order, amount)
+    except payments.PaymentGatewayError as exc:
+        return payment_setup_failed(request, exc)
+
+    context = payment_gateway_context(order, shipping_address, razorpay_order_id, amount)
     return render(request, 'store/payment_gateway.html', context)
 
 
-# --- 4. payment_success (Razorpay Webhook/Callback) ---
+# --- 4. payment_success (Razorpay Callback) ---
 def payment_success(request):
     """
     Handles the success response from the Razorpay modal (client-side verification).
+    The signature proves the payment is genuine; the webhook (see razorpay_webhook)
+    finalizes the order too, whichever arrives first.
     """
     razorpay_payment_id = request.GET.get('razorpay_payment_id')
     razorpay_order_id = request.GET.get('razorpay_order_id')
     razorpay_signature = request.GET.get('razorpay_signature')
-    
-    # 1. Look up the order using the order ID
-    order = get_object_or_404(Order, razorpay_order_id=razorpay_order_id)
-    
+
+    if not request.user.is_authenticated:
+        return redirect('store:login')
+    if not (razorpay_payment_id and razorpay_order_id and razorpay_signature):
+        messages.error(request, "Payment details are missing. Please contact support.")
+        return redirect('store:initiate_payment')
+
+    # 1. Look up the shopper's order using the gateway order ID
+    order = get_object_or_404(Order, razorpay_order_id=razorpay_order_id, customer__user=request.user)
+
     # 2. Verify the payment signature (CRITICAL SECURITY STEP)
-    # try:
-    #     params_dict = {
-    #         'razorpay_order_id': razorpay_order_id,
-    #         'razorpay_payment_id': razorpay_payment_id,
-    #         'razorpay_signature': razorpay_signature
-    #     }
-    #     RAZORPAY_CLIENT.utility.verify_payment_signature(params_dict)
-
-    #     # Signature is valid. Mark the order as complete/paid.
-    #     order.complete = True
-    #     order.transaction_id = razorpay_payment_id
-    #     order.payment_method = 'Razorpay'
-    #     order.status = 'Paid'
-    #     order.save()
-    #     messages.success(request, "Payment successful! Your order is confirmed.")
-        
-    # except Exception as e:
-    #     # Signature verification failed or other error
-    #     messages.error(request, "Payment failed validation. Please contact support.")
-    #     order.status = 'Payment_Failed'
-    #     order.save()
+    gateway = payments.get_gateway()
+    if not gateway.verify_payment_signature(razorpay_order_id, razorpay_payment_id, razorpay_signature):
+        messages.error(request, "Payment failed validation. Please contact support.")
+        return redirect('store:initiate_payment')
+
+    # 3. Mark the order paid (a no-op if the webhook got there first), provided the
+    #    gateway order was for the current total
+    if not payment_events.mark_paid(order, razorpay_payment_id):
+        messages.error(request, "The amount paid does not match your order total. Please contact support.")
+        return redirect('store:initiate_payment')
 
-    # --- For Testing, assume success ---
-    order.complete = True
-    order.transaction_id = razorpay_payment_id or 'MOCK_RAZORPAY_ID'
-    order.payment_method = 'Razorpay'
-    order.status = 'Paid'
-    order.save()
-    
     # Redirect to the final confirmation page
     return redirect('store:order_complete')
 
 
+# --- Razorpay webhook ---
+@csrf_exempt
+@require_POST
+def razorpay_webhook(request):
+    """
+    Receives Razorpay webhooks: verifies the signature, stores the event and
+    acknowledges at once. Orders are updated by the process_payment_events worker.
+    """
+    if not payments.verify_webhook_signature(request.body, request.headers.get('X-Razorpay-Signature')):
+        return JsonResponse({'error': 'Invalid signature.'}, status=400)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'Invalid payload.'}, status=400)
+
+    # Redeliveries carry the same event id; fall back to the body for senders without one
+    event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(request.body).hexdigest()
+    payment_events.record_event(event_id[:64], payload)
+    return JsonResponse({'status': 'ok'})
+
+
 # --- 5. order_complete (Final Success Page) ---
 def order_complete(request):
     """
     Displays the final order confirmation page after successful payment or COD setup.
     """
-    # Get the last completed order for the customer
+    if not request.user.is_authenticated:
+        return redirect('store:login')
+
+    # Get the last completed order for the customer (the customer comes with the cached user)
     order = Order.objects.filter(
-        customer=request.user.customer, 
+        customer=get_customer(request.user),
         complete=True
-    ).order_by('-date_ordered').first()
+    ).order_by('-date_ordered', '-id').first()
     
     if not order:
         # If no completed order is found, redirect back to home
@@ -487,10 +760,65 @@ def order_complete(request):
         
     context = {
         'order': order,
+        'total': order.get_cart_total + SHIPPING_FEE,
         'payment_status': 'PAID' if order.payment_method != 'COD' else 'COD'
     }
     return render(request, 'store/order_complete.html', context)
 
+
+# --- Order history ---
+ORDERS_PER_PAGE = 10
+
+
+def customer_orders(request, alias):
+    """
+    The shopper's completed orders read from `alias`, each with its lines
+    (products and line totals included) prefetched in one query per page.
+    """
+    lines = OrderItem.objects.using(alias).with_totals()
+    return (
+        Order.objects.using(alias)
+        .filter(customer=get_customer(request.user), complete=True)
+        .prefetch_related(Prefetch('orderitem_set', queryset=lines, to_attr='lines'))
+    )
+
+
+def view_orders(request):
+    """
+    Lists the shopper's past orders, newest first, keyset-paginated on
+    (date_ordered, id): a page of a long history costs the same as the first.
+    Counts and totals come from the stored order totals, not from the lines.
+    """
+    if not request.user.is_authenticated:
+        return redirect('store:login')
+
+    after = request.GET.get('after') or ''
+    # Replica lag is fine here; a shopper who just paid is pinned to the primary
+    orders, next_cursor = keyset_page(
+        customer_orders(request, read_alias()), cursor=after, per_page=ORDERS_PER_PAGE, ordering=ORDER_HISTORY,
+    )
+    for order in orders:
+        order.total = order.subtotal + SHIPPING_FEE
+    context = {'orders': orders, 'next_cursor': next_cursor, 'after': after}
+    return render(request, 'store/orders.html', context)
+
+
+def order_detail(request, order_id):
+    """One of the shopper's past orders with its lines and shipping address."""
+    if not request.user.is_authenticated:
+        return redirect('store:login')
+
+    alias = read_alias()
+    order = get_object_or_404(customer_orders(request, alias), pk=order_id)
+    context = {
+        'order': order,
+        'total': order.subtotal + SHIPPING_FEE,
+        'shipping_fee': SHIPPING_FEE,
+        'shipping_address': ShippingAddress.objects.using(alias).filter(order=order).order_by('-date_added').first(),
+    }
+    return render(request, 'store/order_detail.html', context)
+
+
 def removeItem(request, product_id):
     """
     Handles removing an item from the cart.